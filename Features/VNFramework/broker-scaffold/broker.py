@@ -12,14 +12,20 @@ Architecture:
 
 from fastapi import FastAPI, HTTPException, Depends, Header
 from pydantic import BaseModel, Field, validator
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime, timedelta
 import httpx
 import jwt
+import yaml
 import hashlib
 import json
+import os
 from pathlib import Path
 
+import dict_engine
+from http_pool import configure_default_pool, close_default_pool
+from dictionary_registry import DictionaryRegistry
+
 app = FastAPI(title="VNF Broker", version="0.1.0")
 
 # ============================================================================
@@ -34,9 +40,50 @@ class BrokerConfig:
     VNF_CONNECT_TIMEOUT = 3
     VNF_READ_TIMEOUT = 10
     RETRY_ATTEMPTS = 2
-    DICTIONARY_PATH = Path("/etc/vnfbroker/dictionaries")
+    CONFIG_FILE = Path(os.environ.get("BROKER_CONFIG", "/etc/vnfbroker/broker.yaml"))
+    DICTIONARY_PATH = Path("/etc/vnfbroker/dictionaries")  # broker.yaml: dictionaries.path
+    DICTIONARY_AUTO_RELOAD = False  # broker.yaml: dictionaries.autoReload
+    DICTIONARY_POLL_SECONDS = 2.0  # broker.yaml: dictionaries.pollInterval (scan interval without watchfiles)
+    # Target appliance (broker.yaml: vnf); vendor is the dictionary's declared vendor
+    VNF_VENDOR = os.environ.get("VNF_VENDOR", "pfsense")
+    VNF_HOST = os.environ.get("VNF_HOST", "")
+    VNF_USERNAME = os.environ.get("VNF_USERNAME", "")
+    VNF_PASSWORD = os.environ.get("VNF_PASSWORD", "")
+    # Pooled vendor HTTP clients (broker.yaml: httpPool)
+    HTTP_POOL = {
+        "maxConnections": 20,
+        "maxKeepaliveConnections": 10,
+        "keepaliveExpiry": 30,
+        "idleTimeout": 300,
+        "http2": False,
+    }
+
+def load_broker_config(path: Path) -> BrokerConfig:
+    """
+    Defaults overlaid with the sections of broker.yaml the scaffold reads
+    
+    Args:
+        path: broker.yaml (a missing file leaves the defaults)
+        
+    Returns:
+        Configuration with httpPool, dictionaries and vnf.vendor applied
+    """
+    loaded = BrokerConfig()
+    if not path.is_file():
+        return loaded
+    settings = yaml.safe_load(path.read_text()) or {}
+    
+    loaded.HTTP_POOL = {**BrokerConfig.HTTP_POOL, **(settings.get("httpPool") or {})}
+    
+    dictionaries = settings.get("dictionaries") or {}
+    loaded.DICTIONARY_PATH = Path(dictionaries.get("path", BrokerConfig.DICTIONARY_PATH))
+    loaded.DICTIONARY_AUTO_RELOAD = bool(dictionaries.get("autoReload", BrokerConfig.DICTIONARY_AUTO_RELOAD))
+    loaded.DICTIONARY_POLL_SECONDS = float(dictionaries.get("pollInterval", BrokerConfig.DICTIONARY_POLL_SECONDS))
+    
+    loaded.VNF_VENDOR = (settings.get("vnf") or {}).get("vendor", BrokerConfig.VNF_VENDOR)
+    return loaded
     
-config = BrokerConfig()
+config = load_broker_config(BrokerConfig.CONFIG_FILE)
 
 # ============================================================================
 # Models (generated from JSON Schema contracts)
@@ -143,85 +190,137 @@ def verify_jwt(authorization: str = Header(...)) -> dict:
 class DictionaryEngine:
     """Translates abstract commands to vendor API calls"""
     
-    def __init__(self, vendor: str):
+    # Vendor error codes worth retrying (transient appliance-side conditions)
+    RETRYABLE_CODES = {"VNF_TIMEOUT", "VNF_UNREACHABLE", "VNF_CAPACITY", "VNF_RATE_LIMIT"}
+    
+    def __init__(self, vendor: str, dictionary: Optional[dict_engine.DictionaryEngine] = None,
+                 dictionary_version: int = 0):
         self.vendor = vendor
-        # In production: load from DICTIONARY_PATH / f"{vendor}.yaml"
-        # For now: hardcoded pfSense mapping
-        
-    async def execute_create_rule(self, cmd: CreateFirewallRuleCmd, trace_id: str) -> CreateFirewallRuleResponse:
-        """Execute createFirewallRule against vendor API"""
-        start_time = datetime.utcnow()
+        # Compiled vendor dictionary from the registry snapshot (None: vendor not loaded)
+        self.dictionary = dictionary
+        self.dictionary_version = dictionary_version
+    
+    def build_context(self, cmd: CreateFirewallRuleCmd, rule_id: str) -> Dict[str, Any]:
+        """Template variables for a createFirewallRule (appliance + rule fields)"""
+        def addressing(spec: Optional[AddressSpec]) -> str:
+            if spec is None:
+                return "any"
+            return spec.cidr or spec.alias or "any"
         
-        # Build vendor payload (simplified; real impl uses Jinja2 template)
-        vendor_payload = {
+        return {
+            "vnf_mgmt_ip": config.VNF_HOST,
+            "vnf_username": config.VNF_USERNAME,
+            "vnf_password": config.VNF_PASSWORD,
+            "ruleId": rule_id,
             "interface": cmd.interface,
             "direction": cmd.direction,
             "action": cmd.action,
-            "source": {"address": cmd.src.cidr if cmd.src and cmd.src.cidr else "any"},
-            "destination": {"address": cmd.dst.cidr if cmd.dst and cmd.dst.cidr else "any"},
             "protocol": cmd.protocol,
+            "sourceAddressing": addressing(cmd.src),
+            "destinationAddressing": addressing(cmd.dst),
+            "sourcePorts": cmd.ports.src if cmd.ports and cmd.ports.src else "any",
+            "destinationPorts": cmd.ports.dst if cmd.ports and cmd.ports.dst else "any",
+            "description": cmd.description or "VNF managed rule",
             "enabled": cmd.enabled,
             "log": cmd.log,
+            "priority": cmd.priority,
         }
-        if cmd.description:
-            vendor_payload["description"] = cmd.description
+    
+    def error_response(self, rule_id: str, code: str, message: str, trace_id: str) -> CreateFirewallRuleResponse:
+        """Failed createFirewallRule response"""
+        return CreateFirewallRuleResponse(
+            ok=False,
+            ruleId=rule_id,
+            appliedAt=datetime.utcnow().isoformat(),
+            error=ErrorDetail(
+                code=code,
+                message=message,
+                retryable=code in self.RETRYABLE_CODES,
+                traceId=trace_id
+            )
+        )
+        
+    async def execute_create_rule(self, cmd: CreateFirewallRuleCmd, trace_id: str) -> CreateFirewallRuleResponse:
+        """Execute createFirewallRule against vendor API (rendered and sent by the vendor dictionary)"""
+        start_time = datetime.utcnow()
+        rule_id = cmd.ruleId or f"rule-{trace_id}"
+        
+        if self.dictionary is None or "create_firewall_rule" not in self.dictionary.operations:
+            return self.error_response(
+                rule_id, "VNF_INVALID",
+                f"No dictionary with create_firewall_rule loaded for vendor '{self.vendor}'", trace_id)
         
-        # Call vendor API (mock for now)
         try:
-            async with httpx.AsyncClient(timeout=config.VNF_TIMEOUT_SECONDS) as client:
-                # Real: POST to https://{vnf_host}/api/v1/firewall/rules
-                # Mock success response:
-                vendor_response = {
-                    "status": "success",
-                    "data": {
-                        "rule_id": cmd.ruleId or "auto-gen-12345",
-                        "uuid": "pfsense-uuid-abc123"
-                    }
-                }
-                vendor_latency = 250  # ms
-                
+            result = await self.dictionary.execute_operation(
+                "create_firewall_rule", self.build_context(cmd, rule_id))
         except httpx.TimeoutException:
-            return CreateFirewallRuleResponse(
-                ok=False,
-                ruleId=cmd.ruleId or "unknown",
-                appliedAt=datetime.utcnow().isoformat(),
-                error=ErrorDetail(
-                    code="VNF_TIMEOUT",
-                    message=f"VNF did not respond within {config.VNF_TIMEOUT_SECONDS}s",
-                    retryable=True,
-                    traceId=trace_id
-                )
-            )
+            return self.error_response(
+                rule_id, "VNF_TIMEOUT",
+                f"VNF did not respond within {self.dictionary.timeout}s", trace_id)
+        except httpx.HTTPError as e:
+            return self.error_response(rule_id, "VNF_UNREACHABLE", f"VNF request failed: {e}", trace_id)
         
         # Map vendor response to standard response
         end_time = datetime.utcnow()
         latency_ms = int((end_time - start_time).total_seconds() * 1000)
         
+        if not result["success"]:
+            return self.error_response(
+                rule_id, result.get("error_code") or "VNF_UPSTREAM", result["message"], trace_id)
+        
         return CreateFirewallRuleResponse(
             ok=True,
-            ruleId=vendor_response["data"]["rule_id"],
-            vendorRef=vendor_response["data"]["uuid"],
+            ruleId=rule_id,
+            vendorRef=result["vendor_ref"],
             appliedAt=end_time.isoformat(),
             diagnostics=Diagnostics(
                 latencyMs=latency_ms,
-                retries=0,
-                vendorLatencyMs=vendor_latency
+                retries=0
             )
         )
 
+# Vendor dictionaries, compiled once and swapped in as whole snapshots on change
+dictionary_registry = DictionaryRegistry(config.DICTIONARY_PATH, poll_interval=config.DICTIONARY_POLL_SECONDS)
+
+# Engines of the current snapshot, by (snapshot version, vendor)
+_engines: Dict[Tuple[int, str], DictionaryEngine] = {}
+
+def get_dictionary_engine(vendor: str) -> DictionaryEngine:
+    """
+    Engine for vendor, bound to the current dictionary snapshot
+    
+    Built once per snapshot, not per request. A request keeps the engine (and
+    dictionary version) it started with, even if a reload swaps in a newer
+    snapshot while it runs.
+    """
+    snapshot = dictionary_registry.snapshot
+    key = (snapshot.version, vendor)
+    engine = _engines.get(key)
+    if engine is None:
+        for stale in [k for k in _engines if k[0] != snapshot.version]:
+            del _engines[stale]
+        try:
+            compiled = snapshot.engine(vendor)
+        except KeyError:
+            compiled = None
+        engine = _engines[key] = DictionaryEngine(vendor, compiled, dictionary_version=snapshot.version)
+    return engine
+
 # ============================================================================
 # REST Endpoints
 # ============================================================================
 @app.post("/v1/firewall/rules", response_model=CreateFirewallRuleResponse)
 async def create_firewall_rule(
     cmd: CreateFirewallRuleCmd,
-    claims: dict = Depends(verify_jwt)
+    claims: dict = Depends(verify_jwt),
+    x_vnf_vendor: Optional[str] = Header(None)
 ) -> CreateFirewallRuleResponse:
     """
     Create a firewall rule on the VNF appliance.
     
     - Requires JWT with scope 'vnf:rw'
     - Idempotent if ruleId is provided
+    - Vendor dictionary from the X-VNF-Vendor header (default: vnf.vendor)
     - Returns standard response with diagnostics
     """
     
@@ -238,7 +337,7 @@ async def create_firewall_rule(
     trace_id = hashlib.sha256(f"{datetime.utcnow().isoformat()}{cmd.ruleId}".encode()).hexdigest()[:16]
     
     # Execute via dictionary engine
-    engine = DictionaryEngine(vendor="pfsense")  # TODO: detect from config/header
+    engine = get_dictionary_engine(x_vnf_vendor or config.VNF_VENDOR)
     response = await engine.execute_create_rule(cmd, trace_id)
     
     # Store for idempotency
@@ -246,10 +345,28 @@ async def create_firewall_rule(
     
     return response
 
+@app.on_event("startup")
+async def startup():
+    """Create the shared vendor client pool and load the vendor dictionaries"""
+    configure_default_pool(config.HTTP_POOL)
+    await dictionary_registry.reload()
+    if config.DICTIONARY_AUTO_RELOAD:
+        dictionary_registry.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop the dictionary watcher and close pooled vendor connections"""
+    await dictionary_registry.stop()
+    await close_default_pool()
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
-    return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+    return {
+        "status": "healthy",
+        "dictionaries": dictionary_registry.get_stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
 
 @app.get("/v1/firewall/rules/{rule_id}")
 async def get_firewall_rule(rule_id: str, claims: dict = Depends(verify_jwt)):
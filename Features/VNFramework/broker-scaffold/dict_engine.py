@@ -5,33 +5,341 @@ Loads vendor YAML dictionaries and executes templated API calls
 import yaml
 import httpx
 import json
-from typing import Dict, Any, Optional
+import asyncio
+from typing import Dict, Any, Optional, List, Tuple
 from jinja2 import Template
 from jsonpath_ng import parse
 import logging
 
+from http_pool import VendorClientPool, get_default_pool
+from expression import CompiledExpression, Path, compile_expression, parse_path
+from response_extract import read_document
+
 logger = logging.getLogger(__name__)
 
 
+class TemplateCache:
+    """Compile-once cache for Jinja2 templates, JSONPath and success expressions"""
+    
+    def __init__(self):
+        self._templates: Dict[str, Template] = {}
+        self._jsonpaths: Dict[str, Any] = {}
+        self._expressions: Dict[str, CompiledExpression] = {}
+    
+    def template(self, source: str) -> Template:
+        """Get compiled Jinja2 template for source"""
+        compiled = self._templates.get(source)
+        if compiled is None:
+            compiled = self._templates[source] = Template(source)
+        return compiled
+    
+    def jsonpath(self, expr: str):
+        """Get parsed JSONPath expression"""
+        compiled = self._jsonpaths.get(expr)
+        if compiled is None:
+            compiled = self._jsonpaths[expr] = parse(expr)
+        return compiled
+    
+    def expression(self, expr: str) -> CompiledExpression:
+        """Get compiled success/condition expression"""
+        compiled = self._expressions.get(expr)
+        if compiled is None:
+            compiled = self._expressions[expr] = compile_expression(expr)
+        return compiled
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Distinct compiled objects (all compiled at load; requests only render)"""
+        return {
+            'templates': len(self._templates),
+            'jsonpaths': len(self._jsonpaths),
+            'expressions': len(self._expressions)
+        }
+
+
+class CompiledOperation:
+    """Operation definition with every template and expression pre-parsed"""
+    
+    def __init__(self, name: str, operation_def: Dict[str, Any], cache: TemplateCache):
+        response_mapping = operation_def.get('response_mapping', {})
+        
+        self.name = name
+        self.method = operation_def['method']
+        self.endpoint = cache.template(operation_def['endpoint'])
+        self.request_template = cache.template(operation_def.get('request_template', '{}'))
+        self.error_mapping = operation_def.get('error_mapping', {})
+        self.vendor_ref = None
+        if 'vendor_ref' in response_mapping:
+            self.vendor_ref = cache.jsonpath(response_mapping['vendor_ref'])
+        self.success_indicator = None
+        if 'success_indicator' in response_mapping:
+            self.success_indicator = cache.expression(response_mapping['success_indicator'])
+        self.list_path = None
+        if 'list_path' in response_mapping:
+            self.list_path = cache.jsonpath(response_mapping['list_path'])
+        self.response_paths = self._response_paths(response_mapping)
+    
+    def _response_paths(self, response_mapping: Dict[str, Any]) -> Optional[Tuple[Path, ...]]:
+        """Response paths the mappings read (None = the whole document is needed)"""
+        if self.list_path is not None:
+            return None
+        paths: List[Path] = []
+        if self.vendor_ref is not None:
+            vendor_ref = parse_path(response_mapping['vendor_ref'])
+            if vendor_ref is None:
+                # Wildcards, filters, recursive descent: evaluated on the full document
+                return None
+            paths.append(vendor_ref)
+        if self.success_indicator is not None:
+            paths.extend(self.success_indicator.paths)
+        return tuple(paths)
+
+
+class CompiledHook:
+    """Post-operation hook with pre-parsed endpoint and condition"""
+    
+    def __init__(self, hook: Dict[str, Any], cache: TemplateCache):
+        self.name = hook.get('name', hook['endpoint'])
+        self.method = hook['method']
+        self.endpoint = cache.template(hook['endpoint'])
+        self.ignore_errors = hook.get('ignore_errors', False)
+        self._cache = cache
+        self._applies: Dict[str, bool] = {}
+        
+        condition = hook.get('condition')
+        self.condition: Optional[CompiledExpression] = None
+        self.condition_template: Optional[Template] = None
+        if condition and ('{{' in condition or '{%' in condition):
+            # Legacy Jinja-rendered condition; compiled per rendered form
+            self.condition_template = cache.template(condition)
+        elif condition:
+            self.condition = cache.expression(condition)
+    
+    def applies_to(self, operation_name: str) -> bool:
+        """Evaluate the hook condition (memoized: it only depends on the operation)"""
+        applies = self._applies.get(operation_name)
+        if applies is None:
+            condition = self.condition
+            if self.condition_template is not None:
+                condition = self._cache.expression(
+                    self.condition_template.render(operation=operation_name))
+            applies = condition is None or bool(condition(None, {'operation': operation_name}))
+            self._applies[operation_name] = applies
+        return applies
+
+
+class _ApplianceQueue:
+    """Writes waiting to be flushed to one appliance"""
+    
+    def __init__(self):
+        self.pending: List[Tuple[str, Dict[str, Any], asyncio.Future]] = []
+        self.full = asyncio.Event()
+        self.flush_task: Optional[asyncio.Task] = None
+        self.flushes = 0  # flush tasks started and not yet finished
+        # Held while a batch runs, so batches reach the appliance in arrival order
+        self.commit_lock = asyncio.Lock()
+
+
+class WriteCoalescer:
+    """
+    Per-appliance write queue that merges changes into one vendor commit
+    
+    Operations for the same appliance that arrive within `window` seconds
+    (or until `max_batch` are queued) run in arrival order. Then each
+    post-operation hook that applies to any successful operation in the batch
+    fires once. Each caller still gets the result of its own operation.
+    """
+    
+    def __init__(self, engine: 'DictionaryEngine', window: float = 0.05, max_batch: int = 50):
+        """
+        Initialize coalescer
+        
+        Args:
+            engine: Dictionary engine that executes the operations and hooks
+            window: Seconds to wait for more writes after the first one arrives
+            max_batch: Flush immediately once this many writes are queued
+        """
+        self.engine = engine
+        self.window = window
+        self.max_batch = max_batch
+        self._queues: Dict[str, _ApplianceQueue] = {}
+        self.stats = {'operations': 0, 'batches': 0, 'commits': 0}
+    
+    async def submit(self, appliance: str, operation_name: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Queue an operation for appliance and wait for its result
+        
+        Args:
+            appliance: Appliance key (rendered API base URL)
+            operation_name: Name of operation
+            context: Context variables for templating
+            
+        Returns:
+            Response dictionary for this operation
+        """
+        queue = self._queues.get(appliance)
+        if queue is None:
+            queue = self._queues[appliance] = _ApplianceQueue()
+        
+        future = asyncio.get_running_loop().create_future()
+        queue.pending.append((operation_name, context, future))
+        self.stats['operations'] += 1
+        if queue.flush_task is None:
+            queue.flushes += 1
+            queue.flush_task = asyncio.create_task(self._flush(appliance, queue))
+        elif len(queue.pending) >= self.max_batch:
+            queue.full.set()
+        return await future
+    
+    async def _flush(self, appliance: str, queue: _ApplianceQueue):
+        """Collect writes for one window, then run them as a batch"""
+        try:
+            await asyncio.wait_for(queue.full.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        
+        batch, queue.pending = queue.pending, []
+        queue.full = asyncio.Event()
+        queue.flush_task = None
+        
+        try:
+            async with queue.commit_lock:
+                await self._run_batch(appliance, batch)
+        except Exception as e:
+            logger.error(f"Write batch for {appliance} failed: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            queue.flushes -= 1
+            if not queue.flushes:
+                self._queues.pop(appliance, None)
+    
+    async def _run_batch(self, appliance: str, batch: List[Tuple[str, Dict[str, Any], asyncio.Future]]):
+        self.stats['batches'] += 1
+        completed = []
+        for operation_name, context, future in batch:
+            if future.done():
+                # Caller went away before its write was sent
+                continue
+            try:
+                result = await self.engine._send_operation(operation_name, context)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            completed.append((operation_name, context, future, result))
+        
+        succeeded = [(name, context) for name, context, _, result in completed if result.get('success')]
+        hook_error = None
+        if succeeded:
+            try:
+                self.stats['commits'] += await self.engine._execute_batch_hooks(succeeded)
+            except Exception as e:
+                hook_error = e
+        
+        logger.info(f"Flushed {len(batch)} queued write(s) to {appliance} "
+                    f"({len(succeeded)} succeeded)")
+        
+        for operation_name, context, future, result in completed:
+            if future.done():
+                continue
+            if hook_error is not None and result.get('success'):
+                future.set_exception(hook_error)
+            else:
+                future.set_result(result)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get coalescing statistics"""
+        return {
+            'appliances': len(self._queues),
+            'window': self.window,
+            'max_batch': self.max_batch,
+            **self.stats
+        }
+
+
 class DictionaryEngine:
     """Engine for loading and executing vendor-specific API dictionaries"""
     
-    def __init__(self, dictionary_path: str):
+    def __init__(
+        self,
+        dictionary_path: Optional[str] = None,
+        client_pool: Optional[VendorClientPool] = None,
+        dictionary: Optional[Dict[str, Any]] = None
+    ):
         """
         Initialize dictionary engine
         
         Args:
             dictionary_path: Path to YAML dictionary file
+            client_pool: Pooled HTTP clients (defaults to the process-wide pool)
+            dictionary: Already parsed dictionary (instead of dictionary_path)
         """
-        with open(dictionary_path, 'r') as f:
-            self.dictionary = yaml.safe_load(f)
+        if dictionary is None:
+            with open(dictionary_path, 'r') as f:
+                dictionary = yaml.safe_load(f)
+        self.dictionary = dictionary
         
         self.vendor = self.dictionary.get('vendor')
-        self.api_base_url_template = Template(self.dictionary.get('api_base_url', ''))
         self.timeout = self.dictionary.get('timeout_seconds', 30)
         self.retry_attempts = self.dictionary.get('retry_attempts', 3)
+        self.client_pool = client_pool
+        
+        self.template_cache = TemplateCache()
+        self._compile()
+        
+        # Opt-in per dictionary: write_coalescing: {window_ms: 50, max_batch: 50}
+        self.coalescer: Optional[WriteCoalescer] = None
+        coalescing = self.dictionary.get('write_coalescing')
+        if coalescing and coalescing.get('enabled', True):
+            self.coalescer = WriteCoalescer(
+                self,
+                window=coalescing.get('window_ms', 50) / 1000.0,
+                max_batch=coalescing.get('max_batch', 50)
+            )
         
-        logger.info(f"Loaded dictionary for vendor: {self.vendor}")
+        logger.info(f"Loaded dictionary for vendor: {self.vendor} "
+                    f"({len(self.operations)} operations compiled)")
+    
+    def _compile(self):
+        """Parse every template, JSONPath and expression once at load time"""
+        cache = self.template_cache
+        self.api_base_url_template = cache.template(self.dictionary.get('api_base_url', ''))
+        
+        self.operations: Dict[str, CompiledOperation] = {
+            name: CompiledOperation(name, operation_def, cache)
+            for name, operation_def in self.dictionary.get('operations', {}).items()
+        }
+        self.hooks: List[CompiledHook] = [
+            CompiledHook(hook, cache)
+            for hook in self.dictionary.get('post_operation_hooks', [])
+        ]
+        
+        auth_config = self.dictionary.get('authentication', {})
+        self.auth_type = auth_config.get('type')
+        self.auth_templates: Dict[str, Template] = {}
+        if self.auth_type == 'basic':
+            creds = auth_config.get('credentials', {})
+            self.auth_templates['username'] = cache.template(creds.get('username', ''))
+            self.auth_templates['password'] = cache.template(creds.get('password', ''))
+        elif self.auth_type == 'bearer':
+            self.auth_templates['token'] = cache.template(auth_config.get('token', ''))
+        
+        health_config = self.dictionary.get('health_check')
+        self.health_endpoint = None
+        self.health_success = None
+        if health_config:
+            self.health_endpoint = cache.template(health_config['endpoint'])
+            if health_config.get('success_indicator'):
+                self.health_success = cache.expression(health_config['success_indicator'])
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Compiled template/JSONPath/expression counts"""
+        return self.template_cache.get_stats()
+    
+    @property
+    def pool(self) -> VendorClientPool:
+        """Client pool used for vendor calls"""
+        return self.client_pool or get_default_pool()
     
     def get_api_base_url(self, context: Dict[str, Any]) -> str:
         """Render API base URL with context variables"""
@@ -39,23 +347,16 @@ class DictionaryEngine:
     
     def get_auth_config(self, context: Dict[str, Any]) -> Dict[str, Any]:
         """Get authentication configuration"""
-        auth_config = self.dictionary.get('authentication', {})
-        auth_type = auth_config.get('type')
-        
-        if auth_type == 'basic':
-            creds = auth_config.get('credentials', {})
-            username_template = Template(creds.get('username', ''))
-            password_template = Template(creds.get('password', ''))
+        if self.auth_type == 'basic':
             return {
                 'type': 'basic',
-                'username': username_template.render(**context),
-                'password': password_template.render(**context)
+                'username': self.auth_templates['username'].render(**context),
+                'password': self.auth_templates['password'].render(**context)
             }
-        elif auth_type == 'bearer':
-            token_template = Template(auth_config.get('token', ''))
+        elif self.auth_type == 'bearer':
             return {
                 'type': 'bearer',
-                'token': token_template.render(**context)
+                'token': self.auth_templates['token'].render(**context)
             }
         
         return {'type': 'none'}
@@ -75,21 +376,35 @@ class DictionaryEngine:
         Returns:
             Response dictionary with vendor_ref, success, error_code, message
         """
-        operations = self.dictionary.get('operations', {})
-        operation_def = operations.get(operation_name)
-        
-        if not operation_def:
+        if operation_name not in self.operations:
             raise ValueError(f"Operation '{operation_name}' not found in dictionary")
         
+        # Writes that need a commit hook are queued so one commit covers a batch
+        if self.coalescer is not None and any(hook.applies_to(operation_name) for hook in self.hooks):
+            return await self.coalescer.submit(self.get_api_base_url(context), operation_name, context)
+        
+        result = await self._send_operation(operation_name, context)
+        
+        # Execute post-operation hooks
+        if result.get('success'):
+            await self._execute_hooks(operation_name, context)
+        
+        return result
+    
+    async def _send_operation(
+        self,
+        operation_name: str,
+        context: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Send a single operation to the VNF and parse the response (no hooks)"""
+        operation = self.operations[operation_name]
+        
         # Build request
-        method = operation_def['method']
-        endpoint_template = Template(operation_def['endpoint'])
-        endpoint = endpoint_template.render(**context)
+        method = operation.method
+        endpoint = operation.endpoint.render(**context)
         
         # Render request body
-        request_template_str = operation_def.get('request_template', '{}')
-        request_template = Template(request_template_str)
-        request_body_str = request_template.render(**context)
+        request_body_str = operation.request_template.render(**context)
         request_body = json.loads(request_body_str) if request_body_str.strip() else {}
         
         # Get auth
@@ -105,42 +420,35 @@ class DictionaryEngine:
         # Execute HTTP request
         logger.info(f"Executing {method} {full_url}")
         
-        async with httpx.AsyncClient(timeout=self.timeout, verify=False) as client:
-            auth = None
-            if auth_config['type'] == 'basic':
-                auth = (auth_config['username'], auth_config['password'])
-            
-            response = await client.request(
-                method=method,
-                url=full_url,
-                json=request_body if method in ['POST', 'PUT', 'PATCH'] else None,
-                headers=headers,
-                auth=auth
-            )
-        
-        # Parse response
-        result = self._parse_response(operation_def, response, context)
+        client = await self.pool.get_client(full_url, timeout=self.timeout)
+        auth = None
+        if auth_config['type'] == 'basic':
+            auth = (auth_config['username'], auth_config['password'])
         
-        # Execute post-operation hooks
-        if result.get('success'):
-            await self._execute_hooks(operation_name, context)
-        
-        return result
+        # Stream the response: only the parts the mappings read are parsed
+        async with client.stream(
+            method=method,
+            url=full_url,
+            json=request_body if method in ['POST', 'PUT', 'PATCH'] else None,
+            headers=headers,
+            auth=auth
+        ) as response:
+            return await self._parse_response(operation, response, context)
     
-    def _parse_response(
+    async def _parse_response(
         self,
-        operation_def: Dict[str, Any],
+        operation: CompiledOperation,
         response: httpx.Response,
         context: Dict[str, Any]
     ) -> Dict[str, Any]:
-        """Parse HTTP response using dictionary mappings"""
-        response_mapping = operation_def.get('response_mapping', {})
-        error_mapping = operation_def.get('error_mapping', {})
+        """Parse a streamed HTTP response using dictionary mappings"""
+        error_mapping = operation.error_mapping
         
         status_code = response.status_code
         
         # Check for errors
         if status_code >= 400:
+            await response.aread()
             error_code = error_mapping.get(status_code, 'VNF_UPSTREAM')
             try:
                 error_data = response.json()
@@ -155,38 +463,39 @@ class DictionaryEngine:
                 'vendor_ref': None
             }
         
-        # Parse success response
-        try:
-            response_data = response.json()
-        except:
-            response_data = {'text': response.text}
+        # Parse success response (partially, unless a mapping needs the whole document)
+        response_data = await read_document(response, operation.response_paths)
         
         # Extract vendor reference using JSONPath
         vendor_ref = None
-        if 'vendor_ref' in response_mapping:
-            jsonpath_expr = parse(response_mapping['vendor_ref'])
-            matches = jsonpath_expr.find(response_data)
+        if operation.vendor_ref is not None:
+            matches = operation.vendor_ref.find(response_data)
             if matches:
                 vendor_ref = str(matches[0].value)
         
         # Check success indicator
         success = True
-        if 'success_indicator' in response_mapping:
-            success_expr = response_mapping['success_indicator']
-            # Simple evaluation (in production, use safer method)
+        if operation.success_indicator is not None:
             try:
-                # Replace $ with response_data reference
-                eval_expr = success_expr.replace('$.', 'response_data.')
-                success = eval(eval_expr)
-            except:
+                success = bool(operation.success_indicator(response_data))
+            except TypeError:
+                # Incomparable types (e.g. missing field vs number)
                 success = status_code < 300
         
-        return {
+        result = {
             'success': success,
             'vendor_ref': vendor_ref,
             'message': 'Operation completed successfully',
             'error_code': None
         }
+        
+        # List operations: elements of the list at list_path
+        if operation.list_path is not None:
+            matches = operation.list_path.find(response_data)
+            items = matches[0].value if matches else []
+            result['items'] = items if isinstance(items, list) else [items]
+        
+        return result
     
     async def _execute_hooks(
         self,
@@ -194,49 +503,62 @@ class DictionaryEngine:
         context: Dict[str, Any]
     ):
         """Execute post-operation hooks"""
-        hooks = self.dictionary.get('post_operation_hooks', [])
-        
-        for hook in hooks:
+        for hook in self.hooks:
             # Check condition
-            condition = hook.get('condition', '')
-            if condition:
-                condition_template = Template(condition)
-                should_execute = eval(condition_template.render(operation=operation_name))
-                if not should_execute:
-                    continue
+            if hook.applies_to(operation_name):
+                await self._execute_hook(hook, context)
+    
+    async def _execute_batch_hooks(self, operations: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """
+        Execute each hook once for a batch of successful operations
+        
+        Args:
+            operations: (operation_name, context) pairs in execution order
             
-            # Execute hook
-            method = hook['method']
-            endpoint_template = Template(hook['endpoint'])
-            endpoint = endpoint_template.render(**context)
+        Returns:
+            Number of hooks executed
+        """
+        executed = 0
+        for hook in self.hooks:
+            # Render the hook with the latest operation it applies to
+            matching = [context for name, context in operations if hook.applies_to(name)]
+            if matching:
+                await self._execute_hook(hook, matching[-1])
+                executed += 1
+        return executed
+    
+    async def _execute_hook(self, hook: CompiledHook, context: Dict[str, Any]):
+        """Execute a single post-operation hook"""
+        method = hook.method
+        endpoint = hook.endpoint.render(**context)
+        
+        base_url = self.get_api_base_url(context)
+        full_url = base_url + endpoint
+        
+        logger.info(f"Executing hook: {method} {full_url}")
+        
+        try:
+            auth_config = self.get_auth_config(context)
+            headers = {'Content-Type': 'application/json'}
             
-            base_url = self.get_api_base_url(context)
-            full_url = base_url + endpoint
+            client = await self.pool.get_client(full_url, timeout=self.timeout)
+            auth = None
+            if auth_config['type'] == 'basic':
+                auth = (auth_config['username'], auth_config['password'])
             
-            logger.info(f"Executing hook: {method} {full_url}")
+            response = await client.request(
+                method=method,
+                url=full_url,
+                headers=headers,
+                auth=auth
+            )
             
-            try:
-                auth_config = self.get_auth_config(context)
-                headers = {'Content-Type': 'application/json'}
-                
-                async with httpx.AsyncClient(timeout=self.timeout, verify=False) as client:
-                    auth = None
-                    if auth_config['type'] == 'basic':
-                        auth = (auth_config['username'], auth_config['password'])
-                    
-                    response = await client.request(
-                        method=method,
-                        url=full_url,
-                        headers=headers,
-                        auth=auth
-                    )
-                    
-                    if response.status_code >= 400 and not hook.get('ignore_errors', False):
-                        logger.warning(f"Hook failed: {response.text}")
-            except Exception as e:
-                if not hook.get('ignore_errors', False):
-                    logger.error(f"Hook execution error: {e}")
-                    raise
+            if response.status_code >= 400 and not hook.ignore_errors:
+                logger.warning(f"Hook failed: {response.text}")
+        except Exception as e:
+            if not hook.ignore_errors:
+                logger.error(f"Hook execution error: {e}")
+                raise
     
     async def health_check(self, context: Dict[str, Any]) -> bool:
         """Execute health check against VNF"""
@@ -244,8 +566,7 @@ class DictionaryEngine:
         if not health_config:
             return True
         
-        endpoint_template = Template(health_config['endpoint'])
-        endpoint = endpoint_template.render(**context)
+        endpoint = self.health_endpoint.render(**context)
         method = health_config.get('method', 'GET')
         
         base_url = self.get_api_base_url(context)
@@ -257,26 +578,24 @@ class DictionaryEngine:
             
             timeout = health_config.get('timeout_seconds', 5)
             
-            async with httpx.AsyncClient(timeout=timeout, verify=False) as client:
-                auth = None
-                if auth_config['type'] == 'basic':
-                    auth = (auth_config['username'], auth_config['password'])
-                
-                response = await client.request(
-                    method=method,
-                    url=full_url,
-                    headers=headers,
-                    auth=auth
-                )
-                
-                # Check success indicator
-                success_indicator = health_config.get('success_indicator')
-                if success_indicator:
-                    response_data = response.json()
-                    eval_expr = success_indicator.replace('$.', 'response_data.')
-                    return eval(eval_expr)
-                
-                return response.status_code < 300
+            client = await self.pool.get_client(full_url, timeout=timeout)
+            auth = None
+            if auth_config['type'] == 'basic':
+                auth = (auth_config['username'], auth_config['password'])
+            
+            response = await client.request(
+                method=method,
+                url=full_url,
+                headers=headers,
+                auth=auth
+            )
+            
+            # Check success indicator
+            if self.health_success is not None:
+                response_data = response.json()
+                return bool(self.health_success(response_data))
+            
+            return response.status_code < 300
         except Exception as e:
             logger.error(f"Health check failed: {e}")
             return False
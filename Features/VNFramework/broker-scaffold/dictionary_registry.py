@@ -0,0 +1,274 @@
+"""
+VNF Broker Dictionary Registry
+Compiled vendor dictionaries, hot-reloaded as immutable versioned snapshots
+
+Every *.yaml / *.yml file in the dictionary directory is loaded and compiled
+once (DictionaryEngine) and published in a DictionarySnapshot. Engines are
+looked up by the vendor the dictionary declares (vendor: "pfSense" ->
+'pfsense', whatever the file is called), falling back to the file stem
+(pfsense_2.7.yaml -> 'pfsense_2.7'). A request takes the current snapshot once
+and uses it until it finishes. A reload builds a complete new snapshot and
+swaps it in with a single reference assignment, so a request never sees a
+mix of old and new dictionaries, and a dictionary update needs no restart.
+
+- only files whose size, mtime or content changed are recompiled. Other
+  vendors keep their engine (and its write-coalescing queue).
+- a file that fails to parse or compile keeps its previous engine, and the
+  error is reported in the snapshot. A bad edit never takes a vendor offline.
+- a file without an 'operations' section (the older 'services' dictionary
+  format) is reported as an error and not served. When two files declare the
+  same vendor, the first in file name order serves it and the other is
+  reported.
+- changes are picked up via inotify when the optional watchfiles package is
+  installed (it ships with uvicorn[standard]); otherwise the directory is
+  polled every poll_interval seconds
+"""
+
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, Any, Optional, Tuple, Mapping
+
+import yaml
+
+from dict_engine import DictionaryEngine
+from http_pool import VendorClientPool
+
+logger = logging.getLogger(__name__)
+
+try:
+    from watchfiles import awatch
+    WATCHFILES_AVAILABLE = True
+except ImportError:
+    WATCHFILES_AVAILABLE = False
+
+DICTIONARY_SUFFIXES = ('.yaml', '.yml')
+
+
+class DictionarySnapshot:
+    """One immutable generation of compiled dictionaries"""
+
+    __slots__ = ('version', 'engines', 'vendors', 'digests', 'errors', 'loaded_at')
+
+    def __init__(
+        self,
+        version: int,
+        engines: Dict[str, DictionaryEngine],
+        digests: Dict[str, str],
+        errors: Dict[str, str],
+        vendors: Optional[Dict[str, str]] = None
+    ):
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'engines', MappingProxyType(dict(engines)))
+        object.__setattr__(self, 'vendors', MappingProxyType(dict(vendors or {})))
+        object.__setattr__(self, 'digests', MappingProxyType(dict(digests)))
+        object.__setattr__(self, 'errors', MappingProxyType(dict(errors)))
+        object.__setattr__(self, 'loaded_at', time.time())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DictionarySnapshot is immutable")
+
+    def engine(self, vendor: str) -> DictionaryEngine:
+        """
+        Compiled dictionary for vendor
+
+        Args:
+            vendor: Declared vendor name (any case), or a dictionary file stem
+
+        Raises:
+            KeyError: No dictionary for vendor in this snapshot
+        """
+        key = vendor.lower()
+        engine = self.engines.get(self.vendors.get(key, key))
+        if engine is None:
+            raise KeyError(f"No dictionary loaded for vendor '{vendor}'")
+        return engine
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Snapshot summary (for /health)"""
+        return {
+            'version': self.version,
+            'vendors': dict(sorted(self.vendors.items())),
+            'files': sorted(self.engines),
+            'digests': {vendor: digest[:12] for vendor, digest in self.digests.items()},
+            'compiled': {vendor: engine.get_cache_stats() for vendor, engine in self.engines.items()},
+            'errors': dict(self.errors),
+            'loadedAt': self.loaded_at
+        }
+
+
+class DictionaryRegistry:
+    """Loads a dictionary directory and keeps the current snapshot up to date"""
+
+    def __init__(
+        self,
+        path: Path,
+        poll_interval: float = 2.0,
+        client_pool: Optional[VendorClientPool] = None
+    ):
+        """
+        Initialize registry (nothing is loaded until load())
+
+        Args:
+            path: Directory holding the vendor dictionary files
+            poll_interval: Seconds between directory scans without watchfiles
+            client_pool: Pooled HTTP clients for the engines (default: process-wide pool)
+        """
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self.client_pool = client_pool
+        self._snapshot = DictionarySnapshot(0, {}, {}, {})
+        self._seen: Dict[str, Tuple[int, int]] = {}  # file stem -> (mtime_ns, size) last read
+        self._load_errors: Dict[str, str] = {}  # file stem -> last parse/compile error
+        self._reload_lock = threading.Lock()
+        self._watch_task: Optional[asyncio.Task] = None
+        self.stats = {'reloads': 0, 'compiled': 0, 'failed': 0}
+
+    @property
+    def snapshot(self) -> DictionarySnapshot:
+        """Current snapshot; take it once per request and use it throughout"""
+        return self._snapshot
+
+    def get(self, vendor: str) -> DictionaryEngine:
+        """Compiled dictionary for vendor in the current snapshot"""
+        return self._snapshot.engine(vendor)
+
+    def _scan(self) -> Dict[str, Tuple[Path, Tuple[int, int]]]:
+        """Dictionary files by stem, with their (mtime_ns, size)"""
+        files = {}
+        if not self.path.is_dir():
+            return files
+        for file in sorted(self.path.iterdir()):
+            if file.suffix.lower() not in DICTIONARY_SUFFIXES or not file.is_file():
+                continue
+            try:
+                stat = file.stat()
+            except OSError:
+                continue  # removed while scanning
+            files[file.stem.lower()] = (file, (stat.st_mtime_ns, stat.st_size))
+        return files
+
+    def load(self) -> DictionarySnapshot:
+        """
+        Scan the directory and publish a new snapshot if anything changed
+
+        Returns:
+            The current snapshot (unchanged if no file changed)
+        """
+        with self._reload_lock:
+            current = self._snapshot
+            files = self._scan()
+            if current.version and files.keys() == self._seen.keys() \
+                    and all(self._seen[vendor] == stat for vendor, (_, stat) in files.items()):
+                return current
+
+            engines: Dict[str, DictionaryEngine] = {}
+            digests: Dict[str, str] = {}
+            errors: Dict[str, str] = {}
+            for vendor, (file, stat) in files.items():
+                previous = current.engines.get(vendor)
+                if previous is not None:
+                    engines[vendor], digests[vendor] = previous, current.digests[vendor]
+                if self._seen.get(vendor) == stat:
+                    if vendor in self._load_errors:
+                        errors[vendor] = self._load_errors[vendor]
+                    continue
+                self._seen[vendor] = stat
+                self._load_errors.pop(vendor, None)
+                try:
+                    source = file.read_bytes()
+                    digest = hashlib.sha256(source).hexdigest()
+                    if digest != digests.get(vendor):
+                        engine = DictionaryEngine(client_pool=self.client_pool,
+                                                  dictionary=yaml.safe_load(source))
+                        if not engine.operations:
+                            raise ValueError("No 'operations' section (not a dict_engine dictionary)")
+                        engines[vendor], digests[vendor] = engine, digest
+                        self.stats['compiled'] += 1
+                except Exception as e:
+                    self.stats['failed'] += 1
+                    errors[vendor] = self._load_errors[vendor] = str(e)
+                    logger.error(f"Dictionary {file} failed to load: {e}")
+                    if previous is not None:
+                        logger.warning(f"Keeping version {digests[vendor][:12]} of '{vendor}'")
+            for vendor in self._seen.keys() - files.keys():
+                del self._seen[vendor]
+                self._load_errors.pop(vendor, None)
+
+            # Declared vendor -> file; the first file (by name) wins a duplicate
+            vendors: Dict[str, str] = {}
+            for stem in sorted(engines):
+                declared = str(engines[stem].vendor or stem).lower()
+                if declared in vendors:
+                    errors[stem] = f"Vendor '{engines[stem].vendor}' is already served by '{vendors[declared]}'"
+                    continue
+                vendors[declared] = stem
+
+            if current.version and engines == dict(current.engines) and errors == dict(current.errors):
+                return current
+            snapshot = DictionarySnapshot(current.version + 1, engines, digests, errors, vendors)
+            self._snapshot = snapshot
+            self.stats['reloads'] += 1
+            changed = sorted(vendor for vendor in engines.keys() | current.engines.keys()
+                             if engines.get(vendor) is not current.engines.get(vendor))
+            logger.info(f"Dictionary snapshot v{snapshot.version}: {len(engines)} vendor(s) "
+                        f"(changed: {', '.join(changed) or 'none'}, failed: {', '.join(errors) or 'none'})")
+            return snapshot
+
+    async def reload(self) -> DictionarySnapshot:
+        """load() without blocking the event loop"""
+        return await asyncio.to_thread(self.load)
+
+    async def _watch(self):
+        while True:
+            try:
+                if WATCHFILES_AVAILABLE and self.path.is_dir():
+                    await self.reload()  # changes made before the watch started
+                    async for _ in awatch(self.path, recursive=False):
+                        await self.reload()
+                else:
+                    await asyncio.sleep(self.poll_interval)
+                    await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Dictionary watcher error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        """Watch the directory for changes (call from the running event loop)"""
+        if self._watch_task is None:
+            self._watch_task = asyncio.get_running_loop().create_task(self._watch())
+
+    async def stop(self):
+        """Stop watching"""
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Registry statistics"""
+        return {
+            'path': str(self.path),
+            'watching': self._watch_task is not None,
+            'inotify': WATCHFILES_AVAILABLE,
+            **self._snapshot.get_stats(),
+            **self.stats
+        }
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any], client_pool: Optional[VendorClientPool] = None) -> 'DictionaryRegistry':
+        """Build from the 'dictionaries' section of broker.yaml"""
+        return cls(
+            path=Path(config.get('path', '/etc/vnfbroker/dictionaries')),
+            poll_interval=config.get('pollInterval', 2.0),
+            client_pool=client_pool
+        )
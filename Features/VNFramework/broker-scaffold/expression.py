@@ -0,0 +1,291 @@
+"""
+VNF Broker Dictionary Expressions
+Safe evaluator for success_indicator / condition predicates
+
+Grammar (no attribute access, calls or arbitrary Python):
+    expr       := or_expr
+    or_expr    := and_expr ('or' and_expr)*
+    and_expr   := not_expr ('and' not_expr)*
+    not_expr   := 'not' not_expr | comparison
+    comparison := operand (('==' | '!=' | '<' | '<=' | '>' | '>=' | 'in' | 'not in') operand)?
+    operand    := path | NAME | NUMBER | STRING | 'true' | 'false' | 'null' | list | '(' expr ')'
+    path       := '$' ('.' NAME | '[' (STRING | INTEGER) ']')*
+    list       := '[' (operand (',' operand)*)? ']'
+
+Expressions are parsed once into a tree of closures; evaluation only walks
+that tree. `$` refers to the response document, bare names to variables
+(e.g. `operation` in post_operation_hooks conditions). The document paths an
+expression reads are kept in `paths`, so a response reader can extract just
+those parts of the body.
+"""
+import re
+import operator
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+Evaluator = Callable[[Any, Dict[str, Any]], Any]
+Path = Tuple[Union[str, int], ...]
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+      | (?P<op>==|!=|<=|>=|<|>)
+      | (?P<punct>[$.\[\](),])
+      | (?P<name>[A-Za-z_][A-Za-z0-9_-]*)
+    )""", re.VERBOSE)
+
+_COMPARISONS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+_CONSTANTS = {
+    'true': True, 'True': True,
+    'false': False, 'False': False,
+    'null': None, 'None': None,
+}
+
+_KEYWORDS = {'and', 'or', 'not', 'in'}
+
+
+class ExpressionError(ValueError):
+    """Raised when a dictionary expression cannot be parsed"""
+
+
+class CompiledExpression:
+    """Parsed expression; call with (data, variables)"""
+
+    __slots__ = ('source', '_evaluate', 'paths')
+
+    def __init__(self, source: str, evaluate: Evaluator, paths: Tuple[Path, ...] = ()):
+        self.source = source
+        self._evaluate = evaluate
+        self.paths = paths  # document paths read ($ alone is the empty path)
+
+    def __call__(self, data: Any = None, variables: Optional[Dict[str, Any]] = None) -> Any:
+        return self._evaluate(data, variables or {})
+
+    def __repr__(self) -> str:
+        return f"CompiledExpression({self.source!r})"
+
+
+def _tokenize(source: str) -> List[Tuple[str, str]]:
+    tokens = []
+    pos = 0
+    source = source.rstrip()
+    while pos < len(source):
+        match = _TOKEN_RE.match(source, pos)
+        if not match:
+            raise ExpressionError(f"Unexpected character at {pos} in {source!r}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+def _unquote(literal: str) -> str:
+    body = literal[1:-1]
+    return re.sub(r"\\(.)", r"\1", body)
+
+
+def _constant(value: Any) -> Evaluator:
+    evaluate = lambda d, v: value
+    evaluate.constant = True
+    return evaluate
+
+
+def _lookup(data: Any, key: Any) -> Any:
+    if isinstance(data, dict):
+        return data.get(key)
+    if isinstance(data, (list, tuple)) and isinstance(key, int):
+        return data[key] if -len(data) <= key < len(data) else None
+    return None
+
+
+class _Parser:
+    """Recursive-descent parser producing closures"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.tokens = _tokenize(source)
+        self.pos = 0
+        self.paths: List[Path] = []
+
+    def peek(self, offset: int = 0) -> Tuple[Optional[str], Optional[str]]:
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self) -> Tuple[str, str]:
+        token = self.peek()
+        if token[0] is None:
+            raise ExpressionError(f"Unexpected end of expression {self.source!r}")
+        self.pos += 1
+        return token
+
+    def expect(self, value: str):
+        kind, text = self.take()
+        if text != value:
+            raise ExpressionError(f"Expected {value!r}, got {text!r} in {self.source!r}")
+
+    def at(self, value: str) -> bool:
+        kind, text = self.peek()
+        return text == value and kind in ('punct', 'op', 'name')
+
+    def parse(self) -> Evaluator:
+        node = self.or_expr()
+        if self.peek()[0] is not None:
+            raise ExpressionError(f"Unexpected {self.peek()[1]!r} in {self.source!r}")
+        return node
+
+    def or_expr(self) -> Evaluator:
+        node = self.and_expr()
+        while self.at('or'):
+            self.take()
+            left, right = node, self.and_expr()
+            node = lambda d, v, l=left, r=right: l(d, v) or r(d, v)
+        return node
+
+    def and_expr(self) -> Evaluator:
+        node = self.not_expr()
+        while self.at('and'):
+            self.take()
+            left, right = node, self.not_expr()
+            node = lambda d, v, l=left, r=right: l(d, v) and r(d, v)
+        return node
+
+    def not_expr(self) -> Evaluator:
+        if self.at('not'):
+            self.take()
+            inner = self.not_expr()
+            return lambda d, v: not inner(d, v)
+        return self.comparison()
+
+    def comparison(self) -> Evaluator:
+        left = self.operand()
+        kind, text = self.peek()
+        if kind == 'op':
+            self.take()
+            compare = _COMPARISONS[text]
+            right = self.operand()
+            return lambda d, v: compare(left(d, v), right(d, v))
+        if self.at('in'):
+            self.take()
+            right = self.operand()
+            return lambda d, v: left(d, v) in (right(d, v) or ())
+        if self.at('not') and self.peek(1)[1] == 'in':
+            self.take()
+            self.take()
+            right = self.operand()
+            return lambda d, v: left(d, v) not in (right(d, v) or ())
+        return left
+
+    def operand(self) -> Evaluator:
+        kind, text = self.take()
+
+        if kind == 'number':
+            return _constant(float(text) if '.' in text else int(text))
+        if kind == 'string':
+            return _constant(_unquote(text))
+        if kind == 'punct' and text == '$':
+            return self.path()
+        if kind == 'punct' and text == '[':
+            items = []
+            if not self.at(']'):
+                items.append(self.operand())
+                while self.at(','):
+                    self.take()
+                    items.append(self.operand())
+            self.expect(']')
+            if all(getattr(item, 'constant', False) for item in items):
+                return _constant(tuple(item(None, {}) for item in items))
+            return lambda d, v: [item(d, v) for item in items]
+        if kind == 'punct' and text == '(':
+            node = self.or_expr()
+            self.expect(')')
+            return node
+        if kind == 'name' and text in _CONSTANTS:
+            return _constant(_CONSTANTS[text])
+        if kind == 'name' and text not in _KEYWORDS:
+            return lambda d, v: v.get(text)
+
+        raise ExpressionError(f"Unexpected {text!r} in {self.source!r}")
+
+    def path_keys(self) -> Path:
+        keys: List[Any] = []
+        while True:
+            if self.at('.'):
+                self.take()
+                kind, text = self.take()
+                if kind != 'name':
+                    raise ExpressionError(f"Expected field name after '.' in {self.source!r}")
+                keys.append(text)
+            elif self.at('['):
+                self.take()
+                kind, text = self.take()
+                if kind == 'string':
+                    keys.append(_unquote(text))
+                elif kind == 'number' and '.' not in text:
+                    keys.append(int(text))
+                else:
+                    raise ExpressionError(f"Invalid index {text!r} in {self.source!r}")
+                self.expect(']')
+            else:
+                break
+        return tuple(keys)
+
+    def path(self) -> Evaluator:
+        path = self.path_keys()
+        self.paths.append(path)
+
+        def resolve(d, v):
+            for key in path:
+                d = _lookup(d, key)
+                if d is None:
+                    return None
+            return d
+        return resolve
+
+
+def compile_expression(source: str) -> CompiledExpression:
+    """
+    Parse expression source once into a reusable evaluator
+
+    Args:
+        source: Expression such as "$.code == 200"
+
+    Returns:
+        CompiledExpression callable as expr(response_data, variables)
+
+    Raises:
+        ExpressionError: If the expression is not valid
+    """
+    if not source or not source.strip():
+        raise ExpressionError("Empty expression")
+    parser = _Parser(source)
+    evaluate = parser.parse()
+    return CompiledExpression(source, evaluate, tuple(dict.fromkeys(parser.paths)))
+
+
+def parse_path(source: str) -> Optional[Path]:
+    """
+    Keys of a plain JSONPath such as $.data.id or $.results[0]['local-port']
+
+    Args:
+        source: JSONPath (e.g. a response_mapping vendor_ref)
+
+    Returns:
+        Key tuple, or None if the path uses other JSONPath features
+        (wildcards, recursive descent, filters, slices)
+    """
+    try:
+        parser = _Parser(source)
+        if parser.take() != ('punct', '$'):
+            return None
+        keys = parser.path_keys()
+    except ExpressionError:
+        return None
+    return keys if parser.peek()[0] is None else None
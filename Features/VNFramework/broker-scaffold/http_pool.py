@@ -0,0 +1,211 @@
+"""
+VNF Broker HTTP Client Pool
+Per-appliance pooled httpx.AsyncClient cache with keep-alive and idle eviction
+"""
+import asyncio
+import time
+import logging
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  (httpx needs the h2 package for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class VendorClientPool:
+    """
+    Cache of pooled async HTTP clients, one per VNF endpoint
+
+    Clients are keyed by scheme://host:port plus the TLS/timeout settings, so
+    every request to the same appliance reuses its keep-alive connections
+    instead of paying a TCP+TLS handshake per call.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 30.0,
+        idle_timeout: float = 300.0,
+        http2: bool = False,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        """
+        Initialize client pool
+
+        Args:
+            max_connections: Maximum open connections per VNF endpoint
+            max_keepalive_connections: Idle keep-alive connections kept per endpoint
+            keepalive_expiry: Seconds an idle keep-alive connection is retained
+            idle_timeout: Seconds after which an unused endpoint client is closed
+            http2: Negotiate HTTP/2 when the appliance supports it (needs h2)
+            transport: Optional transport override (tests / custom TLS)
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.idle_timeout = idle_timeout
+        self.transport = transport
+
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning("HTTP/2 requested but 'h2' package not installed, using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+
+        self._clients: Dict[Tuple, httpx.AsyncClient] = {}
+        self._last_used: Dict[Tuple, float] = {}
+        self._lock = asyncio.Lock()
+        self._last_eviction = time.monotonic()
+        self._closed = False
+
+        self.stats = {'created': 0, 'reused': 0, 'evicted': 0}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'VendorClientPool':
+        """Build pool from the 'httpPool' section of broker.yaml"""
+        return cls(
+            max_connections=config.get('maxConnections', 20),
+            max_keepalive_connections=config.get('maxKeepaliveConnections', 10),
+            keepalive_expiry=config.get('keepaliveExpiry', 30.0),
+            idle_timeout=config.get('idleTimeout', 300.0),
+            http2=config.get('http2', False)
+        )
+
+    @staticmethod
+    def _endpoint_of(url: str) -> str:
+        """Reduce a full URL to scheme://host:port"""
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        return f"{parts.scheme}://{parts.hostname}:{port}"
+
+    async def get_client(
+        self,
+        url: str,
+        timeout: float = 30.0,
+        verify: bool = False
+    ) -> httpx.AsyncClient:
+        """
+        Get (or create) the pooled client for the endpoint serving url
+
+        Args:
+            url: Any URL on the target VNF
+            timeout: Request timeout in seconds
+            verify: Verify appliance TLS certificate
+
+        Returns:
+            Shared httpx.AsyncClient; callers must not close it
+        """
+        if self._closed:
+            raise RuntimeError("VendorClientPool is closed")
+
+        key = (self._endpoint_of(url), timeout, verify)
+        now = time.monotonic()
+
+        if now - self._last_eviction > min(self.idle_timeout, 60.0):
+            await self.evict_idle()
+
+        client = self._clients.get(key)
+        if client is not None and not client.is_closed:
+            self._last_used[key] = now
+            self.stats['reused'] += 1
+            return client
+
+        async with self._lock:
+            client = self._clients.get(key)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(
+                    timeout=timeout,
+                    verify=verify,
+                    limits=self.limits,
+                    http2=self.http2,
+                    transport=self.transport
+                )
+                self._clients[key] = client
+                self.stats['created'] += 1
+                logger.info(f"Opened pooled client for {key[0]}")
+            else:
+                self.stats['reused'] += 1
+            self._last_used[key] = now
+            return client
+
+    async def evict_idle(self) -> int:
+        """
+        Close clients whose endpoint has not been used within idle_timeout
+
+        Returns:
+            Number of clients evicted
+        """
+        now = time.monotonic()
+        self._last_eviction = now
+
+        async with self._lock:
+            stale = [
+                key for key, last_used in self._last_used.items()
+                if now - last_used > self.idle_timeout
+            ]
+            clients = [self._clients.pop(key) for key in stale if key in self._clients]
+            for key in stale:
+                self._last_used.pop(key, None)
+
+        for client in clients:
+            await client.aclose()
+
+        if clients:
+            self.stats['evicted'] += len(clients)
+            logger.info(f"Evicted {len(clients)} idle VNF client(s)")
+        return len(clients)
+
+    async def aclose(self):
+        """Close every pooled client (call on broker shutdown)"""
+        self._closed = True
+        async with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._last_used.clear()
+
+        for client in clients:
+            await client.aclose()
+        logger.info(f"Closed {len(clients)} pooled VNF client(s)")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pool statistics"""
+        return {
+            'endpoints': len(self._clients),
+            'http2': self.http2,
+            **self.stats
+        }
+
+
+_default_pool: Optional[VendorClientPool] = None
+
+
+def get_default_pool() -> VendorClientPool:
+    """Get the process-wide client pool, creating it on first use"""
+    global _default_pool
+    if _default_pool is None or _default_pool._closed:
+        _default_pool = VendorClientPool()
+    return _default_pool
+
+
+def configure_default_pool(config: Dict[str, Any]) -> VendorClientPool:
+    """Replace the process-wide pool using broker.yaml 'httpPool' settings"""
+    global _default_pool
+    _default_pool = VendorClientPool.from_config(config)
+    return _default_pool
+
+
+async def close_default_pool():
+    """Shutdown hook: close the process-wide client pool"""
+    global _default_pool
+    if _default_pool is not None:
+        await _default_pool.aclose()
+        _default_pool = None
@@ -1,34 +1,88 @@
 """
 Redis-based idempotency store for VNF Broker
 Replaces in-memory store for production deployment
+
+Admin operations never enumerate the keyspace with KEYS (which blocks Redis
+for seconds at millions of keys): clear_all walks it with cursor SCAN and
+batched UNLINK, and get_stats counts entries with HyperLogLogs maintained
+on every write.
 """
+import math
+import time
 import redis
-import json
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Iterator, List
 from datetime import timedelta
 
+# Shared with python-broker (one copy of the entry format and of the keyspace
+# invalidation, so both brokers can share a Redis). The python-broker
+# directory must be on PYTHONPATH: see README.md, pytest.ini and
+# vnfbroker.service.example
+from cache_codec import CacheCodec, CodecError, load_zstd_dictionary
+from near_cache import NearCache, KeyspaceInvalidator
+
 logger = logging.getLogger(__name__)
 
 
 class RedisIdempotencyStore:
     """Redis-backed idempotency store with TTL support"""
     
-    def __init__(self, redis_url: str = "redis://localhost:6379/0", ttl_hours: int = 24):
+    KEY_PREFIX = "vnf:idempotency:"
+    # Outside KEY_PREFIX so SCANs and keyspace notifications never see them
+    STATS_PREFIX = "vnf:idempotency-stats:"
+    # Entries are counted in one HyperLogLog per hour of writes
+    STATS_BUCKET_SECONDS = 3600
+    
+    def __init__(
+        self,
+        redis_url: str = "redis://localhost:6379/0",
+        ttl_hours: int = 24,
+        codec: Optional[CacheCodec] = None,
+        near_cache: Optional[NearCache] = None
+    ):
         """
         Initialize Redis store
         
         Args:
             redis_url: Redis connection URL
             ttl_hours: Time-to-live for cached responses in hours
+            codec: Entry codec (defaults to msgpack + zstd when installed);
+                   entries written as plain JSON are still readable
+            near_cache: In-process cache consulted before Redis; kept in sync
+                        with other replicas through keyspace notifications
         """
-        self.client = redis.from_url(redis_url, decode_responses=True)
+        # Raw bytes: encoded entries are binary
+        self.client = redis.from_url(redis_url, decode_responses=False)
         self.ttl = timedelta(hours=ttl_hours)
+        self.codec = codec or CacheCodec()
+        self.near_cache = near_cache
+        self.invalidator: Optional[KeyspaceInvalidator] = None
         logger.info(f"Connected to Redis: {redis_url}")
     
+    def start_invalidation(self):
+        """Start dropping near-cache entries deleted, expired or evicted in Redis"""
+        if self.near_cache is None or self.invalidator is not None:
+            return
+        try:
+            self.invalidator = KeyspaceInvalidator(self.client, self.near_cache, self._make_key(''))
+        except redis.RedisError as e:
+            logger.error(f"Keyspace invalidation unavailable, near-cache entries expire after {self.near_cache.max_ttl}s: {e}")
+    
+    def close(self):
+        """Stop the invalidation listener"""
+        if self.invalidator is not None:
+            self.invalidator.close()
+            self.invalidator = None
+    
     def _make_key(self, rule_id: str) -> str:
         """Generate Redis key for rule ID"""
-        return f"vnf:idempotency:{rule_id}"
+        return f"{self.KEY_PREFIX}{rule_id}"
+    
+    def _stats_buckets(self, now: Optional[float] = None) -> List[str]:
+        """HyperLogLog keys covering writes that may still be live (newest first)"""
+        bucket = int((now if now is not None else time.time()) // self.STATS_BUCKET_SECONDS)
+        count = math.ceil(self.ttl.total_seconds() / self.STATS_BUCKET_SECONDS) + 1
+        return [f"{self.STATS_PREFIX}hll:{bucket - i}" for i in range(count)]
     
     def get(self, rule_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -40,17 +94,29 @@ class RedisIdempotencyStore:
         Returns:
             Cached response dict or None if not found/expired
         """
+        key = self._make_key(rule_id)
+        if self.near_cache is not None:
+            cached = self.near_cache.get(key)
+            if cached is not None:
+                logger.info(f"Near-cache HIT for rule_id: {rule_id}")
+                return cached
+        
         try:
-            key = self._make_key(rule_id)
             data = self.client.get(key)
             
             if data:
                 logger.info(f"Cache HIT for rule_id: {rule_id}")
-                return json.loads(data)
+                response = self.codec.decode(data)
+                if self.near_cache is not None:
+                    self.near_cache.put(key, response)
+                return response
             
             logger.debug(f"Cache MISS for rule_id: {rule_id}")
             return None
             
+        except CodecError as e:
+            logger.warning(f"Unreadable cache entry for rule_id {rule_id}, ignoring: {e}")
+            return None
         except redis.RedisError as e:
             logger.error(f"Redis GET error: {e}")
             return None
@@ -68,13 +134,17 @@ class RedisIdempotencyStore:
         """
         try:
             key = self._make_key(rule_id)
-            data = json.dumps(response)
+            data = self.codec.encode(response)
+            bucket = self._stats_buckets()[0]
             
-            self.client.setex(
-                name=key,
-                time=self.ttl,
-                value=data
-            )
+            # Entry and its stats count in one round trip
+            pipe = self.client.pipeline(transaction=False)
+            pipe.setex(name=key, time=self.ttl, value=data)
+            pipe.pfadd(bucket, key)
+            pipe.expire(bucket, self.ttl + timedelta(seconds=self.STATS_BUCKET_SECONDS))
+            pipe.execute()
+            if self.near_cache is not None:
+                self.near_cache.put(key, response, self.ttl.total_seconds())
             
             logger.info(f"Cached response for rule_id: {rule_id} (TTL: {self.ttl})")
             return True
@@ -93,8 +163,10 @@ class RedisIdempotencyStore:
         Returns:
             True if deleted
         """
+        key = self._make_key(rule_id)
+        if self.near_cache is not None:
+            self.near_cache.invalidate(key)
         try:
-            key = self._make_key(rule_id)
             result = self.client.delete(key)
             
             if result:
@@ -125,42 +197,101 @@ class RedisIdempotencyStore:
             logger.error(f"Redis TTL error: {e}")
             return None
     
-    def clear_all(self) -> int:
+    def scan_keys(self, batch_size: int = 500) -> Iterator[List[bytes]]:
+        """
+        Walk the idempotency keys with cursor SCAN
+        
+        Each SCAN call does a bounded amount of work, so Redis keeps serving
+        other clients between batches. Keys added or removed during the walk
+        may or may not be returned.
+        
+        Args:
+            batch_size: SCAN COUNT hint (keys examined per call)
+            
+        Yields:
+            Lists of matching keys (possibly empty)
+        """
+        cursor = 0
+        while True:
+            cursor, keys = self.client.scan(cursor=cursor, match=f"{self.KEY_PREFIX}*", count=batch_size)
+            yield keys
+            if cursor == 0:
+                return
+    
+    def clear_all(
+        self,
+        batch_size: int = 500,
+        max_keys_per_second: Optional[float] = None,
+        progress: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> int:
         """
         Clear all idempotency cache entries (USE WITH CAUTION)
         
+        Keys are found with SCAN and removed with UNLINK (memory is freed
+        in a background thread), one batch per round trip, so the server
+        never blocks and the broker keeps serving while this runs.
+        
+        Args:
+            batch_size: Keys examined per SCAN call and deleted per UNLINK
+            max_keys_per_second: Throttle deletions (None = as fast as Redis answers)
+            progress: Callback({'scanned_batches', 'deleted', 'elapsed'}) after each batch
+            
         Returns:
-            Number of keys deleted
+            Number of keys deleted (up to the point of failure on a Redis error)
         """
+        if self.near_cache is not None:
+            self.near_cache.clear()
+        started = time.monotonic()
+        deleted = 0
+        batches = 0
         try:
-            pattern = "vnf:idempotency:*"
-            keys = self.client.keys(pattern)
-            
-            if keys:
-                count = self.client.delete(*keys)
-                logger.warning(f"Cleared {count} idempotency cache entries")
-                return count
-            
-            return 0
-            
+            for keys in self.scan_keys(batch_size):
+                batches += 1
+                if keys:
+                    deleted += self.client.unlink(*keys)
+                if progress:
+                    progress({'scanned_batches': batches, 'deleted': deleted,
+                              'elapsed': round(time.monotonic() - started, 3)})
+                if max_keys_per_second and keys:
+                    # Sleep until the deletion rate is back under the limit
+                    ahead = deleted / max_keys_per_second - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            self.client.unlink(*self._stats_buckets())
         except redis.RedisError as e:
-            logger.error(f"Redis CLEAR error: {e}")
-            return 0
+            logger.error(f"Redis CLEAR error after {deleted} keys: {e}")
+            return deleted
+        
+        if deleted:
+            logger.warning(f"Cleared {deleted} idempotency cache entries in {time.monotonic() - started:.1f}s")
+        return deleted
+    
+    def count_entries(self) -> int:
+        """
+        Estimate the number of live entries without enumerating keys
+        
+        Union of the hourly HyperLogLogs of written keys (standard error
+        0.81%). Overcounts by entries deleted or evicted early, and by up to
+        one hour of writes that have already expired.
+        """
+        return self.client.pfcount(*self._stats_buckets())
     
     def get_stats(self) -> Dict[str, Any]:
-        """Get cache statistics"""
+        """Get cache statistics (O(1) in the number of keys)"""
         try:
-            pattern = "vnf:idempotency:*"
-            keys = self.client.keys(pattern)
-            
+            cached_rules = self.count_entries()
+            total_keys = self.client.dbsize()
             info = self.client.info("stats")
             
             return {
-                "cached_rules": len(keys),
-                "total_keys": info.get("db0", {}).get("keys", 0),
+                "cached_rules": cached_rules,
+                "cached_rules_estimated": True,
+                "total_keys": total_keys,
                 "hits": info.get("keyspace_hits", 0),
                 "misses": info.get("keyspace_misses", 0),
-                "hit_rate": info.get("keyspace_hits", 0) / (info.get("keyspace_hits", 0) + info.get("keyspace_misses", 1)) * 100
+                "hit_rate": info.get("keyspace_hits", 0) / (info.get("keyspace_hits", 0) + info.get("keyspace_misses", 1)) * 100,
+                "codec": self.codec.get_stats(),
+                "near_cache": self.near_cache.get_stats() if self.near_cache is not None else None
             }
             
         except redis.RedisError as e:
@@ -214,8 +345,9 @@ class FallbackIdempotencyStore:
         """TTL not implemented for fallback"""
         return None
     
-    def clear_all(self) -> int:
-        """Clear all entries"""
+    def clear_all(self, batch_size: int = 500, max_keys_per_second: Optional[float] = None,
+                  progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> int:
+        """Clear all entries (same signature as RedisIdempotencyStore.clear_all)"""
         count = len(self.store)
         self.store.clear()
         return count
@@ -229,22 +361,55 @@ class FallbackIdempotencyStore:
         return True
 
 
-def create_idempotency_store(redis_url: Optional[str] = None, ttl_hours: int = 24):
+def create_codec(config: Dict[str, Any]) -> CacheCodec:
+    """Build the entry codec from the 'idempotency.codec' section of broker.yaml"""
+    return CacheCodec(
+        serializer=config.get('serializer', 'msgpack'),
+        compression=config.get('compression', 'zstd'),
+        zstd_dictionary=load_zstd_dictionary(config.get('zstdDictionary')),
+        compress_min_size=config.get('compressMinSize', 128)
+    )
+
+
+def create_near_cache(config: Dict[str, Any]) -> Optional[NearCache]:
+    """Build the near-cache from the 'idempotency.nearCache' section of broker.yaml"""
+    if not config.get('enabled', True):
+        return None
+    return NearCache(
+        max_entries=config.get('maxEntries', 10000),
+        max_ttl=config.get('ttl', 300)
+    )
+
+
+def create_idempotency_store(
+    redis_url: Optional[str] = None,
+    ttl_hours: int = 24,
+    codec_config: Optional[Dict[str, Any]] = None,
+    near_cache_config: Optional[Dict[str, Any]] = None
+):
     """
     Factory function to create idempotency store
     
     Args:
         redis_url: Redis connection URL (None = fallback to in-memory)
         ttl_hours: TTL for cached entries
+        codec_config: 'idempotency.codec' section of broker.yaml
+        near_cache_config: 'idempotency.nearCache' section of broker.yaml
         
     Returns:
         RedisIdempotencyStore or FallbackIdempotencyStore
     """
     if redis_url:
         try:
-            store = RedisIdempotencyStore(redis_url, ttl_hours)
+            store = RedisIdempotencyStore(
+                redis_url,
+                ttl_hours,
+                codec=create_codec(codec_config or {}),
+                near_cache=create_near_cache(near_cache_config or {})
+            )
             if store.health_check():
                 logger.info("Using Redis idempotency store")
+                store.start_invalidation()
                 return store
             else:
                 logger.warning("Redis health check failed, using fallback")
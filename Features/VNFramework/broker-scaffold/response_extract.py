@@ -0,0 +1,277 @@
+"""
+VNF Broker Response Extraction
+Streamed, partial JSON parsing of vendor responses
+
+Most operations read one or two values from the vendor response: the
+vendor_ref JSONPath and the paths used by success_indicator. FortiGate and
+Palo Alto answer with multi-megabyte documents, and decoding all of them
+costs far more than those few values. read_document() sends the body through
+an incremental parser (the optional ijson package) as it arrives:
+
+- only subtrees at the requested paths are built. Everything else is stepped
+  over without creating Python objects, so peak memory is bounded by the
+  requested values rather than by the response size.
+- parsing stops as soon as every path has been found, or is known to be
+  absent. The rest of the body is drained unparsed so the keep-alive
+  connection goes back to the pool.
+
+The result is a partial document with the same shape as the full one, so
+JSONPath matches and expressions evaluate exactly as before. Callers that
+need the whole document (list_path iteration, JSONPaths with wildcards) pass
+paths=None. Without ijson the body is read and decoded in one go. Bodies
+that are not JSON objects or arrays come back as {'text': body}, as before.
+A body that starts as JSON but turns out malformed comes back as its first
+MALFORMED_TEXT_BYTES only ({'text': head, 'truncated': True} when cut), so
+a broken multi-megabyte response is not held in memory either.
+"""
+import json
+import logging
+from typing import Any, AsyncIterator, Iterable, List, Optional, Sequence, Tuple
+
+import httpx
+
+from expression import Path
+
+logger = logging.getLogger(__name__)
+
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
+_CONTAINERS = {'start_map': dict, 'start_array': list}
+_ENDS = ('end_map', 'end_array')
+_WHITESPACE = b' \t\r\n'
+
+# Bytes of a malformed streamed body kept for the {'text': ...} fallback
+MALFORMED_TEXT_BYTES = 64 * 1024
+
+# Roles of a value relative to the requested paths
+_SKIP, _DESCEND, _BUILD = 0, 1, 2
+
+
+def normalize_paths(paths: Iterable[Path]) -> Tuple[Path, ...]:
+    """
+    Reduce requested paths to the subtrees that must be built
+
+    A negative index needs the whole list, so the path stops at that list.
+    A path inside another requested path is covered by it.
+    """
+    trimmed = []
+    for path in paths:
+        for position, key in enumerate(path):
+            if isinstance(key, int) and key < 0:
+                path = path[:position]
+                break
+        trimmed.append(tuple(path))
+    trimmed = sorted(set(trimmed), key=len)
+    minimal: List[Path] = []
+    for path in trimmed:
+        if not any(path[:len(kept)] == kept for kept in minimal):
+            minimal.append(path)
+    return tuple(minimal)
+
+
+class _Frame:
+    """An open container being built"""
+
+    __slots__ = ('container', 'path', 'key', 'building')
+
+    def __init__(self, container, path: Optional[Path], building: bool):
+        self.container = container
+        self.path = path  # None inside a requested subtree (not needed for resolution)
+        self.key = None
+        self.building = building
+
+
+class PartialDocument:
+    """Builds the parts of a JSON document at a set of paths from ijson basic events"""
+
+    def __init__(self, paths: Iterable[Path]):
+        """
+        Initialize builder
+
+        Args:
+            paths: Key tuples to extract (() = the whole document)
+        """
+        self.paths = normalize_paths(paths)
+        self.pending = set(self.paths)
+        self.root: Any = None
+        self._stack: List[_Frame] = []
+        self._skip = 0  # nesting depth inside a skipped container
+
+    @property
+    def done(self) -> bool:
+        """Every path was found or is known to be absent"""
+        return not self.pending
+
+    def _role(self, path: Path) -> int:
+        for wanted in self.paths:
+            if path[:len(wanted)] == wanted:
+                return _BUILD
+        for wanted in self.paths:
+            if wanted[:len(path)] == path:
+                return _DESCEND
+        return _SKIP
+
+    def _resolve(self, path: Path):
+        """Nothing more can appear at or below path"""
+        if self.pending:
+            self.pending = {wanted for wanted in self.pending if wanted[:len(path)] != path}
+
+    def _place(self, frame: Optional[_Frame], value: Any):
+        if frame is None:
+            self.root = value
+        elif isinstance(frame.container, list):
+            frame.container.append(value)
+        else:
+            frame.container[frame.key] = value
+
+    def feed(self, events: Iterable[Tuple[str, Any]]) -> bool:
+        """
+        Consume parser events
+
+        Returns:
+            True once every path is resolved (further events are not needed)
+        """
+        for event, value in events:
+            if self._skip:
+                if event in _CONTAINERS:
+                    self._skip += 1
+                elif event in _ENDS:
+                    self._skip -= 1
+                continue
+            if event == 'map_key':
+                self._stack[-1].key = value
+                continue
+            if event in _ENDS:
+                frame = self._stack.pop()
+                if frame.path is not None:
+                    self._resolve(frame.path)
+                    if self.done:
+                        return True
+                continue
+
+            frame = self._stack[-1] if self._stack else None
+            if frame is not None and frame.building:
+                role, path = _BUILD, None
+            else:
+                if frame is None:
+                    path = ()
+                elif isinstance(frame.container, list):
+                    path = frame.path + (len(frame.container),)
+                else:
+                    path = frame.path + (frame.key,)
+                role = self._role(path)
+
+            if role == _SKIP:
+                if frame is not None and isinstance(frame.container, list):
+                    frame.container.append(None)  # keeps later indices in place
+                if event in _CONTAINERS:
+                    self._skip = 1
+                continue
+
+            if event in _CONTAINERS:
+                container = _CONTAINERS[event]()
+                self._place(frame, container)
+                self._stack.append(_Frame(container, path, role == _BUILD))
+            else:
+                self._place(frame, value)
+                if path is not None:
+                    # A requested value, or a scalar where a container was expected
+                    self._resolve(path)
+                    if self.done:
+                        return True
+        return self.done
+
+
+def _decode_document(body: bytes, encoding: str) -> Any:
+    """Whole-body fallback, as response.json() / response.text did"""
+    try:
+        return json.loads(body)
+    except ValueError:
+        return {'text': body.decode(encoding, errors='replace')}
+
+
+async def _drain(chunks: AsyncIterator[bytes]) -> int:
+    """Read the rest of the body without parsing it"""
+    drained = 0
+    async for chunk in chunks:
+        drained += len(chunk)
+    return drained
+
+
+async def read_document(response: httpx.Response, paths: Optional[Sequence[Path]] = None) -> Any:
+    """
+    Read the requested parts of a streamed JSON response body
+
+    Args:
+        response: Response opened with stream=True (body not read yet)
+        paths: Key tuples the caller reads (None = the whole document,
+               empty = nothing; the body is drained unparsed)
+
+    Returns:
+        Document containing (at least) the values at paths, or
+        {'text': body} if the body is not a JSON object or array (at most
+        MALFORMED_TEXT_BYTES of it if the body starts as JSON but is malformed)
+    """
+    encoding = response.encoding or 'utf-8'
+    chunks = response.aiter_bytes()
+
+    if paths is not None and not paths:
+        await _drain(chunks)
+        return {}
+    if paths is None or not IJSON_AVAILABLE:
+        return _decode_document(b''.join([chunk async for chunk in chunks]), encoding)
+
+    # Sniff the first significant byte: plain-text bodies keep the old fallback
+    head: List[bytes] = []
+    first = b''
+    async for chunk in chunks:
+        head.append(chunk)
+        stripped = chunk.lstrip(_WHITESPACE)
+        if stripped:
+            first = stripped[:1]
+            break
+    if first not in (b'{', b'['):
+        return _decode_document(b''.join(head + [chunk async for chunk in chunks]), encoding)
+
+    document = PartialDocument(paths)
+    events = ijson.sendable_list()
+    parser = ijson.basic_parse_coro(events, use_float=True)
+    kept = bytearray()  # head of the body, for the text fallback if the JSON turns out malformed
+    parsed = 0
+    try:
+        for chunk in head:
+            kept += chunk[:MALFORMED_TEXT_BYTES - len(kept)]
+            parsed += len(chunk)
+            parser.send(chunk)
+        done = document.feed(events)
+        del events[:]
+        if not done:
+            async for chunk in chunks:
+                if len(kept) < MALFORMED_TEXT_BYTES:
+                    kept += chunk[:MALFORMED_TEXT_BYTES - len(kept)]
+                parsed += len(chunk)
+                parser.send(chunk)
+                done = document.feed(events)
+                del events[:]
+                if done:
+                    break
+        if done:
+            skipped = await _drain(chunks)
+            if skipped:
+                logger.debug(f"Response paths found after {parsed} bytes, {skipped} bytes left unparsed")
+        else:
+            parser.close()
+            document.feed(events)
+    except ijson.JSONError as e:
+        logger.warning(f"Malformed JSON response from {response.url}: {e}")
+        size = parsed + await _drain(chunks)
+        text = {'text': bytes(kept).decode(encoding, errors='replace')}
+        if size > len(kept):
+            text['truncated'] = True
+        return text
+    return document.root
+
@@ -0,0 +1,462 @@
+"""
+Pytest tests for the VNF Broker dictionary engine
+"""
+import pytest
+import httpx
+import yaml
+from pathlib import Path
+
+from dict_engine import DictionaryEngine
+from http_pool import VendorClientPool
+
+
+DICTIONARY = {
+    'vendor': 'pfSense',
+    'api_base_url': 'https://{{ vnf_mgmt_ip }}/api/v1',
+    'authentication': {
+        'type': 'basic',
+        'credentials': {'username': '{{ vnf_username }}', 'password': '{{ vnf_password }}'}
+    },
+    'timeout_seconds': 5,
+    'operations': {
+        'create_firewall_rule': {
+            'method': 'POST',
+            'endpoint': '/firewall/rule',
+            'request_template': '{"tracker": "{{ ruleId }}"}',
+            'response_mapping': {
+                'vendor_ref': '$.data.id',
+                'success_indicator': '$.code == 200'
+            },
+            'error_mapping': {409: 'VNF_CONFLICT'}
+        }
+    },
+    'post_operation_hooks': [{
+        'name': 'apply_changes',
+        'method': 'POST',
+        'endpoint': '/firewall/apply',
+        'condition': "operation in ['create_firewall_rule']"
+    }],
+    'health_check': {
+        'endpoint': '/system/status',
+        'success_indicator': '$.code == 200'
+    }
+}
+
+CONTEXT = {
+    'vnf_mgmt_ip': '10.0.0.1',
+    'vnf_username': 'admin',
+    'vnf_password': 'secret',
+    'ruleId': 'r-1'
+}
+
+
+@pytest.fixture
+def dictionary_path(tmp_path):
+    path = tmp_path / 'pfsense.yaml'
+    path.write_text(yaml.safe_dump(DICTIONARY))
+    return str(path)
+
+
+@pytest.fixture
+def vendor_calls():
+    return []
+
+
+@pytest.fixture
+def pool(vendor_calls):
+    def handler(request: httpx.Request) -> httpx.Response:
+        vendor_calls.append((request.method, request.url.path))
+        if request.url.path.endswith('/firewall/rule'):
+            return httpx.Response(200, json={'code': 200, 'data': {'id': 42}})
+        return httpx.Response(200, json={'code': 200})
+
+    return VendorClientPool(transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.asyncio
+async def test_execute_operation_reuses_pooled_client(dictionary_path, pool, vendor_calls):
+    engine = DictionaryEngine(dictionary_path, client_pool=pool)
+
+    first = await engine.execute_operation('create_firewall_rule', CONTEXT)
+    second = await engine.execute_operation('create_firewall_rule', CONTEXT)
+
+    assert first['success'] is True
+    assert first['vendor_ref'] == '42'
+    assert second['vendor_ref'] == '42'
+    assert vendor_calls.count(('POST', '/api/v1/firewall/apply')) == 2
+    # Operation and hook calls share one client for the appliance
+    assert pool.get_stats()['created'] == 1
+    assert pool.get_stats()['reused'] == 3
+    await pool.aclose()
+
+
+@pytest.mark.asyncio
+async def test_pool_separates_endpoints_and_evicts_idle(pool):
+    a = await pool.get_client('https://10.0.0.1/api/v1/firewall/rule')
+    b = await pool.get_client('https://10.0.0.1:443/api/v1/system/status')
+    c = await pool.get_client('https://10.0.0.2/api/v1/firewall/rule')
+
+    assert a is b
+    assert a is not c
+
+    pool.idle_timeout = 0
+    assert await pool.evict_idle() == 2
+    assert a.is_closed and c.is_closed
+    assert pool.get_stats()['endpoints'] == 0
+
+
+@pytest.mark.asyncio
+async def test_closed_pool_rejects_new_clients(pool):
+    client = await pool.get_client('https://10.0.0.1/')
+    await pool.aclose()
+
+    assert client.is_closed
+    with pytest.raises(RuntimeError):
+        await pool.get_client('https://10.0.0.1/')
+
+
+@pytest.mark.asyncio
+async def test_templates_compiled_once_at_load(dictionary_path, pool, monkeypatch):
+    import dict_engine
+
+    engine = DictionaryEngine(dictionary_path, client_pool=pool)
+    assert engine.get_cache_stats() == {'templates': 7, 'jsonpaths': 1, 'expressions': 2}
+
+    def _no_compile(*args, **kwargs):
+        raise AssertionError("template compiled on the request path")
+
+    monkeypatch.setattr(dict_engine, 'Template', _no_compile)
+    monkeypatch.setattr(dict_engine, 'parse', _no_compile)
+
+    result = await engine.execute_operation('create_firewall_rule', CONTEXT)
+    assert result['vendor_ref'] == '42'
+    assert engine.get_auth_config(CONTEXT)['password'] == 'secret'
+    await pool.aclose()
+
+
+def test_expression_evaluation():
+    from expression import compile_expression
+
+    response = {'code': 200, 'data': {'id': 7, 'local-port': '8080', 'tags': ['a', 'b']}}
+
+    assert compile_expression("$.code == 200")(response) is True
+    assert compile_expression("$.code == 200 and $.data.id > 5")(response) is True
+    assert compile_expression("$.data['local-port'] == '8080'")(response) is True
+    assert compile_expression("$.data.tags[1] == 'b'")(response) is True
+    assert compile_expression("$.missing.field == null")(response) is True
+    assert compile_expression("not ($.code != 200)")(response) is True
+    assert compile_expression("operation not in ['delete_nat_rule']")(None, {'operation': 'x'}) is True
+
+
+@pytest.mark.parametrize('source', [
+    "__import__('os').system('id')",
+    "$.code.__class__()",
+    "response_data.code == 200",
+    "$.code == 200; 1",
+    "",
+])
+def test_expression_rejects_code(source):
+    from expression import ExpressionError, compile_expression
+
+    with pytest.raises(ExpressionError):
+        compile_expression(source)
+
+
+@pytest.mark.asyncio
+async def test_success_indicator_and_hook_condition(dictionary_path, vendor_calls):
+    def handler(request: httpx.Request) -> httpx.Response:
+        vendor_calls.append((request.method, request.url.path))
+        if request.url.path.endswith('/firewall/rule'):
+            return httpx.Response(200, json={'code': 500, 'data': {'id': 9}})
+        return httpx.Response(200, json={'code': 200})
+
+    pool = VendorClientPool(transport=httpx.MockTransport(handler))
+    engine = DictionaryEngine(dictionary_path, client_pool=pool)
+
+    result = await engine.execute_operation('create_firewall_rule', CONTEXT)
+    assert result['success'] is False
+    assert ('POST', '/api/v1/firewall/apply') not in vendor_calls
+
+    assert engine.hooks[0].applies_to('create_firewall_rule') is True
+    assert engine.hooks[0].applies_to('delete_firewall_rule') is False
+    assert await engine.health_check(CONTEXT) is True
+    await pool.aclose()
+
+
+@pytest.mark.asyncio
+async def test_write_coalescing_commits_once_per_batch(tmp_path, vendor_calls):
+    import asyncio
+    import json
+
+    dictionary = dict(DICTIONARY, write_coalescing={'window_ms': 20, 'max_batch': 50})
+    dictionary['operations'] = dict(DICTIONARY['operations'], get_status={
+        'method': 'GET', 'endpoint': '/system/status'
+    })
+    path = tmp_path / 'pfsense.yaml'
+    path.write_text(yaml.safe_dump(dictionary))
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        vendor_calls.append((request.method, request.url.path))
+        if request.url.path.endswith('/firewall/rule'):
+            tracker = json.loads(request.content)['tracker']
+            if tracker == 'bad':
+                return httpx.Response(409, json={'message': 'exists'})
+            return httpx.Response(200, json={'code': 200, 'data': {'id': tracker}})
+        return httpx.Response(200, json={'code': 200})
+
+    pool = VendorClientPool(transport=httpx.MockTransport(handler))
+    engine = DictionaryEngine(str(path), client_pool=pool)
+
+    rule_ids = ['r-1', 'r-2', 'bad', 'r-4']
+    results = await asyncio.gather(*[
+        engine.execute_operation('create_firewall_rule', dict(CONTEXT, ruleId=rule_id))
+        for rule_id in rule_ids
+    ])
+
+    # Each caller gets its own result; writes ran in arrival order
+    assert [r['vendor_ref'] for r in results] == ['r-1', 'r-2', None, 'r-4']
+    assert results[2]['error_code'] == 'VNF_CONFLICT'
+    assert vendor_calls.count(('POST', '/api/v1/firewall/rule')) == 4
+    assert vendor_calls.count(('POST', '/api/v1/firewall/apply')) == 1
+    assert vendor_calls[-1] == ('POST', '/api/v1/firewall/apply')
+
+    # Operations without a commit hook bypass the queue
+    await engine.execute_operation('get_status', CONTEXT)
+    stats = engine.coalescer.get_stats()
+    assert stats['batches'] == 1 and stats['operations'] == 4 and stats['commits'] == 1
+    assert stats['appliances'] == 0
+    await pool.aclose()
+
+
+@pytest.mark.asyncio
+async def test_response_extraction_reads_only_mapped_paths(tmp_path):
+    import json
+    import ijson
+    from response_extract import PartialDocument
+
+    rules = [{'policyid': i, 'name': f'rule-{i}', 'srcaddr': [{'name': 'all'}]} for i in range(2000)]
+    listing = {'status': 'success', 'results': rules, 'mkey': 'tail'}
+    body = json.dumps(listing).encode()
+
+    # Parsing stops once the mapped paths are resolved; skipped list entries keep their index
+    document = PartialDocument([('status',), ('results', 1, 'policyid')])
+    events = ijson.sendable_list()
+    parser = ijson.basic_parse_coro(events, use_float=True)
+    parsed = 0
+    for offset in range(0, len(body), 1024):
+        parser.send(body[offset:offset + 1024])
+        parsed += 1024
+        if document.feed(events):
+            break
+        del events[:]
+    assert parsed < len(body) // 100
+    assert document.root == {'status': 'success', 'results': [None, {'policyid': 1}]}
+
+    dictionary = dict(DICTIONARY, post_operation_hooks=[])
+    dictionary['operations'] = {
+        'get_rule': {
+            'method': 'GET', 'endpoint': '/firewall/rule',
+            'response_mapping': {'vendor_ref': '$.results[1].name', 'success_indicator': "$.status == 'success'"}
+        },
+        'find_rule': {
+            'method': 'GET', 'endpoint': '/firewall/rule',
+            'response_mapping': {'vendor_ref': '$.results[*].name'}
+        },
+        'list_rules': {
+            'method': 'GET', 'endpoint': '/firewall/rule',
+            'response_mapping': {'list_path': '$.results'}
+        },
+        'get_text': {
+            'method': 'GET', 'endpoint': '/text',
+            'response_mapping': {'success_indicator': "$.text == 'OK'"}
+        }
+    }
+    path = tmp_path / 'fortigate.yaml'
+    path.write_text(yaml.safe_dump(dictionary))
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith('/text'):
+            return httpx.Response(200, text='OK')
+        return httpx.Response(200, content=body, headers={'Content-Type': 'application/json'})
+
+    pool = VendorClientPool(transport=httpx.MockTransport(handler))
+    engine = DictionaryEngine(str(path), client_pool=pool)
+    assert engine.operations['get_rule'].response_paths == (('results', 1, 'name'), ('status',))
+    assert engine.operations['find_rule'].response_paths is None
+
+    result = await engine.execute_operation('get_rule', CONTEXT)
+    assert result['success'] is True and result['vendor_ref'] == 'rule-1'
+    assert (await engine.execute_operation('find_rule', CONTEXT))['vendor_ref'] == 'rule-0'
+    listed = await engine.execute_operation('list_rules', CONTEXT)
+    assert listed['items'] == rules
+    assert (await engine.execute_operation('get_text', CONTEXT))['success'] is True
+    # Streamed responses were fully read, so the connection stayed reusable
+    assert pool.get_stats()['created'] == 1
+    await pool.aclose()
+
+
+@pytest.mark.asyncio
+async def test_malformed_json_response_falls_back_to_text():
+    from response_extract import read_document
+
+    body = b'{"status": "success", "results": [{"policyid": 1, "name": "rule-'  # cut off mid-string
+    bodies = {
+        '/truncated': body,
+        '/malformed': b'{"status": success}',
+    }
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=bodies[request.url.path])
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        for url, content in bodies.items():
+            async with client.stream('GET', f'https://vnf{url}') as response:
+                document = await read_document(response, [('results', 0, 'name')])
+            # The bytes already fed to the parser are kept, not replaced by {}
+            assert document == {'text': content.decode()}
+
+
+@pytest.mark.asyncio
+async def test_malformed_json_fallback_keeps_only_the_head(monkeypatch):
+    import response_extract
+
+    monkeypatch.setattr(response_extract, 'MALFORMED_TEXT_BYTES', 1024)
+    # Malformed well past the limit: only the first 1 KB is kept, the rest is drained
+    body = b'{"results": [' + b'{"name": "rule"}, ' * 2000 + b'oops]}'
+    chunks = [body[i:i + 500] for i in range(0, len(body), 500)]
+
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=stream())
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        async with client.stream('GET', 'https://vnf/big') as response:
+            document = await response_extract.read_document(response, [('missing',)])
+            assert response.is_stream_consumed
+    assert document == {'text': body[:1024].decode(), 'truncated': True}
+
+
+def test_dictionary_registry_swaps_immutable_snapshots(tmp_path):
+    import os
+    from dictionary_registry import DictionaryRegistry
+
+    def write(name, content, mtime):
+        path = tmp_path / name
+        path.write_text(content)
+        os.utime(path, ns=(mtime, mtime))
+
+    write('pfsense.yaml', yaml.safe_dump(DICTIONARY), 1_000_000_000)
+    write('fortigate.yml', yaml.safe_dump(dict(DICTIONARY, vendor='Fortinet')), 1_000_000_000)
+    (tmp_path / 'README.txt').write_text('not a dictionary')
+
+    registry = DictionaryRegistry(tmp_path)
+    first = registry.load()
+    assert first.version == 1 and sorted(first.engines) == ['fortigate', 'pfsense']
+    assert registry.get('PfSense').vendor == 'pfSense'
+    with pytest.raises(AttributeError):
+        first.version = 2
+    with pytest.raises(TypeError):
+        first.engines['vyos'] = None
+
+    # No change (or only a touch): same snapshot, nothing recompiled
+    assert registry.load() is first
+    write('pfsense.yaml', yaml.safe_dump(DICTIONARY), 2_000_000_000)
+    assert registry.load() is first and registry.stats['compiled'] == 2
+
+    # An edit recompiles that vendor only; a request holding the old snapshot keeps its engine
+    in_flight = registry.snapshot.engine('pfsense')
+    write('pfsense.yaml', yaml.safe_dump(dict(DICTIONARY, timeout_seconds=9)), 3_000_000_000)
+    second = registry.load()
+    assert second.version == 2 and registry.get('pfsense').timeout == 9
+    assert in_flight.timeout == 5 and first.engine('pfsense') is in_flight
+    assert second.engine('fortigate') is first.engine('fortigate')
+
+    # A broken edit keeps the last good version and is reported (and not retried until it changes)
+    write('pfsense.yaml', 'operations: [unclosed', 4_000_000_000)
+    third = registry.load()
+    assert third.engine('pfsense') is second.engine('pfsense') and 'pfsense' in third.errors
+    assert registry.load() is third and registry.stats['failed'] == 1
+
+    os.remove(tmp_path / 'fortigate.yml')
+    fourth = registry.load()
+    assert sorted(fourth.engines) == ['pfsense'] and fourth.version == 4
+    with pytest.raises(KeyError):
+        fourth.engine('fortigate')
+
+
+SHIPPED_DICTIONARIES = Path(__file__).resolve().parent.parent / 'dictionaries'
+
+
+def test_registry_serves_shipped_dictionaries_by_declared_vendor(tmp_path):
+    import shutil
+    from dictionary_registry import DictionaryRegistry
+
+    for name in ('pfsense_2.7.yaml', 'pfsense-dictionary.yaml', 'pfsense-test.yaml'):
+        shutil.copy(SHIPPED_DICTIONARIES / name, tmp_path / name)
+
+    snapshot = DictionaryRegistry(tmp_path).load()
+    assert snapshot.vendors == {'pfsense': 'pfsense_2.7'}
+    assert snapshot.engine('pfSense') is snapshot.engine('pfsense_2.7')
+    # 'services' format dictionaries are not served by the engine, and are reported
+    assert sorted(snapshot.errors) == ['pfsense-dictionary', 'pfsense-test']
+    with pytest.raises(KeyError):
+        snapshot.engine('netgate')
+
+
+@pytest.mark.asyncio
+async def test_broker_creates_rule_through_snapshot_dictionary(tmp_path, monkeypatch):
+    import json
+    import shutil
+    import broker
+    from dictionary_registry import DictionaryRegistry
+
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.path == '/api/v1/firewall/rule':
+            return httpx.Response(200, json={'code': 200, 'data': {'id': 17}})
+        return httpx.Response(200, json={'code': 200})
+
+    shutil.copy(SHIPPED_DICTIONARIES / 'pfsense_2.7.yaml', tmp_path / 'pfsense_2.7.yaml')
+    registry = DictionaryRegistry(tmp_path, client_pool=VendorClientPool(transport=httpx.MockTransport(handler)))
+    registry.load()
+    monkeypatch.setattr(broker, 'dictionary_registry', registry)
+    monkeypatch.setattr(broker.config, 'VNF_HOST', '10.0.0.1')
+    monkeypatch.setattr(broker.config, 'VNF_USERNAME', 'admin')
+
+    cmd = broker.CreateFirewallRuleCmd(
+        ruleId='web-1', interface='wan', direction='in', action='allow', protocol='tcp',
+        dst={'cidr': '192.168.1.10/32'}, ports={'dst': '443'})
+    response = await broker.get_dictionary_engine('pfsense').execute_create_rule(cmd, 'trace-1')
+
+    assert response.ok and response.ruleId == 'web-1' and response.vendorRef == '17'
+    create = requests[0]
+    assert str(create.url) == 'https://10.0.0.1/api/v1/firewall/rule'
+    body = json.loads(create.content)
+    assert body['type'] == 'pass' and body['dst'] == '192.168.1.10/32' and body['src'] == 'any'
+    assert body['dstport'] == '443' and 'srcport' not in body and body['tracker'] == 'web-1'
+
+    # No dictionary declares the vendor: an error response, not a mocked success
+    missing = await broker.get_dictionary_engine('vyos').execute_create_rule(cmd, 'trace-2')
+    assert not missing.ok and missing.error.code == 'VNF_INVALID'
+
+
+def test_broker_config_reads_http_pool_and_dictionaries(tmp_path):
+    import broker
+    from http_pool import VendorClientPool
+
+    path = tmp_path / 'broker.yaml'
+    path.write_text((Path(broker.__file__).parent / 'broker.yaml.example').read_text()
+                    .replace('maxConnections: 20 ', 'maxConnections: 64 '))
+    loaded = broker.load_broker_config(path)
+    assert loaded.HTTP_POOL['maxConnections'] == 64 and loaded.HTTP_POOL['idleTimeout'] == 300
+    assert loaded.DICTIONARY_PATH == Path('/etc/vnfbroker/dictionaries')
+    assert loaded.DICTIONARY_AUTO_RELOAD is False and loaded.VNF_VENDOR == 'pfsense'
+    assert VendorClientPool.from_config(loaded.HTTP_POOL)
+
+    # No file: the built-in defaults
+    assert broker.load_broker_config(tmp_path / 'missing.yaml').HTTP_POOL == broker.BrokerConfig.HTTP_POOL
@@ -0,0 +1,190 @@
+"""
+Pytest tests for the VNF Broker Redis idempotency store
+"""
+from pathlib import Path
+
+import pytest
+import redis
+
+import redis_store
+
+
+def test_codec_and_near_cache_are_shared_with_python_broker():
+    import cache_codec
+    import near_cache
+
+    shared = Path(__file__).resolve().parent.parent / 'python-broker'
+    assert Path(cache_codec.__file__).resolve() == shared / 'cache_codec.py'
+    assert Path(near_cache.__file__).resolve() == shared / 'near_cache.py'
+    assert redis_store.CacheCodec is cache_codec.CacheCodec
+    assert redis_store.KeyspaceInvalidator is near_cache.KeyspaceInvalidator
+
+
+class FakeClock:
+    """Stands in for the time module: sleeps advance the clock instead of blocking"""
+
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeRedis:
+    """Just enough of redis.Redis for the admin paths: paged SCAN, UNLINK, exact HLLs"""
+
+    def __init__(self, keys=(), page_size: int = 3, fail_on_scan: int = None):
+        self.data = {key.encode(): b'x' for key in keys}
+        self.sets = {}
+        self.page_size = page_size
+        self.fail_on_scan = fail_on_scan
+        self.order = []
+        self.scans = []
+        self.unlinks = []
+
+    def scan(self, cursor=0, match=None, count=None):
+        self.scans.append((cursor, match, count))
+        if self.fail_on_scan is not None and len(self.scans) == self.fail_on_scan:
+            raise redis.ConnectionError("connection reset")
+        if cursor == 0:
+            self.order = sorted(self.data)  # the cursor walks a fixed order, as Redis' hash-slot order
+        prefix = match.rstrip('*').encode()
+        page = self.order[cursor:cursor + self.page_size]
+        following = cursor + self.page_size
+        return (following if following < len(self.order) else 0), [key for key in page if key.startswith(prefix)]
+
+    def unlink(self, *keys):
+        self.unlinks.append(keys)
+        removed = 0
+        for key in keys:
+            name = key if isinstance(key, bytes) else key.encode()
+            removed += self.data.pop(name, None) is not None
+            removed += self.sets.pop(name, None) is not None
+        return removed
+
+    def pfadd(self, name, *values):
+        self.sets.setdefault(name.encode(), set()).update(values)
+
+    def pfcount(self, *names):
+        return len(set().union(*(self.sets.get(name.encode(), set()) for name in names)))
+
+    def dbsize(self):
+        return len(self.data) + len(self.sets)
+
+    def info(self, section=None):
+        return {'keyspace_hits': 3, 'keyspace_misses': 1}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(redis_store, 'time', clock)
+    return clock
+
+
+def make_store(client: FakeRedis, ttl_hours: int = 24) -> redis_store.RedisIdempotencyStore:
+    store = redis_store.RedisIdempotencyStore('redis://localhost:6379/0', ttl_hours)
+    store.client = client  # redis.from_url does not connect until first use
+    return store
+
+
+def idempotency_keys(count: int):
+    return [f"{redis_store.RedisIdempotencyStore.KEY_PREFIX}rule-{i:02d}" for i in range(count)]
+
+
+def test_clear_all_walks_scan_cursor_and_unlinks_per_batch(clock):
+    client = FakeRedis(idempotency_keys(7) + ['other:key'], page_size=3)
+    store = make_store(client)
+    reports = []
+
+    assert store.clear_all(batch_size=3, progress=reports.append) == 7
+
+    # Cursor handed back on every call until Redis returns 0
+    assert [(cursor, count) for cursor, _, count in client.scans] == [(0, 3), (3, 3), (6, 3)]
+    assert {match for _, match, _ in client.scans} == {'vnf:idempotency:*'}
+    # One UNLINK per batch ('other:key' is filtered out of the first), then the stats HyperLogLogs
+    assert [len(keys) for keys in client.unlinks[:-1]] == [2, 3, 2]
+    assert client.unlinks[-1] == tuple(store._stats_buckets())
+    assert list(client.data) == [b'other:key']
+    assert reports == [
+        {'scanned_batches': 1, 'deleted': 2, 'elapsed': 0.0},
+        {'scanned_batches': 2, 'deleted': 5, 'elapsed': 0.0},
+        {'scanned_batches': 3, 'deleted': 7, 'elapsed': 0.0},
+    ]
+    assert clock.sleeps == []
+
+
+def test_clear_all_throttles_to_max_keys_per_second(clock):
+    client = FakeRedis(idempotency_keys(9), page_size=3)
+    store = make_store(client)
+    reports = []
+
+    assert store.clear_all(batch_size=3, max_keys_per_second=6, progress=reports.append) == 9
+
+    # 3 keys at 6/s is half a second ahead of schedule after every batch
+    assert clock.sleeps == pytest.approx([0.5, 0.5, 0.5])
+    assert [report['elapsed'] for report in reports] == [0.0, 0.5, 1.0]
+
+
+def test_clear_all_returns_partial_count_on_redis_error(clock):
+    client = FakeRedis(idempotency_keys(7), page_size=3, fail_on_scan=3)
+    store = make_store(client)
+
+    assert store.clear_all(batch_size=3) == 6
+    # Failed before reaching the stats keys
+    assert len(client.unlinks) == 2
+    assert len(client.data) == 1
+
+
+def test_stats_buckets_cover_ttl_plus_current_hour(clock):
+    store = make_store(FakeRedis(), ttl_hours=2)
+    hour = redis_store.RedisIdempotencyStore.STATS_BUCKET_SECONDS
+
+    buckets = store._stats_buckets(now=10 * hour + 1)
+    assert buckets == [f"vnf:idempotency-stats:hll:{n}" for n in (10, 9, 8)]
+    # Last second of an hour, then the first of the next: the window moves by one
+    assert store._stats_buckets(now=11 * hour - 1) == buckets
+    assert store._stats_buckets(now=11 * hour) == [f"vnf:idempotency-stats:hll:{n}" for n in (11, 10, 9)]
+
+
+def test_count_entries_unions_live_buckets(clock):
+    client = FakeRedis()
+    store = make_store(client, ttl_hours=1)
+    hour = redis_store.RedisIdempotencyStore.STATS_BUCKET_SECONDS
+
+    clock.now = 100 * hour + 10
+    current, previous = store._stats_buckets()
+    client.pfadd(current, 'vnf:idempotency:a', 'vnf:idempotency:b')
+    client.pfadd(previous, 'vnf:idempotency:b', 'vnf:idempotency:c')
+    client.pfadd('vnf:idempotency-stats:hll:98', 'vnf:idempotency:old')
+    assert store.count_entries() == 3
+
+    # Crossing the hour drops bucket 99 from the window
+    clock.now = 101 * hour
+    assert store.count_entries() == 2
+
+    stats = store.get_stats()
+    assert stats['cached_rules'] == 2
+    assert stats['cached_rules_estimated'] is True
+    assert stats['hit_rate'] == 75.0
+
+
+def test_fallback_clear_all_matches_redis_signature():
+    import inspect
+
+    redis_params = inspect.signature(redis_store.RedisIdempotencyStore.clear_all).parameters
+    fallback_params = inspect.signature(redis_store.FallbackIdempotencyStore.clear_all).parameters
+    assert list(fallback_params) == list(redis_params)
+    assert [p.default for p in fallback_params.values()] == [p.default for p in redis_params.values()]
+
+    store = redis_store.FallbackIdempotencyStore()
+    store.set('rule-1', {'ok': True})
+    assert store.clear_all(batch_size=10, max_keys_per_second=5, progress=print) == 1
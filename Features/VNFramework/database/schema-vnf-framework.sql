@@ -132,6 +132,19 @@ CREATE TABLE IF NOT EXISTS `vnf_broker_audit` (
   CONSTRAINT `fk_audit_vnf_id` FOREIGN KEY (`vnf_appliance_id`) REFERENCES `vnf_appliances` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
+-- Completed broker operations by idempotency key, written behind by the broker
+-- so retries stay deduplicated after a Redis flush (see DURABLE_STORE_URL)
+CREATE TABLE IF NOT EXISTS `vnf_broker_operations` (
+  `idempotency_key` varchar(255) NOT NULL COMMENT 'Broker idempotency key (operation + parameter hash)',
+  `operation` varchar(100) NOT NULL COMMENT 'Operation (e.g., firewall.create)',
+  `vnf_instance_id` varchar(128) COMMENT 'UUID of the target VNF appliance',
+  `response` MEDIUMTEXT NOT NULL COMMENT 'JSON response returned to CloudStack',
+  `created` datetime NOT NULL COMMENT 'Date completed (UTC)',
+  `expires` datetime NOT NULL COMMENT 'Replayed until this date (UTC)',
+  PRIMARY KEY (`idempotency_key`),
+  KEY `idx_broker_operations_expires` (`expires`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
 -- =====================================================
 -- 6. Network Details Extension
 -- =====================================================
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+VNF Broker Bulkheads - Build2
+=============================
+Concurrency limits per VNF instance and per tenant (JWT subject).
+
+A small appliance can only process a few configuration calls at once. Without
+a bound, one tenant's bulk reapply floods it and every other tenant queues
+behind that burst. Each compartment (kind + key) has:
+- a concurrency limit (slots held for the duration of the VNF call)
+- a bounded FIFO wait queue; arrivals beyond it are rejected immediately
+- deadline-aware admission: a caller whose estimated wait (from the moving
+  average of recent hold times) already overruns its deadline is rejected
+  up front instead of queueing, and a queued caller gives up at its deadline
+
+Slots are acquired subject-first, then VNF, so a tenant waiting on its own
+quota never holds a slot on a shared appliance.
+
+- Bulkhead:      threading implementation (Flask / gunicorn threads)
+- AsyncBulkhead: asyncio implementation (ASGI serving mode)
+"""
+
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Any, Optional, Callable, Tuple, List
+
+KINDS = ('subject', 'vnf')  # acquisition order
+
+
+class BulkheadRejected(Exception):
+    """Raised when a call cannot get a bulkhead slot before its deadline"""
+
+    def __init__(self, kind: str, key: str, reason: str, retry_after: float):
+        super().__init__(f"Bulkhead full for {kind} {key} ({reason})")
+        self.kind = kind
+        self.key = key
+        self.reason = reason  # queue_full | deadline | timeout
+        self.retry_after = retry_after
+
+
+class _Compartment:
+    """Slots and wait queue for one (kind, key)"""
+
+    __slots__ = ('limit', 'active', 'waiters', 'hold_time')
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiters: deque = deque()
+        self.hold_time = 0.0  # moving average of seconds a slot is held
+
+    def record_hold(self, held: float, alpha: float):
+        if self.hold_time == 0.0:
+            self.hold_time = held
+        else:
+            self.hold_time += alpha * (held - self.hold_time)
+
+    def estimated_wait(self, position: int) -> float:
+        """Expected seconds until the caller at queue position (1-based) gets a slot"""
+        return self.hold_time * position / self.limit
+
+
+class _BulkheadBase:
+    """Shared admission policy and bookkeeping"""
+
+    def __init__(
+        self,
+        limits: Dict[str, int],
+        max_queue: int = 100,
+        max_wait: float = 10.0,
+        alpha: float = 0.2,
+        on_admit: Optional[Callable[[str, int, float], None]] = None,
+        on_reject: Optional[Callable[[str, str], None]] = None
+    ):
+        """
+        Initialize bulkhead
+
+        Args:
+            limits: Concurrent calls per key for each kind ('vnf', 'subject');
+                    a missing or 0 limit disables that kind
+            max_queue: Callers allowed to wait per compartment (0 = no queueing)
+            max_wait: Default seconds a caller may wait when no deadline is given
+            alpha: Smoothing factor for the hold-time moving average
+            on_admit: Callback(kind, queue_depth, waited_seconds) per admitted call
+            on_reject: Callback(kind, reason) per rejected call
+        """
+        self.limits = {kind: limit for kind, limit in limits.items() if limit}
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.alpha = alpha
+        self.on_admit = on_admit
+        self.on_reject = on_reject
+        self._compartments: Dict[Tuple[str, str], _Compartment] = {}
+        self.stats = {'admitted': 0, 'queued': 0, 'rejected': 0}
+
+    def _keys(self, vnf: Optional[str], subject: Optional[str]) -> List[Tuple[str, str]]:
+        wanted = {'vnf': vnf, 'subject': subject}
+        return [(kind, wanted[kind]) for kind in KINDS if wanted[kind] and kind in self.limits]
+
+    def _deadline(self, deadline: Optional[float]) -> float:
+        return deadline if deadline is not None else time.monotonic() + self.max_wait
+
+    def _compartment(self, kind: str, key: str) -> _Compartment:
+        comp = self._compartments.get((kind, key))
+        if comp is None:
+            comp = self._compartments[(kind, key)] = _Compartment(self.limits[kind])
+        return comp
+
+    def _check_queue(self, kind: str, key: str, comp: _Compartment, deadline: float, now: float):
+        """Reject a caller that would overflow the queue or cannot be served by its deadline"""
+        position = len(comp.waiters) + 1
+        estimate = comp.estimated_wait(position)
+        if position > self.max_queue:
+            self._rejected(kind, key, 'queue_full', estimate)
+        if now + estimate > deadline:
+            self._rejected(kind, key, 'deadline', estimate)
+
+    def _rejected(self, kind: str, key: str, reason: str, estimate: float):
+        self.stats['rejected'] += 1
+        if self.on_reject:
+            self.on_reject(kind, reason)
+        raise BulkheadRejected(kind, key, reason, max(math.ceil(estimate), 1))
+
+    def _admitted(self, kind: str, depth: int, waited: float):
+        self.stats['admitted'] += 1
+        if depth:
+            self.stats['queued'] += 1
+        if self.on_admit:
+            self.on_admit(kind, depth, waited)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get bulkhead statistics, with per-compartment usage for busy compartments"""
+        compartments = {}
+        for (kind, key), comp in list(self._compartments.items()):
+            if comp.active or comp.waiters:
+                compartments.setdefault(kind, {})[key] = {
+                    'active': comp.active,
+                    'queued': len(comp.waiters),
+                    'limit': comp.limit,
+                    'hold_time': round(comp.hold_time, 4)
+                }
+        return {
+            'limits': dict(self.limits),
+            'max_queue': self.max_queue,
+            'compartments': compartments,
+            **self.stats
+        }
+
+
+class Bulkhead(_BulkheadBase):
+    """Thread-safe bulkhead for the Flask broker"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def _acquire(self, kind: str, key: str, deadline: float) -> _Compartment:
+        with self._lock:
+            comp = self._compartment(kind, key)
+            if comp.active < comp.limit and not comp.waiters:
+                comp.active += 1
+                self._admitted(kind, 0, 0.0)
+                return comp
+            started = time.monotonic()
+            self._check_queue(kind, key, comp, deadline, started)
+            waiter = threading.Event()
+            comp.waiters.append(waiter)
+            depth = len(comp.waiters)
+
+        waiter.wait(max(deadline - started, 0.0))
+
+        with self._lock:
+            # A release may hand the slot over between the timeout and this lock
+            if not waiter.is_set():
+                comp.waiters.remove(waiter)
+                self._rejected(kind, key, 'timeout', comp.estimated_wait(len(comp.waiters) + 1))
+            self._admitted(kind, depth, time.monotonic() - started)
+        return comp
+
+    def _release(self, comp: _Compartment, held: Optional[float]):
+        with self._lock:
+            if held is not None:
+                comp.record_hold(held, self.alpha)
+            if comp.waiters:
+                # Hand the slot straight to the oldest waiter (FIFO fairness)
+                comp.waiters.popleft().set()
+            else:
+                comp.active -= 1
+
+    @contextmanager
+    def slot(self, vnf: Optional[str] = None, subject: Optional[str] = None,
+             deadline: Optional[float] = None):
+        """
+        Hold a slot in the VNF and subject compartments for the enclosed call
+
+        Args:
+            vnf: vnfInstanceId the call goes to
+            subject: JWT subject (tenant) making the call
+            deadline: time.monotonic() by which a slot must be held
+                      (defaults to now + max_wait)
+
+        Raises:
+            BulkheadRejected: Queue full or deadline cannot be met
+        """
+        deadline = self._deadline(deadline)
+        held: List[_Compartment] = []
+        started = None
+        try:
+            for kind, key in self._keys(vnf, subject):
+                held.append(self._acquire(kind, key, deadline))
+            started = time.monotonic()
+            yield
+        finally:
+            elapsed = time.monotonic() - started if started is not None else None
+            for comp in reversed(held):
+                self._release(comp, elapsed)
+
+
+class AsyncBulkhead(_BulkheadBase):
+    """Bulkhead for the ASGI broker (one event loop, no locking needed)"""
+
+    async def _acquire(self, kind: str, key: str, deadline: float) -> _Compartment:
+        comp = self._compartment(kind, key)
+        if comp.active < comp.limit and not comp.waiters:
+            comp.active += 1
+            self._admitted(kind, 0, 0.0)
+            return comp
+        started = time.monotonic()
+        self._check_queue(kind, key, comp, deadline, started)
+        waiter = asyncio.get_running_loop().create_future()
+        comp.waiters.append(waiter)
+        depth = len(comp.waiters)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), max(deadline - started, 0.0))
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                waiter.cancel()
+                comp.waiters.remove(waiter)
+                self._rejected(kind, key, 'timeout', comp.estimated_wait(len(comp.waiters) + 1))
+        except asyncio.CancelledError:
+            if waiter.done():
+                # Slot was handed over just as we were cancelled - pass it on
+                self._release(comp, None)
+            else:
+                waiter.cancel()
+                comp.waiters.remove(waiter)
+            raise
+        self._admitted(kind, depth, time.monotonic() - started)
+        return comp
+
+    def _release(self, comp: _Compartment, held: Optional[float]):
+        if held is not None:
+            comp.record_hold(held, self.alpha)
+        if comp.waiters:
+            comp.waiters.popleft().set_result(None)
+        else:
+            comp.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, vnf: Optional[str] = None, subject: Optional[str] = None,
+                   deadline: Optional[float] = None):
+        """Async counterpart of Bulkhead.slot"""
+        deadline = self._deadline(deadline)
+        held: List[_Compartment] = []
+        started = None
+        try:
+            for kind, key in self._keys(vnf, subject):
+                held.append(await self._acquire(kind, key, deadline))
+            started = time.monotonic()
+            yield
+        finally:
+            elapsed = time.monotonic() - started if started is not None else None
+            for comp in reversed(held):
+                self._release(comp, elapsed)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+VNF Broker Cache Codec - Build2
+===============================
+Compact encoding for idempotency cache entries.
+
+Entries are held for 24h, so storing whole JSON documents costs a lot of
+Redis memory. CacheCodec writes a 4-byte header followed by the payload:
+
+    0xC1 | version | serializer | compression
+
+- serializer: json, msgpack or cbor (msgpack/cbor2 packages optional)
+- compression: none, zstd, or zstd with a shared trained dictionary
+  (zstandard package optional; applied only above compress_min_size)
+
+0xC1 never starts valid JSON, msgpack or UTF-8, so decode() tells new
+entries from legacy plain-JSON ones (str or bytes) and reads both. Rolling
+out a new codec therefore needs no flush: old entries age out with their TTL.
+The `json` serializer without compression writes plain legacy JSON, so
+roll back to it before downgrading to a broker that cannot read headers.
+"""
+
+import json
+import logging
+import threading
+from typing import Dict, Any, Optional, Union, List, Callable
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import cbor2
+    CBOR_AVAILABLE = True
+except ImportError:
+    CBOR_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+MAGIC = 0xC1
+FORMAT_VERSION = 1
+
+SERIALIZERS = {'json': 0, 'msgpack': 1, 'cbor': 2}
+COMPRESSIONS = {'none': 0, 'zstd': 1, 'zstd_dict': 2}
+
+
+class CodecError(ValueError):
+    """Entry cannot be decoded (unknown format, missing package or dictionary)"""
+
+
+def _serializer_available(name: str) -> bool:
+    return {'json': True, 'msgpack': MSGPACK_AVAILABLE, 'cbor': CBOR_AVAILABLE}.get(name, False)
+
+
+class CacheCodec:
+    """Versioned encoder/decoder for cached response documents"""
+
+    def __init__(
+        self,
+        serializer: str = 'msgpack',
+        compression: Optional[str] = 'zstd',
+        zstd_dictionary: Optional[bytes] = None,
+        compress_min_size: int = 128,
+        level: int = 3,
+        on_encode: Optional[Callable[[int, int], None]] = None
+    ):
+        """
+        Initialize codec
+
+        Args:
+            serializer: json | msgpack | cbor (falls back to json if the package is missing)
+            compression: zstd or None (falls back to None if zstandard is missing)
+            zstd_dictionary: Trained zstd dictionary shared by every worker
+            compress_min_size: Payloads smaller than this are stored uncompressed
+            level: zstd compression level
+            on_encode: Callback(raw_bytes, stored_bytes) per encoded entry
+        """
+        if serializer not in SERIALIZERS:
+            raise ValueError(f"Unknown cache serializer: {serializer}")
+        if not _serializer_available(serializer):
+            logger.warning(f"Cache serializer '{serializer}' requested but its package is not installed, using json")
+            serializer = 'json'
+        if compression in (None, 'none'):
+            compression = None
+        elif compression != 'zstd':
+            raise ValueError(f"Unknown cache compression: {compression}")
+        elif not ZSTD_AVAILABLE:
+            logger.warning("zstd compression requested but 'zstandard' package not installed, storing uncompressed")
+            compression = None
+
+        self.serializer = serializer
+        self.compression = compression
+        self.compress_min_size = compress_min_size
+        self.level = level
+        self.on_encode = on_encode
+
+        self._dictionary = None
+        if compression and zstd_dictionary:
+            self._dictionary = zstandard.ZstdCompressionDict(zstd_dictionary)
+        # zstd (de)compressor objects are not thread-safe
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'encoded': 0,
+            'decoded': 0,
+            'legacy_decoded': 0,
+            'decode_errors': 0,
+            'raw_bytes': 0,
+            'stored_bytes': 0
+        }
+
+    @property
+    def legacy(self) -> bool:
+        """True when entries are written as plain JSON (no header)"""
+        return self.serializer == 'json' and self.compression is None
+
+    def _compressor(self):
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(
+                level=self.level, dict_data=self._dictionary)
+        return compressor
+
+    def _decompressor(self, with_dictionary: bool):
+        attr = 'dict_decompressor' if with_dictionary else 'decompressor'
+        decompressor = getattr(self._local, attr, None)
+        if decompressor is None:
+            if with_dictionary and self._dictionary is None:
+                raise CodecError("Entry needs a zstd dictionary but none is configured")
+            decompressor = zstandard.ZstdDecompressor(dict_data=self._dictionary if with_dictionary else None)
+            setattr(self._local, attr, decompressor)
+        return decompressor
+
+    def _serialize(self, obj: Any) -> bytes:
+        if self.serializer == 'msgpack':
+            return msgpack.packb(obj, use_bin_type=True)
+        if self.serializer == 'cbor':
+            return cbor2.dumps(obj)
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+    @staticmethod
+    def _deserialize(serializer_id: int, payload: bytes) -> Any:
+        if serializer_id == SERIALIZERS['json']:
+            return json.loads(payload)
+        if serializer_id == SERIALIZERS['msgpack']:
+            if not MSGPACK_AVAILABLE:
+                raise CodecError("Entry is msgpack-encoded but 'msgpack' is not installed")
+            return msgpack.unpackb(payload, raw=False)
+        if serializer_id == SERIALIZERS['cbor']:
+            if not CBOR_AVAILABLE:
+                raise CodecError("Entry is CBOR-encoded but 'cbor2' is not installed")
+            return cbor2.loads(payload)
+        raise CodecError(f"Unknown serializer id {serializer_id}")
+
+    def encode(self, obj: Any) -> Union[bytes, str]:
+        """
+        Encode a response document for storage
+
+        Returns:
+            Plain JSON str in legacy mode, otherwise header + payload bytes
+        """
+        raw = json.dumps(obj)
+        if self.legacy:
+            self._count(len(raw), len(raw))
+            return raw
+
+        payload = self._serialize(obj)
+        compression = 'none'
+        if self.compression and len(payload) >= self.compress_min_size:
+            compressed = self._compressor().compress(payload)
+            if len(compressed) < len(payload):
+                payload = compressed
+                compression = 'zstd_dict' if self._dictionary is not None else 'zstd'
+
+        data = bytes((MAGIC, FORMAT_VERSION, SERIALIZERS[self.serializer], COMPRESSIONS[compression])) + payload
+        self._count(len(raw), len(data))
+        return data
+
+    def decode(self, data: Union[bytes, str]) -> Any:
+        """
+        Decode a stored entry written by any codec version (or legacy JSON)
+
+        Raises:
+            CodecError: Entry cannot be decoded by this broker
+        """
+        try:
+            if isinstance(data, str) or not data or data[0] != MAGIC:
+                value = json.loads(data)
+                with self._stats_lock:
+                    self.stats['legacy_decoded'] += 1
+                return value
+
+            if len(data) < 4 or data[1] != FORMAT_VERSION:
+                raise CodecError(f"Unsupported cache entry version {data[1] if len(data) > 1 else None}")
+            serializer_id, compression_id = data[2], data[3]
+            payload = bytes(data[4:])
+            if compression_id == COMPRESSIONS['zstd'] or compression_id == COMPRESSIONS['zstd_dict']:
+                if not ZSTD_AVAILABLE:
+                    raise CodecError("Entry is zstd-compressed but 'zstandard' is not installed")
+                payload = self._decompressor(compression_id == COMPRESSIONS['zstd_dict']).decompress(payload)
+            elif compression_id != COMPRESSIONS['none']:
+                raise CodecError(f"Unknown compression id {compression_id}")
+
+            value = self._deserialize(serializer_id, payload)
+            with self._stats_lock:
+                self.stats['decoded'] += 1
+            return value
+        except CodecError:
+            with self._stats_lock:
+                self.stats['decode_errors'] += 1
+            raise
+        except Exception as e:
+            with self._stats_lock:
+                self.stats['decode_errors'] += 1
+            raise CodecError(f"Corrupt cache entry: {e}") from e
+
+    def _count(self, raw_bytes: int, stored_bytes: int):
+        with self._stats_lock:
+            self.stats['encoded'] += 1
+            self.stats['raw_bytes'] += raw_bytes
+            self.stats['stored_bytes'] += stored_bytes
+        if self.on_encode:
+            self.on_encode(raw_bytes, stored_bytes)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get codec statistics (raw_bytes is the size the entries would have had as JSON)"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['bytes_saved'] = stats['raw_bytes'] - stats['stored_bytes']
+        stats['ratio'] = round(stats['stored_bytes'] / stats['raw_bytes'], 4) if stats['raw_bytes'] else 1.0
+        return {
+            'serializer': self.serializer,
+            'compression': ('zstd_dict' if self._dictionary is not None else self.compression) or 'none',
+            **stats
+        }
+
+
+def load_zstd_dictionary(path: Optional[str]) -> Optional[bytes]:
+    """Read a trained zstd dictionary file (None or missing file = no dictionary)"""
+    if not path:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError as e:
+        logger.error(f"Cannot read zstd dictionary {path}: {e}")
+        return None
+
+
+def train_zstd_dictionary(samples: List[Any], size: int = 16384, serializer: str = 'msgpack') -> bytes:
+    """
+    Train a shared zstd dictionary from sample response documents
+
+    Args:
+        samples: Representative cached responses (a few hundred or more)
+        size: Dictionary size in bytes
+        serializer: Serializer the dictionary will be used with
+
+    Returns:
+        Dictionary bytes to distribute to every broker
+    """
+    if not ZSTD_AVAILABLE:
+        raise RuntimeError("zstandard package is required to train a dictionary")
+    codec = CacheCodec(serializer=serializer, compression=None)
+    encoded = [codec._serialize(sample) for sample in samples]
+    return zstandard.train_dictionary(size, encoded).as_bytes()
@@ -0,0 +1,598 @@
+#!/usr/bin/env python3
+"""
+VNF Broker Circuit Breaker Backends - Build2
+============================================
+Pluggable storage for per-VNF circuit breaker state:
+
+- MemoryCircuitBreakerBackend: process-local dict (one view per worker)
+- RedisCircuitBreakerBackend:  shared Redis hash per VNF, state transitions
+                               done atomically in Lua, with a local
+                               read-through cache kept coherent by pub/sub
+
+With the Redis backend, the worker whose failure trips a breaker publishes
+the transition. Every other worker updates its cache from that message and
+stops sending traffic to the appliance without waiting for its own failures.
+
+Both backends apply the same CircuitBreakerPolicy. A breaker opens on:
+- N consecutive failures, or
+- a failure rate or slow-call rate over a rolling, time-bucketed window
+  (once the window holds a minimum number of calls)
+
+A half-open breaker admits a limited number of probe calls. It closes once
+that many probes succeed and re-opens on the first failed or slow probe.
+Rolling counters are kept per worker; the state they trip is shared.
+"""
+
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Callable, List
+
+logger = logging.getLogger(__name__)
+
+STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+@dataclass
+class CircuitBreakerPolicy:
+    """Thresholds shared by every breaker"""
+    failure_threshold: int = 5  # consecutive failures that open the breaker
+    timeout: float = 30  # seconds open before going half-open
+    window: float = 60  # rolling window length in seconds
+    buckets: int = 6  # time buckets in the rolling window
+    minimum_calls: int = 10  # calls in window before rates are evaluated
+    failure_rate_threshold: float = 0.5  # failed / calls that opens the breaker
+    slow_call_seconds: float = 10.0  # calls at least this long count as slow
+    slow_call_rate_threshold: float = 0.8  # slow / calls that opens the breaker
+    half_open_max_calls: int = 3  # probes admitted (and successes needed) in half-open
+
+    def is_slow(self, duration: Optional[float]) -> bool:
+        return duration is not None and duration >= self.slow_call_seconds
+
+    def trip_reason(self, totals: Dict[str, int]) -> Optional[str]:
+        """Rate-based reason to open the breaker, if any"""
+        calls = totals['calls']
+        if calls < self.minimum_calls:
+            return None
+        if totals['failures'] / calls >= self.failure_rate_threshold:
+            return 'failure_rate'
+        if totals['slow'] / calls >= self.slow_call_rate_threshold:
+            return 'slow_call_rate'
+        return None
+
+
+class RollingWindow:
+    """Ring of time buckets counting calls, failures and slow calls"""
+
+    __slots__ = ('window', 'buckets', 'width', '_epochs', '_counts', '_lock')
+
+    def __init__(self, window: float = 60, buckets: int = 6):
+        self.window = window
+        self.buckets = buckets
+        self.width = window / buckets
+        self._epochs = [-1] * buckets
+        self._counts = [[0, 0, 0] for _ in range(buckets)]  # calls, failures, slow
+        self._lock = threading.Lock()
+
+    def record(self, failed: bool, slow: bool, now: Optional[float] = None):
+        now = now if now is not None else time.time()
+        epoch = int(now // self.width)
+        index = epoch % self.buckets
+        with self._lock:
+            counts = self._counts[index]
+            if self._epochs[index] != epoch:
+                self._epochs[index] = epoch
+                counts[0] = counts[1] = counts[2] = 0
+            counts[0] += 1
+            counts[1] += int(failed)
+            counts[2] += int(slow)
+
+    def _live(self, now: float):
+        oldest = int(now // self.width) - self.buckets + 1
+        for epoch, counts in zip(self._epochs, self._counts):
+            if epoch >= oldest:
+                yield epoch, counts
+
+    def totals(self, now: Optional[float] = None) -> Dict[str, int]:
+        now = now if now is not None else time.time()
+        calls = failures = slow = 0
+        with self._lock:
+            for _, counts in self._live(now):
+                calls += counts[0]
+                failures += counts[1]
+                slow += counts[2]
+        return {'calls': calls, 'failures': failures, 'slow': slow}
+
+    def snapshot(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Live buckets, oldest first"""
+        now = now if now is not None else time.time()
+        with self._lock:
+            live = sorted(self._live(now))
+            return [
+                {'start': epoch * self.width, 'calls': c[0], 'failures': c[1], 'slow': c[2]}
+                for epoch, c in live
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._epochs = [-1] * self.buckets
+
+
+@dataclass
+class BreakerStatus:
+    """Result of a circuit breaker call for one VNF instance"""
+    state: str
+    failures: int = 0
+    allowed: bool = True
+    changed: bool = False  # state differs from before the call (or breaker is new)
+    reason: Optional[str] = None  # why the breaker opened (when it just did)
+
+
+class CircuitBreakerBackend:
+    """Interface shared by circuit breaker backends"""
+
+    def __init__(self, policy: Optional[CircuitBreakerPolicy] = None):
+        self.policy = policy or CircuitBreakerPolicy()
+        self._windows: Dict[str, RollingWindow] = {}
+        self._windows_lock = threading.Lock()
+
+    def window_for(self, vnf_instance_id: str) -> RollingWindow:
+        """Rolling window of this worker's calls to vnf_instance_id"""
+        window = self._windows.get(vnf_instance_id)
+        if window is None or window.window != self.policy.window or window.buckets != self.policy.buckets:
+            with self._windows_lock:
+                window = RollingWindow(self.policy.window, self.policy.buckets)
+                self._windows[vnf_instance_id] = window
+        return window
+
+    def _observe(self, vnf_instance_id: str, failed: bool, duration: Optional[float]) -> Optional[str]:
+        """Count a call in the rolling window; returns a trip reason if rates are breached"""
+        window = self.window_for(vnf_instance_id)
+        window.record(failed, self.policy.is_slow(duration))
+        return self.policy.trip_reason(window.totals())
+
+    def _window_stats(self, vnf_instance_id: str) -> Dict[str, Any]:
+        window = self._windows.get(vnf_instance_id)
+        if window is None:
+            return {'calls': 0, 'failure_rate': 0.0, 'slow_call_rate': 0.0, 'buckets': []}
+        totals = window.totals()
+        calls = totals['calls']
+        return {
+            'calls': calls,
+            'failure_rate': round(totals['failures'] / calls, 4) if calls else 0.0,
+            'slow_call_rate': round(totals['slow'] / calls, 4) if calls else 0.0,
+            'buckets': window.snapshot()
+        }
+
+    def allow(self, vnf_instance_id: str) -> BreakerStatus:
+        """Decide whether a request may go to the VNF (may move open -> half_open)"""
+        raise NotImplementedError
+
+    def record_success(self, vnf_instance_id: str, duration: Optional[float] = None) -> BreakerStatus:
+        """Record a successful VNF call that took duration seconds"""
+        raise NotImplementedError
+
+    def record_failure(self, vnf_instance_id: str, duration: Optional[float] = None) -> BreakerStatus:
+        """Record a failed VNF call that took duration seconds"""
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Known breakers as {vnf_instance_id: {'state', 'failures', 'calls', rates, 'buckets'}}"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release background resources"""
+
+
+class MemoryCircuitBreakerBackend(CircuitBreakerBackend):
+    """
+    Circuit breaker state in a process-local dict
+
+    The dict is passed in (vnf_broker_enhanced.circuit_breaker_state) so
+    existing code and tests that read or seed it keep working.
+    """
+
+    def __init__(self, state: Optional[Dict[str, Dict[str, Any]]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.state = state if state is not None else {}
+        self._lock = threading.Lock()
+
+    def _entry(self, vnf_instance_id: str):
+        cb = self.state.get(vnf_instance_id)
+        if cb is None:
+            cb = self.state[vnf_instance_id] = {'state': 'closed', 'failures': 0, 'last_failure': None}
+            return cb, True
+        return cb, False
+
+    def _open(self, vnf_instance_id: str, cb: Dict[str, Any], now: float, reason: str) -> BreakerStatus:
+        cb['state'] = 'open'
+        cb['last_failure'] = now
+        return BreakerStatus('open', cb['failures'], allowed=False, changed=True, reason=reason)
+
+    def allow(self, vnf_instance_id: str) -> BreakerStatus:
+        now = time.time()
+        with self._lock:
+            cb, created = self._entry(vnf_instance_id)
+
+            if cb['state'] == 'open':
+                if cb['last_failure'] and (now - cb['last_failure']) > self.policy.timeout:
+                    cb.update(state='half_open', probes=1, probe_successes=0, half_open_since=now)
+                    return BreakerStatus('half_open', cb['failures'], allowed=True, changed=True)
+                return BreakerStatus('open', cb['failures'], allowed=False)
+
+            if cb['state'] == 'half_open':
+                if now - cb.get('half_open_since', now) > self.policy.timeout:
+                    # Probes never reported back; issue a fresh set
+                    cb.update(probes=0, probe_successes=0, half_open_since=now)
+                if cb.get('probes', 0) >= self.policy.half_open_max_calls:
+                    return BreakerStatus('half_open', cb['failures'], allowed=False)
+                cb['probes'] = cb.get('probes', 0) + 1
+
+            return BreakerStatus(cb['state'], cb['failures'], allowed=True, changed=created)
+
+    def record_success(self, vnf_instance_id: str, duration: Optional[float] = None) -> BreakerStatus:
+        reason = self._observe(vnf_instance_id, False, duration)
+        now = time.time()
+        with self._lock:
+            cb, _ = self._entry(vnf_instance_id)
+
+            if cb['state'] == 'half_open':
+                if self.policy.is_slow(duration):
+                    return self._open(vnf_instance_id, cb, now, 'slow_probe')
+                cb['probe_successes'] = cb.get('probe_successes', 0) + 1
+                if cb['probe_successes'] < self.policy.half_open_max_calls:
+                    return BreakerStatus('half_open', cb['failures'])
+                cb.update(state='closed', failures=0, last_failure=None)
+                self.window_for(vnf_instance_id).reset()
+                return BreakerStatus('closed', 0, changed=True)
+
+            if cb['state'] == 'open':
+                # Late result of a call admitted before the breaker opened
+                return BreakerStatus('open', cb['failures'], allowed=False)
+
+            cb['failures'] = 0
+            if reason:
+                return self._open(vnf_instance_id, cb, now, reason)
+            return BreakerStatus('closed', 0)
+
+    def record_failure(self, vnf_instance_id: str, duration: Optional[float] = None) -> BreakerStatus:
+        reason = self._observe(vnf_instance_id, True, duration)
+        now = time.time()
+        with self._lock:
+            cb, created = self._entry(vnf_instance_id)
+            cb['failures'] += 1
+            cb['last_failure'] = now
+
+            if cb['state'] == 'half_open':
+                return self._open(vnf_instance_id, cb, now, 'failed_probe')
+            if cb['state'] == 'closed':
+                if cb['failures'] >= self.policy.failure_threshold:
+                    return self._open(vnf_instance_id, cb, now, 'consecutive_failures')
+                if reason:
+                    return self._open(vnf_instance_id, cb, now, reason)
+            return BreakerStatus(cb['state'], cb['failures'], allowed=cb['state'] != 'open', changed=created)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            states = {vnf_id: (cb['state'], cb['failures']) for vnf_id, cb in self.state.items()}
+        return {
+            vnf_id: {'state': state, 'failures': failures, **self._window_stats(vnf_id)}
+            for vnf_id, (state, failures) in states.items()
+        }
+
+
+# Messages are "state|failures|last_failure|vnf_instance_id" (id last: it may contain '|')
+ALLOW_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local timeout = tonumber(ARGV[2])
+local max_probes = tonumber(ARGV[5])
+
+local fields = redis.call('HMGET', key, 'state', 'failures', 'last_failure', 'probes', 'half_open_since')
+local state = fields[1] or 'closed'
+local failures = tonumber(fields[2]) or 0
+local last_failure = tonumber(fields[3]) or 0
+
+if state == 'open' then
+    if now - last_failure > timeout then
+        redis.call('HSET', key, 'state', 'half_open', 'probes', 1, 'probe_successes', 0, 'half_open_since', ARGV[1])
+        redis.call('PUBLISH', ARGV[3], 'half_open|' .. failures .. '|' .. last_failure .. '|' .. ARGV[4])
+        return {1, 'half_open', failures, tostring(last_failure), 1}
+    end
+    return {0, 'open', failures, tostring(last_failure), 0}
+end
+
+if state == 'half_open' then
+    local probes = tonumber(fields[4]) or 0
+    if now - (tonumber(fields[5]) or now) > timeout then
+        -- probes never reported back; issue a fresh set
+        probes = 0
+        redis.call('HSET', key, 'probe_successes', 0, 'half_open_since', ARGV[1])
+    end
+    if probes >= max_probes then
+        return {0, 'half_open', failures, tostring(last_failure), 0}
+    end
+    redis.call('HSET', key, 'probes', probes + 1)
+end
+return {1, state, failures, tostring(last_failure), 0}
+"""
+
+FAILURE_SCRIPT = """
+local key = KEYS[1]
+local threshold = tonumber(ARGV[2])
+local trip = ARGV[6] == '1'
+
+local state = redis.call('HGET', key, 'state') or 'closed'
+local failures = redis.call('HINCRBY', key, 'failures', 1)
+redis.call('HSET', key, 'last_failure', ARGV[1])
+
+local changed = 0
+if state == 'half_open' or (state == 'closed' and (failures >= threshold or trip)) then
+    state = 'open'
+    changed = 1
+end
+redis.call('HSET', key, 'state', state)
+redis.call('PEXPIRE', key, ARGV[5])
+redis.call('PUBLISH', ARGV[3], state .. '|' .. failures .. '|' .. ARGV[1] .. '|' .. ARGV[4])
+return {0, state, failures, ARGV[1], changed}
+"""
+
+SUCCESS_SCRIPT = """
+local key = KEYS[1]
+local slow = ARGV[4] == '1'
+local trip = ARGV[5] == '1'
+local max_probes = tonumber(ARGV[6])
+
+local fields = redis.call('HMGET', key, 'state', 'failures', 'last_failure')
+local state = fields[1] or 'closed'
+local failures = tonumber(fields[2]) or 0
+local last_failure = fields[3] or '0'
+
+local function open()
+    redis.call('HSET', key, 'state', 'open', 'last_failure', ARGV[1])
+    redis.call('PEXPIRE', key, ARGV[7])
+    redis.call('PUBLISH', ARGV[2], 'open|' .. failures .. '|' .. ARGV[1] .. '|' .. ARGV[3])
+    return {0, 'open', failures, ARGV[1], 1}
+end
+
+if state == 'open' then
+    return {0, 'open', failures, last_failure, 0}
+end
+
+if state == 'half_open' then
+    if slow then
+        return open()
+    end
+    local successes = redis.call('HINCRBY', key, 'probe_successes', 1)
+    if successes < max_probes then
+        return {1, 'half_open', failures, last_failure, 0}
+    end
+    redis.call('HSET', key, 'state', 'closed', 'failures', 0, 'last_failure', 0)
+    redis.call('PUBLISH', ARGV[2], 'closed|0|0|' .. ARGV[3])
+    return {1, 'closed', 0, '0', 1}
+end
+
+if trip then
+    return open()
+end
+if failures > 0 then
+    redis.call('HSET', key, 'failures', 0)
+    redis.call('PUBLISH', ARGV[2], 'closed|0|' .. last_failure .. '|' .. ARGV[3])
+end
+return {1, 'closed', 0, last_failure, 0}
+"""
+
+
+class RedisCircuitBreakerBackend(CircuitBreakerBackend):
+    """
+    Circuit breaker state shared through Redis
+
+    Hash circuit_breaker:<vnf_instance_id> holds state/failures/last_failure
+    and half-open probe counters. Every transition is one Lua script call
+    that also PUBLISHes the new state. A local cache answers the common case
+    without a round trip: a closed breaker with no failures, or an open
+    breaker still inside its timeout. Pub/sub updates that cache on every
+    worker. cache_ttl bounds how stale the cache can get if a message is lost.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        key_prefix: str = 'circuit_breaker',
+        channel: str = 'circuit_breaker:events',
+        cache_ttl: float = 5.0,
+        state_ttl: float = 86400,
+        subscribe: bool = True,
+        on_change: Optional[Callable[[str, str], None]] = None,
+        **kwargs
+    ):
+        """
+        Initialize Redis backend
+
+        Args:
+            redis_client: Synchronous redis.Redis client (decode_responses=True)
+            key_prefix: Prefix of per-VNF state hashes
+            channel: Pub/sub channel for state change notifications
+            cache_ttl: Seconds a cached state is trusted without Redis
+            state_ttl: Seconds an idle breaker hash is kept in Redis
+            subscribe: Listen for notifications from other workers
+            on_change: Callback(vnf_instance_id, state) for transitions received via pub/sub
+            **kwargs: policy (CircuitBreakerPolicy)
+        """
+        super().__init__(**kwargs)
+        self.redis = redis_client
+        self.key_prefix = key_prefix
+        self.channel = channel
+        self.cache_ttl = cache_ttl
+        self.state_ttl_ms = int(state_ttl * 1000)
+        self.on_change = on_change
+
+        self._allow = redis_client.register_script(ALLOW_SCRIPT)
+        self._failure = redis_client.register_script(FAILURE_SCRIPT)
+        self._success = redis_client.register_script(SUCCESS_SCRIPT)
+
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._pubsub = None
+        self._listener = None
+        if subscribe:
+            self._subscribe()
+
+    def _key(self, vnf_instance_id: str) -> str:
+        # {vnf} hash tag: every per-VNF key shares one Redis Cluster slot
+        return f"{self.key_prefix}:{{{vnf_instance_id}}}"
+
+    def _subscribe(self):
+        """Start the pub/sub listener thread"""
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel: self._handle_message})
+        self._listener = self._pubsub.run_in_thread(sleep_time=0.01, daemon=True)
+
+    def _store(self, vnf_instance_id: str, state: str, failures: int, last_failure: float) -> Optional[str]:
+        """Update the local cache; returns the previous cached state"""
+        with self._lock:
+            previous = self._cache.get(vnf_instance_id, {}).get('state')
+            self._cache[vnf_instance_id] = {
+                'state': state,
+                'failures': failures,
+                'last_failure': last_failure,
+                'synced_at': time.time()
+            }
+        if state == 'closed' and previous not in (None, 'closed'):
+            self.window_for(vnf_instance_id).reset()
+        return previous
+
+    def _handle_message(self, message: Dict[str, Any]):
+        """Apply a state change published by any worker (including this one)"""
+        data = message.get('data')
+        if isinstance(data, bytes):
+            data = data.decode()
+        try:
+            state, failures, last_failure, vnf_instance_id = data.split('|', 3)
+            failures = int(failures)
+            last_failure = float(last_failure)
+        except (AttributeError, ValueError):
+            logger.warning(f"Ignoring malformed circuit breaker message: {data!r}")
+            return
+
+        previous = self._store(vnf_instance_id, state, failures, last_failure)
+        if previous != state and self.on_change:
+            self.on_change(vnf_instance_id, state)
+
+    def _apply(self, vnf_instance_id: str, raw, reason: Optional[str] = None) -> BreakerStatus:
+        """Update the local cache from a script reply"""
+        allowed, state, failures, last_failure, changed = raw
+        previous = self._store(vnf_instance_id, state, int(failures), float(last_failure))
+        changed = bool(int(changed)) or previous is None
+        return BreakerStatus(
+            state,
+            int(failures),
+            allowed=bool(int(allowed)),
+            changed=changed,
+            reason=reason if changed and state == 'open' else None
+        )
+
+    def _cached(self, vnf_instance_id: str, now: float) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(vnf_instance_id)
+        if entry is not None and now - entry['synced_at'] < self.cache_ttl:
+            return entry
+        return None
+
+    def allow(self, vnf_instance_id: str) -> BreakerStatus:
+        now = time.time()
+        entry = self._cached(vnf_instance_id, now)
+        if entry is not None:
+            if entry['state'] == 'closed':
+                return BreakerStatus('closed', entry['failures'])
+            if entry['state'] == 'open' and now - entry['last_failure'] <= self.policy.timeout:
+                return BreakerStatus('open', entry['failures'], allowed=False)
+
+        raw = self._allow(
+            keys=[self._key(vnf_instance_id)],
+            args=[now, self.policy.timeout, self.channel, vnf_instance_id, self.policy.half_open_max_calls]
+        )
+        return self._apply(vnf_instance_id, raw)
+
+    def record_success(self, vnf_instance_id: str, duration: Optional[float] = None) -> BreakerStatus:
+        reason = self._observe(vnf_instance_id, False, duration)
+        slow = self.policy.is_slow(duration)
+        entry = self._cached(vnf_instance_id, time.time())
+        if (entry is not None and entry['state'] == 'closed' and entry['failures'] == 0
+                and not reason):
+            return BreakerStatus('closed')
+
+        raw = self._success(
+            keys=[self._key(vnf_instance_id)],
+            args=[
+                time.time(), self.channel, vnf_instance_id,
+                int(slow), int(bool(reason)), self.policy.half_open_max_calls, self.state_ttl_ms
+            ]
+        )
+        return self._apply(vnf_instance_id, raw, reason or ('slow_probe' if slow else None))
+
+    def record_failure(self, vnf_instance_id: str, duration: Optional[float] = None) -> BreakerStatus:
+        reason = self._observe(vnf_instance_id, True, duration)
+        previous = (self._cache.get(vnf_instance_id) or {}).get('state')
+        raw = self._failure(
+            keys=[self._key(vnf_instance_id)],
+            args=[
+                time.time(), self.policy.failure_threshold, self.channel,
+                vnf_instance_id, self.state_ttl_ms, int(bool(reason))
+            ]
+        )
+        status = self._apply(vnf_instance_id, raw)
+        status.allowed = status.state != 'open'
+        if status.changed and status.state == 'open':
+            if previous == 'half_open':
+                status.reason = 'failed_probe'
+            elif status.failures >= self.policy.failure_threshold:
+                status.reason = 'consecutive_failures'
+            else:
+                status.reason = reason
+        return status
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Breakers this worker has seen (local cache view, local rolling stats)"""
+        with self._lock:
+            states = {vnf_id: (entry['state'], entry['failures']) for vnf_id, entry in self._cache.items()}
+        return {
+            vnf_id: {'state': state, 'failures': failures, **self._window_stats(vnf_id)}
+            for vnf_id, (state, failures) in states.items()
+        }
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+
+
+def create_circuit_breaker_backend(
+    backend: str,
+    redis_client=None,
+    state: Optional[Dict[str, Dict[str, Any]]] = None,
+    **kwargs
+) -> CircuitBreakerBackend:
+    """
+    Build a circuit breaker backend by name
+
+    Args:
+        backend: 'memory' or 'redis'
+        redis_client: Required for the redis backend
+        state: Dict used by the memory backend
+        **kwargs: policy and backend-specific options
+
+    Returns:
+        CircuitBreakerBackend
+    """
+    if backend == 'redis':
+        if redis_client is None:
+            raise ValueError("Redis circuit breaker backend requires a Redis client")
+        return RedisCircuitBreakerBackend(redis_client, **kwargs)
+    if backend == 'memory':
+        kwargs = {k: v for k, v in kwargs.items() if k == 'policy'}
+        return MemoryCircuitBreakerBackend(state, **kwargs)
+    raise ValueError(f"Unknown circuit breaker backend: {backend}")
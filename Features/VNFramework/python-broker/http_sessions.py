@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+VNF Broker HTTP Session Registry - Build2
+=========================================
+Keep-alive connection pools for the synchronous /vnfproxy HTTP path.
+
+requests.request() builds a throwaway Session per call, so every proxied
+call pays a TCP connect and TLS handshake to the appliance. SessionRegistry
+keeps one requests.Session per target appliance instead, with an
+HTTPAdapter mounted for http:// and https://:
+
+- up to pool_maxsize keep-alive connections per target. With pool_block
+  the caller waits for a free connection; without it an extra connection is
+  opened and closed after use. Either way the request counts as saturated.
+- failed connects, and read errors or retry_statuses (502/503/504 by
+  default) on idempotent methods, are retried max_retries times with
+  exponential backoff. POST and PATCH are only retried when the request
+  never reached the appliance.
+- sessions with no connection in use for idle_timeout seconds are closed
+  by a reaper thread
+- cookies set by an appliance are not kept, since one session serves every
+  caller of that appliance
+
+get_stats() reports the connections open and in use per target, for the
+/health endpoint.
+"""
+
+import time
+import logging
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Any, Optional, Tuple, Iterable
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class _Target:
+    """One appliance's session"""
+
+    __slots__ = ('session', 'adapter', 'last_used')
+
+    def __init__(self, session: requests.Session, adapter: HTTPAdapter):
+        self.session = session
+        self.adapter = adapter
+        self.last_used = time.monotonic()
+
+
+class SessionRegistry:
+    """Thread-safe registry of pooled requests sessions, one per target appliance"""
+
+    def __init__(
+        self,
+        pool_maxsize: int = 10,
+        pool_block: bool = False,
+        max_retries: int = 2,
+        backoff_factor: float = 0.5,
+        retry_statuses: Iterable[int] = (502, 503, 504),
+        idle_timeout: float = 300.0,
+        verify: bool = False
+    ):
+        """
+        Initialize registry
+
+        Args:
+            pool_maxsize: Keep-alive connections per target
+            pool_block: Wait for a free connection instead of opening an extra one
+            max_retries: Retries per request (0 = off)
+            backoff_factor: Backoff base in seconds (0.5 -> 0.5s, 1s, 2s...)
+            retry_statuses: Response statuses retried on idempotent methods
+            idle_timeout: Seconds an unused session stays open
+            verify: TLS certificate verification (appliances mostly use self-signed certs)
+        """
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.retry_statuses = frozenset(retry_statuses)
+        self.idle_timeout = idle_timeout
+        self.verify = verify
+        self._targets: Dict[str, _Target] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+        self.stats = {'requests': 0, 'retries': 0, 'saturated': 0, 'errors': 0, 'evictions': 0}
+
+    def _retry_policy(self) -> Retry:
+        return Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=self.max_retries,
+            status=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.retry_statuses,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False,  # the last response is relayed as is
+            respect_retry_after_header=False  # an appliance must not park a worker thread
+        )
+
+    def _new_target(self) -> _Target:
+        session = requests.Session()
+        session.verify = self.verify
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        # One pool per scheme/port the appliance is reached on
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize,
+                              max_retries=self._retry_policy(), pool_block=self.pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return _Target(session, adapter)
+
+    def _entry(self, target: str) -> _Target:
+        with self._lock:
+            entry = self._targets.get(target)
+            if entry is None:
+                entry = self._targets[target] = self._new_target()
+            entry.last_used = time.monotonic()
+            return entry
+
+    def session(self, target: str) -> requests.Session:
+        """Pooled session for a target appliance (created on first use)"""
+        return self._entry(target).session
+
+    @staticmethod
+    def _connections(entry: _Target) -> Tuple[int, int]:
+        """(connections open, connections in use) across the target's pools"""
+        opened = in_use = 0
+        pools = entry.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            queue = getattr(pool, 'pool', None)
+            if queue is None:
+                continue
+            # The pool queue holds idle connections and None placeholders for free slots
+            idle = sum(1 for conn in list(queue.queue) if conn is not None)
+            busy = queue.maxsize - queue.qsize()
+            opened += idle + busy
+            in_use += busy
+        return opened, in_use
+
+    def request(self, target: str, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request on the target's pooled session
+
+        Args:
+            target: Appliance address (registry key)
+            method: HTTP method
+            url: Full request URL
+            **kwargs: Passed to requests.Session.request (headers, data, timeout, stream...)
+
+        Returns:
+            Response (with stream=True its connection is in use until the response is closed)
+
+        Raises:
+            requests.RequestException: Request failed after retries
+        """
+        entry = self._entry(target)
+        if self._connections(entry)[1] >= self.pool_maxsize:
+            self.stats['saturated'] += 1
+            logger.debug(f"HTTP pool for {target} saturated ({self.pool_maxsize} connections in use)")
+        self.stats['requests'] += 1
+        try:
+            response = entry.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            entry.last_used = time.monotonic()
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and retries.history:
+            self.stats['retries'] += len(retries.history)
+        return response
+
+    def evict_idle(self) -> int:
+        """
+        Close sessions unused for idle_timeout seconds
+
+        Returns:
+            Number of sessions closed
+        """
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for target, entry in list(self._targets.items()):
+                if now - entry.last_used < self.idle_timeout or self._connections(entry)[1]:
+                    continue
+                evicted.append(self._targets.pop(target))
+        for entry in evicted:
+            entry.session.close()
+        self.stats['evictions'] += len(evicted)
+        return len(evicted)
+
+    def start(self):
+        """Start the idle reaper thread"""
+        if self._reaper is None:
+            self._stop.clear()
+            self._reaper = threading.Thread(target=self._run_reaper, name='http-session-reaper', daemon=True)
+            self._reaper.start()
+
+    def _run_reaper(self):
+        while not self._stop.wait(max(1.0, min(self.idle_timeout / 2, 30.0))):
+            self.evict_idle()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get registry statistics"""
+        with self._lock:
+            entries = list(self._targets.values())
+        connections = [self._connections(entry) for entry in entries]
+        busiest = max((in_use for _, in_use in connections), default=0)
+        return {
+            'targets': len(entries),
+            'connections': sum(opened for opened, _ in connections),
+            'in_use': sum(in_use for _, in_use in connections),
+            'pool_maxsize': self.pool_maxsize,
+            'saturation': round(busiest / self.pool_maxsize, 2) if self.pool_maxsize else 0.0,
+            **self.stats
+        }
+
+    def close(self):
+        """Stop the reaper and close every session"""
+        self._stop.set()
+        if self._reaper is not None:
+            self._reaper.join(timeout=5)
+            self._reaper = None
+        with self._lock:
+            entries = list(self._targets.values())
+            self._targets.clear()
+        for entry in entries:
+            entry.session.close()
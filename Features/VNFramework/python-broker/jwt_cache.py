@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+VNF Broker Verified-JWT Cache - Build2
+======================================
+Bounded LRU of already-verified JWT claims.
+
+CloudStack reuses the same token for its whole lifetime, so repeated RS256
+signature checks on that token do the same work each time. Entries are:
+- keyed by SHA-256 of the raw token (tokens themselves are never stored)
+- valid only until the token's `exp` claim (and at most max_ttl seconds)
+- dropped wholesale when the verification key changes (key rotation)
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from cryptography.hazmat.primitives import serialization
+
+
+def key_fingerprint(public_key: Any) -> str:
+    """SHA-256 fingerprint of a public key (PEM bytes/str or key object)"""
+    if public_key is None:
+        return ''
+    if isinstance(public_key, str):
+        public_key = public_key.encode()
+    if isinstance(public_key, bytes):
+        material = public_key
+    else:
+        material = public_key.public_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+    return hashlib.sha256(material).hexdigest()
+
+
+class VerifiedTokenCache:
+    """
+    Thread-safe LRU of verified JWT claims
+
+    Only successful verifications are cached; invalid tokens always go
+    through full verification so failures are still logged and counted.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_ttl: float = 300.0):
+        """
+        Initialize cache
+
+        Args:
+            max_entries: Maximum cached tokens (least recently used evicted first)
+            max_ttl: Upper bound in seconds on how long a verification is reused
+        """
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._entries: 'OrderedDict[str, tuple[Dict[str, Any], float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_obj: Any = None
+        self._fingerprint: str = ''
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def bind_key(self, public_key: Any) -> bool:
+        """
+        Associate the cache with the current verification key
+
+        The fingerprint is only recomputed when a different key object is
+        passed, so calling this on every request is cheap.
+
+        Returns:
+            True if the key changed and the cache was cleared
+        """
+        if public_key is self._key_obj:
+            return False
+
+        fingerprint = key_fingerprint(public_key)
+        with self._lock:
+            self._key_obj = public_key
+            if fingerprint == self._fingerprint:
+                return False
+            rotated = bool(self._fingerprint)
+            self._fingerprint = fingerprint
+            if self._entries:
+                self._entries.clear()
+                self.stats['invalidations'] += 1
+        return rotated
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up verified claims for token
+
+        Returns:
+            Cached claims, or None if absent or past expiry
+        """
+        digest = self._digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            claims, expires_at = entry
+            if now >= expires_at:
+                del self._entries[digest]
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.stats['hits'] += 1
+            return claims
+
+    def put(self, token: str, claims: Dict[str, Any]):
+        """
+        Cache claims for a token that just passed full verification
+
+        Tokens without a numeric `exp` are cached for max_ttl seconds; tokens
+        that are not yet valid (`nbf` in the future) are not cached.
+        """
+        now = time.time()
+        expires_at = now + self.max_ttl
+
+        exp = claims.get('exp')
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, float(exp))
+        nbf = claims.get('nbf')
+        if isinstance(nbf, (int, float)) and nbf > now:
+            return
+        if expires_at <= now:
+            return
+
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (claims, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        """Drop every cached verification"""
+        with self._lock:
+            self._entries.clear()
+            self.stats['invalidations'] += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else 0.0,
+            **self.stats
+        }
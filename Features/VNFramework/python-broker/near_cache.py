@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+VNF Broker Idempotency Near-Cache - Build2
+==========================================
+In-process LRU in front of the Redis idempotency cache.
+
+A CloudStack retry of a recent operation usually lands on the worker that
+just ran it, yet every lookup costs a Redis GET (plus decoding). NearCache
+keeps decoded entries in memory:
+- bounded LRU (max_entries), each entry valid until the earlier of its Redis
+  TTL and max_ttl seconds
+- keyed by the full Redis key, values copied on the way in and out
+
+Idempotency entries are written once per key (same parameters, same
+result), so an entry only goes stale when the Redis key disappears. Other
+replicas learn about that from Redis keyspace notifications: a
+KeyspaceInvalidator pattern-subscribes to `__keyspace@<db>__:<prefix>*` and
+drops the local copy on del / expired / evicted / rename events. A Redis
+Cluster publishes keyspace events only on the node that holds the key, so
+there it listens on every primary. If a subscription drops, the whole
+near-cache is cleared, since events may have been missed; max_ttl bounds
+staleness if notifications are disabled.
+"""
+
+import copy
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Keyspace events after which the cached value may no longer match Redis
+INVALIDATING_EVENTS = frozenset({'del', 'expired', 'evicted', 'rename_from', 'rename_to', 'move_from'})
+
+# notify-keyspace-events flags needed: K(eyspace), g(eneric: del/rename), x (expired), e (evicted)
+REQUIRED_NOTIFY_FLAGS = 'Kgxe'
+
+
+class NearCache:
+    """Thread-safe TTL-aware LRU of decoded idempotency entries"""
+
+    def __init__(self, max_entries: int = 10000, max_ttl: float = 300.0):
+        """
+        Initialize cache
+
+        Args:
+            max_entries: Maximum cached entries (least recently used evicted first)
+            max_ttl: Upper bound in seconds on how long an entry is served locally
+        """
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._entries: 'OrderedDict[str, tuple[Any, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a cached entry
+
+        Returns:
+            A copy of the cached value, or None if absent or expired
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            value, expires_at = entry
+            if now >= expires_at:
+                del self._entries[key]
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return copy.deepcopy(value)
+
+    def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """Look up several entries (None for each miss)"""
+        return [self.get(key) for key in keys]
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None):
+        """
+        Cache an entry that was just read from or written to Redis
+
+        Args:
+            key: Redis key of the entry
+            value: Decoded entry
+            ttl: Remaining Redis TTL in seconds (capped at max_ttl)
+        """
+        lifetime = self.max_ttl if ttl is None else min(ttl, self.max_ttl)
+        if lifetime <= 0 or self.max_entries <= 0:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + lifetime)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, key: str) -> bool:
+        """
+        Drop one entry
+
+        Returns:
+            True if the entry was cached
+        """
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return False
+            self.stats['invalidations'] += 1
+            return True
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self.stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'max_ttl': self.max_ttl,
+            'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else 0.0,
+            **self.stats
+        }
+
+
+def enable_keyspace_notifications(redis_client) -> bool:
+    """
+    Make sure the server publishes the keyspace events NearCache needs
+
+    Existing flags are kept. Managed Redis services often refuse CONFIG; the
+    flags must then be set in the server configuration instead.
+
+    Returns:
+        True if the required events are enabled
+    """
+    try:
+        current = redis_client.config_get('notify-keyspace-events').get('notify-keyspace-events', '')
+        if isinstance(current, bytes):
+            current = current.decode()
+        # 'A' is an alias for every event class (g$lshzxetd)
+        missing = ''.join(
+            flag for flag in REQUIRED_NOTIFY_FLAGS
+            if flag not in current and not (flag != 'K' and 'A' in current)
+        )
+        if missing:
+            redis_client.config_set('notify-keyspace-events', current + missing)
+            logger.info(f"Enabled keyspace notifications: notify-keyspace-events={current + missing}")
+        return True
+    except redis.RedisError as e:
+        logger.warning(
+            f"Cannot enable keyspace notifications ({e}); set notify-keyspace-events "
+            f"to include '{REQUIRED_NOTIFY_FLAGS}' on the server or near-cache entries "
+            f"are only invalidated by max_ttl"
+        )
+        return False
+
+
+class KeyspaceInvalidator:
+    """Drops near-cache entries when their Redis keys are deleted, expire or are evicted"""
+
+    def __init__(
+        self,
+        redis_client,
+        cache: NearCache,
+        prefix: str,
+        configure: bool = True,
+        subscribe: bool = True
+    ):
+        """
+        Initialize invalidator
+
+        Args:
+            redis_client: Redis client on the server holding the entries
+                          (a RedisCluster client listens on each primary)
+            cache: Near-cache to invalidate
+            prefix: Key prefix of the cached entries (e.g. 'idempotency:')
+            configure: Enable the required notify-keyspace-events flags
+            subscribe: Start the listener thread immediately
+        """
+        self.redis = redis_client
+        self.cache = cache
+        self.prefix = prefix
+        pool = getattr(redis_client, 'connection_pool', None)
+        db = getattr(pool, 'connection_kwargs', {}).get('db', 0)
+        self.channel_prefix = f"__keyspace@{db}__:"
+        self.stats = {'events': 0, 'invalidated': 0, 'resets': 0}
+        self._pubsubs: List[Any] = []
+        self._listeners: List[Any] = []
+        if subscribe:
+            self._subscribe(configure)
+
+    def _node_clients(self) -> List[Any]:
+        """Clients whose keyspace events must be heard (every primary of a cluster)"""
+        get_primaries = getattr(self.redis, 'get_primaries', None)
+        if get_primaries is None:
+            return [self.redis]
+        return [node.redis_connection for node in get_primaries()]
+
+    def _subscribe(self, configure: bool):
+        """Start one pub/sub listener thread per node"""
+        try:
+            for client in self._node_clients():
+                if configure:
+                    enable_keyspace_notifications(client)
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                self._pubsubs.append(pubsub)
+                pubsub.psubscribe(**{f"{self.channel_prefix}{self.prefix}*": self._handle_message})
+                self._listeners.append(pubsub.run_in_thread(
+                    sleep_time=0.01, daemon=True, exception_handler=self._handle_error))
+        except Exception:
+            self.close()
+            raise
+
+    def _handle_message(self, message: Dict[str, Any]):
+        """Apply one keyspace notification (channel = key, data = event)"""
+        channel, event = message.get('channel'), message.get('data')
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        if isinstance(event, bytes):
+            event = event.decode()
+        self.stats['events'] += 1
+        if event in INVALIDATING_EVENTS and channel.startswith(self.channel_prefix):
+            if self.cache.invalidate(channel[len(self.channel_prefix):]):
+                self.stats['invalidated'] += 1
+
+    def _handle_error(self, error: Exception, pubsub, worker):
+        """Connection lost: events may have been missed, so start from an empty cache"""
+        logger.warning(f"Near-cache invalidation listener error, clearing near-cache: {error}")
+        self.cache.clear()
+        self.stats['resets'] += 1
+        # The pubsub reconnects and resubscribes on its next read
+        time.sleep(1.0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get invalidation statistics"""
+        return {'listening': len(self._listeners), **self.stats}
+
+    def close(self):
+        """Stop the listener threads"""
+        for listener in self._listeners:
+            listener.stop()
+        self._listeners = []
+        for pubsub in self._pubsubs:
+            try:
+                pubsub.close()
+            except redis.RedisError:
+                pass
+        self._pubsubs = []
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+VNF Broker Streaming Proxy - Build2
+===================================
+Byte-for-byte passthrough of appliance HTTP responses.
+
+The /vnfproxy JSON envelope carries the upstream body as a decoded string,
+so a 200MB configuration backup is held several times over (raw bytes,
+decoded text, JSON-escaped copy). In streaming mode the broker instead
+relays the upstream response as its own:
+
+- upstream status code and end-to-end headers are passed through
+  (hop-by-hop headers such as Connection and Transfer-Encoding are not)
+- the body is forwarded in chunks of chunk_size bytes as it arrives, still
+  content-encoded, so Content-Length and Content-Encoding stay valid and
+  memory per request is bounded by the chunk size
+- X-VNF-Proxy-Duration-Ms reports the time to the upstream headers; the
+  full transfer time and byte count are passed to on_complete and logged
+  when the body has been relayed (or the client went away)
+"""
+
+import json
+import time
+import logging
+from typing import Dict, Optional, Iterator, Callable, Mapping
+
+import requests
+from flask import Response
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 65536
+
+# RFC 7230 section 6.1 hop-by-hop headers, never forwarded by a proxy
+HOP_BY_HOP_HEADERS = frozenset({
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade'
+})
+
+
+def passthrough_headers(headers: Mapping[str, str]) -> Dict[str, str]:
+    """End-to-end upstream headers (hop-by-hop and Connection-listed ones removed)"""
+    listed = {token.strip().lower() for token in headers.get('Connection', '').split(',') if token.strip()}
+    return {
+        name: value for name, value in headers.items()
+        if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() not in listed
+    }
+
+
+def iter_upstream(
+    upstream: requests.Response,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    on_complete: Optional[Callable[[int, Optional[Exception]], None]] = None
+) -> Iterator[bytes]:
+    """
+    Yield the raw (still content-encoded) upstream body
+
+    Args:
+        upstream: Response opened with stream=True
+        chunk_size: Bytes read per chunk
+        on_complete: Called once with (bytes relayed, error or None) when the
+                     body ends, fails or the consumer stops early
+
+    Returns:
+        Iterator over body chunks; the upstream connection is released when it ends
+    """
+    relayed = 0
+    error: Optional[Exception] = None
+    try:
+        for chunk in upstream.raw.stream(chunk_size, decode_content=False):
+            relayed += len(chunk)
+            yield chunk
+    except GeneratorExit:
+        error = ConnectionAbortedError('client closed the stream')
+        raise
+    except Exception as e:
+        # Headers are already sent: the client sees a truncated body
+        error = e
+        raise
+    finally:
+        upstream.close()
+        if on_complete is not None:
+            on_complete(relayed, error)
+
+
+def streaming_response(
+    upstream: requests.Response,
+    target: str,
+    started: float,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    on_complete: Optional[Callable[[int, float, Optional[Exception]], None]] = None
+) -> Response:
+    """
+    Flask response relaying an upstream response
+
+    Args:
+        upstream: Response opened with stream=True
+        target: Appliance address (for logging)
+        started: time.time() when the upstream request was sent
+        chunk_size: Bytes read per chunk
+        on_complete: Called with (bytes relayed, total seconds, error or None)
+
+    Returns:
+        Streamed response with the upstream status and end-to-end headers
+    """
+    headers = passthrough_headers(upstream.headers)
+    headers['X-VNF-Proxy-Duration-Ms'] = str(int((time.time() - started) * 1000))
+
+    def done(relayed: int, error: Optional[Exception]):
+        duration = time.time() - started
+        if error is not None:
+            logger.error(f"Stream from {target} failed after {relayed} bytes ({duration:.2f}s): {error}")
+        else:
+            logger.info(f"Streamed {relayed} bytes from {target} in {duration:.2f}s (status {upstream.status_code})")
+        if on_complete is not None:
+            on_complete(relayed, duration, error)
+
+    body = iter_upstream(upstream, chunk_size, done)
+
+    def close():
+        # Also runs when the client goes away mid-stream (or before the first chunk)
+        body.close()
+        upstream.close()
+
+    response = Response(body, status=upstream.status_code, headers=headers, direct_passthrough=True)
+    response.call_on_close(close)
+    return response
+
+
+def error_response(status_code: int, error: str, duration_ms: int) -> Response:
+    """Upstream unreachable in streaming mode (nothing was relayed yet)"""
+    body = json.dumps({'success': False, 'status_code': status_code, 'error': error, 'duration_ms': duration_ms})
+    return Response(body, status=status_code, mimetype='application/json')
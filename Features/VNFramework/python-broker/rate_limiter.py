@@ -0,0 +1,677 @@
+#!/usr/bin/env python3
+"""
+VNF Broker Rate Limiter - Build2
+================================
+Single-round-trip Redis rate limiting. Each algorithm is one Lua script run
+with EVALSHA (redis-py falls back to EVAL once on NOSCRIPT):
+
+- sliding_log:    exact sliding window, one sorted-set member per admitted
+                  request (memory grows with the limit)
+- gcra:           generic cell rate algorithm / token bucket, one string key
+                  per client (O(1) memory)
+- sliding_window: weighted previous+current fixed-window counters, two
+                  integer keys per client (O(1) memory, approximate)
+
+Every call returns the remaining quota and reset time for X-RateLimit-*
+response headers. Keys carry the client id as a hash tag ({client}), so all
+of a client's keys share one Redis Cluster slot.
+
+LeasedRateLimiter adds an in-process tier: each worker takes a slice of a
+client's quota from Redis in one call and admits requests locally until the
+slice is used up. Leased tokens are consumed in Redis up front, so workers
+can only under-admit (by at most one lease each); unused tokens are refunded
+in the background when a lease expires.
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+import itertools
+import threading
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+SLIDING_LOG_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+local count = redis.call('ZCARD', key)
+local granted = math.min(cost, math.max(limit - count, 0))
+for i = 1, granted do
+    redis.call('ZADD', key, now, ARGV[5] .. ':' .. i)
+end
+count = count + granted
+redis.call('PEXPIRE', key, math.ceil(window * 1000))
+
+local reset_after = window
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+if oldest[2] then
+    reset_after = tonumber(oldest[2]) + window - now
+end
+local retry_after = 0
+if granted == 0 then
+    retry_after = reset_after
+end
+return {granted, limit - count, tostring(reset_after), tostring(retry_after)}
+"""
+
+GCRA_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local burst = tonumber(ARGV[4])
+local cost = tonumber(ARGV[5])
+
+local emission_interval = window / limit
+local delay_tolerance = emission_interval * burst
+
+local tat = tonumber(redis.call('GET', key))
+if not tat or tat < now then
+    tat = now
+end
+
+local available = math.floor((delay_tolerance - (tat - now)) / emission_interval + 1e-9)
+local granted = math.min(cost, math.max(available, 0))
+if granted == 0 then
+    local allow_at = tat + emission_interval - delay_tolerance
+    return {0, 0, tostring(tat - now), tostring(allow_at - now)}
+end
+
+local new_tat = tat + granted * emission_interval
+redis.call('SET', key, string.format('%.6f', new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return {granted, available - granted, tostring(new_tat - now), '0'}
+"""
+
+SLIDING_WINDOW_SCRIPT = """
+local current_key = KEYS[1]
+local previous_key = KEYS[2]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local window_start = tonumber(ARGV[4])
+local cost = tonumber(ARGV[5])
+
+local previous = tonumber(redis.call('GET', previous_key)) or 0
+local current = tonumber(redis.call('GET', current_key)) or 0
+local elapsed = now - window_start
+local weight = (window - elapsed) / window
+local estimate = previous * weight + current
+local reset_after = window - elapsed
+
+local available = math.floor(limit - estimate + 1e-9)
+local granted = math.min(cost, math.max(available, 0))
+if granted == 0 then
+    local retry_after = reset_after
+    if current + 1 <= limit and previous > 0 then
+        -- time until the decaying previous window makes room for one request
+        retry_after = (estimate + 1 - limit) * window / previous
+    end
+    return {0, 0, tostring(reset_after), tostring(retry_after)}
+end
+
+redis.call('INCRBY', current_key, granted)
+redis.call('PEXPIRE', current_key, math.ceil(window * 2000))
+return {granted, available - granted, tostring(reset_after), '0'}
+"""
+
+SLIDING_LOG_REFUND_SCRIPT = """
+return redis.call('ZREM', KEYS[1], unpack(ARGV))
+"""
+
+GCRA_REFUND_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local emission_interval = tonumber(ARGV[2]) / tonumber(ARGV[3])
+local count = tonumber(ARGV[4])
+
+local tat = tonumber(redis.call('GET', key))
+if not tat or tat <= now then
+    return 0
+end
+local new_tat = math.max(now, tat - count * emission_interval)
+if new_tat <= now then
+    redis.call('DEL', key)
+else
+    redis.call('SET', key, string.format('%.6f', new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+end
+return count
+"""
+
+SLIDING_WINDOW_REFUND_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]))
+if not current then
+    return 0
+end
+local count = math.min(tonumber(ARGV[1]), current)
+redis.call('DECRBY', KEYS[1], count)
+return count
+"""
+
+SCRIPTS = {
+    'sliding_log': SLIDING_LOG_SCRIPT,
+    'gcra': GCRA_SCRIPT,
+    'sliding_window': SLIDING_WINDOW_SCRIPT,
+}
+
+REFUND_SCRIPTS = {
+    'sliding_log': SLIDING_LOG_REFUND_SCRIPT,
+    'gcra': GCRA_REFUND_SCRIPT,
+    'sliding_window': SLIDING_WINDOW_REFUND_SCRIPT,
+}
+
+
+@dataclass
+class RateLimitResult:
+    """Outcome of a rate limit check"""
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float  # seconds until the quota is fully restored
+    retry_after: float = 0.0  # seconds until the next request can pass (when blocked)
+    granted: int = 1  # tokens taken from Redis (lease acquisitions take several)
+    source: str = 'redis'  # 'redis' or 'local' (served from a lease)
+
+    def headers(self) -> Dict[str, str]:
+        """X-RateLimit-* (and Retry-After when blocked) response headers"""
+        headers = {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(max(self.remaining, 0)),
+            'X-RateLimit-Reset': str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(max(math.ceil(self.retry_after), 1))
+        return headers
+
+
+class RateLimiter:
+    """
+    Redis rate limiter backed by one registered Lua script
+
+    Limits are passed per call so config reloads (and per-client limits) do
+    not require rebuilding the limiter.
+    """
+
+    ALGORITHMS = tuple(SCRIPTS)
+
+    def __init__(
+        self,
+        redis_client,
+        algorithm: str = 'sliding_log',
+        limit: int = 100,
+        window: float = 60,
+        burst: Optional[int] = None,
+        key_prefix: str = 'rate_limit'
+    ):
+        """
+        Initialize rate limiter
+
+        Args:
+            redis_client: redis.Redis (or redis.asyncio.Redis for AsyncRateLimiter)
+            algorithm: One of sliding_log, gcra, sliding_window
+            limit: Default requests allowed per window
+            window: Default window length in seconds
+            burst: GCRA burst size (defaults to limit)
+            key_prefix: Redis key prefix
+        """
+        if algorithm not in SCRIPTS:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm} (expected one of {', '.join(SCRIPTS)})")
+
+        self.redis = redis_client
+        self.algorithm = algorithm
+        self.limit = limit
+        self.window = window
+        self.burst = burst
+        self.key_prefix = key_prefix
+        self.script = redis_client.register_script(SCRIPTS[algorithm])
+        self.refund_script = redis_client.register_script(REFUND_SCRIPTS[algorithm])
+        self._member_prefix = f"{os.getpid()}-{id(self):x}"
+        self._sequence = itertools.count()
+
+    def _invocation(
+        self,
+        client_id: str,
+        cost: int,
+        limit: int,
+        window: float,
+        now: float
+    ) -> Tuple[List[str], List[Any]]:
+        """Build KEYS/ARGV for the configured algorithm"""
+        if self.algorithm == 'sliding_log':
+            # Unique member base so requests sharing a timestamp are all counted
+            member = f"{now:.6f}-{self._member_prefix}-{next(self._sequence)}"
+            return [f"{self.key_prefix}:{{{client_id}}}"], [now, window, limit, cost, member]
+
+        if self.algorithm == 'gcra':
+            burst = self.burst or limit
+            return [f"{self.key_prefix}:gcra:{{{client_id}}}"], [now, window, limit, burst, cost]
+
+        window_start = math.floor(now / window) * window
+        index = int(window_start // window)
+        base = f"{self.key_prefix}:swc:{{{client_id}}}"
+        return [f"{base}:{index}", f"{base}:{index - 1}"], [now, window, limit, window_start, cost]
+
+    def refund_invocation(
+        self,
+        keys: List[str],
+        args: List[Any],
+        granted: int,
+        count: int,
+        now: float
+    ) -> Tuple[List[str], List[Any]]:
+        """
+        Build KEYS/ARGV that give back count of the tokens granted by an
+        earlier acquire() made with keys/args
+        """
+        if self.algorithm == 'sliding_log':
+            member = args[4]
+            return keys, [f"{member}:{i}" for i in range(granted - count + 1, granted + 1)]
+        if self.algorithm == 'gcra':
+            return keys, [now, args[1], args[2], count]
+        return keys[:1], [count]
+
+    @staticmethod
+    def _result(raw: List[Any], limit: int) -> RateLimitResult:
+        granted, remaining, reset_after, retry_after = raw
+        return RateLimitResult(
+            allowed=int(granted) > 0,
+            limit=limit,
+            remaining=int(remaining),
+            reset_after=float(reset_after),
+            retry_after=float(retry_after),
+            granted=int(granted)
+        )
+
+    def prepare(
+        self,
+        client_id: str,
+        cost: int = 1,
+        limit: Optional[int] = None,
+        window: Optional[float] = None,
+        now: Optional[float] = None
+    ) -> Tuple[int, List[str], List[Any]]:
+        """Resolve defaults and build the script invocation; returns (limit, keys, args)"""
+        limit = limit or self.limit
+        window = window or self.window
+        keys, args = self._invocation(client_id, cost, limit, window, now if now is not None else time.time())
+        return limit, keys, args
+
+    def acquire(
+        self,
+        client_id: str,
+        cost: int = 1,
+        limit: Optional[int] = None,
+        window: Optional[float] = None,
+        now: Optional[float] = None
+    ) -> RateLimitResult:
+        """
+        Take up to cost tokens for client_id (single EVALSHA round trip)
+
+        Args:
+            client_id: JWT subject or remote address
+            cost: Tokens wanted; fewer are granted if less quota is left
+            limit: Requests per window (defaults to the limiter's limit)
+            window: Window in seconds (defaults to the limiter's window)
+            now: Current time override (tests)
+
+        Returns:
+            RateLimitResult (allowed when at least one token was granted)
+
+        Raises:
+            redis.RedisError: On Redis failure (callers decide fail-open/closed)
+        """
+        limit, keys, args = self.prepare(client_id, cost, limit, window, now)
+        return self._result(self.script(keys=keys, args=args), limit)
+
+    def check(
+        self,
+        client_id: str,
+        limit: Optional[int] = None,
+        window: Optional[float] = None,
+        now: Optional[float] = None
+    ) -> RateLimitResult:
+        """Count one request for client_id"""
+        return self.acquire(client_id, 1, limit, window, now)
+
+    def refund(self, keys: List[str], args: List[Any]) -> int:
+        """Run the refund script for a refund_invocation()"""
+        return int(self.refund_script(keys=keys, args=args) or 0)
+
+
+class AsyncRateLimiter(RateLimiter):
+    """RateLimiter for redis.asyncio clients (ASGI serving mode)"""
+
+    async def acquire(
+        self,
+        client_id: str,
+        cost: int = 1,
+        limit: Optional[int] = None,
+        window: Optional[float] = None,
+        now: Optional[float] = None
+    ) -> RateLimitResult:
+        """Async variant of RateLimiter.acquire"""
+        limit, keys, args = self.prepare(client_id, cost, limit, window, now)
+        return self._result(await self.script(keys=keys, args=args), limit)
+
+    async def check(
+        self,
+        client_id: str,
+        limit: Optional[int] = None,
+        window: Optional[float] = None,
+        now: Optional[float] = None
+    ) -> RateLimitResult:
+        """Async variant of RateLimiter.check"""
+        return await self.acquire(client_id, 1, limit, window, now)
+
+    async def refund(self, keys: List[str], args: List[Any]) -> int:
+        """Async variant of RateLimiter.refund"""
+        return int(await self.refund_script(keys=keys, args=args) or 0)
+
+
+@dataclass
+class _Lease:
+    """Tokens (or a denial) held locally for one client"""
+    limit: int
+    window: float
+    tokens: int
+    granted: int
+    remote_remaining: int
+    reset_at: float
+    expires_at: float
+    keys: List[str]
+    args: List[Any]
+    retry_at: float = 0.0  # set for cached denials
+
+    @property
+    def denied(self) -> bool:
+        return self.granted == 0
+
+
+class LeasedRateLimiter:
+    """
+    Local pre-admission tier in front of a RateLimiter
+
+    A request is served from the client's local lease when it still holds
+    tokens; otherwise one Redis call leases a fresh slice of the quota.
+    Denials are also cached (until retry_after, at most lease_ttl), so a
+    client hammering past its limit does not cost a Redis call per request.
+    """
+
+    def __init__(
+        self,
+        limiter: RateLimiter,
+        lease_fraction: float = 0.1,
+        max_lease: int = 50,
+        lease_ttl: float = 1.0
+    ):
+        """
+        Initialize leased limiter
+
+        Args:
+            limiter: Redis-backed limiter tokens are leased from
+            lease_fraction: Share of the per-window limit leased per Redis call
+            max_lease: Upper bound on tokens per lease
+            lease_ttl: Seconds a lease (or cached denial) is used before unused
+                tokens are refunded
+        """
+        self.limiter = limiter
+        self.lease_fraction = lease_fraction
+        self.max_lease = max_lease
+        self.lease_ttl = lease_ttl
+
+        self._leases: Dict[str, _Lease] = {}
+        self._retired: List[_Lease] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.stats = {'local': 0, 'redis': 0, 'denied_local': 0, 'refunded': 0}
+
+    @property
+    def redis(self):
+        return self.limiter.redis
+
+    @property
+    def algorithm(self) -> str:
+        return self.limiter.algorithm
+
+    def lease_size(self, limit: int) -> int:
+        """Tokens requested per lease for a given per-window limit"""
+        return max(1, min(self.max_lease, int(limit * self.lease_fraction)))
+
+    def _take_local(self, client_id: str, limit: int, window: float, now: float) -> Optional[RateLimitResult]:
+        """Serve the request from the client's lease, if possible"""
+        with self._lock:
+            lease = self._leases.get(client_id)
+            if lease is None or lease.limit != limit or lease.window != window:
+                return None
+
+            if lease.denied:
+                if now < lease.retry_at:
+                    self.stats['denied_local'] += 1
+                    return RateLimitResult(
+                        allowed=False,
+                        limit=limit,
+                        remaining=0,
+                        reset_after=max(lease.reset_at - now, 0.0),
+                        retry_after=lease.retry_at - now,
+                        granted=0,
+                        source='local'
+                    )
+                return None
+
+            if lease.tokens > 0 and now < lease.expires_at:
+                lease.tokens -= 1
+                self.stats['local'] += 1
+                return RateLimitResult(
+                    allowed=True,
+                    limit=limit,
+                    remaining=lease.remote_remaining + lease.tokens,
+                    reset_after=max(lease.reset_at - now, 0.0),
+                    source='local'
+                )
+            return None
+
+    def _store_lease(
+        self,
+        client_id: str,
+        result: RateLimitResult,
+        keys: List[str],
+        args: List[Any],
+        window: float,
+        now: float
+    ) -> RateLimitResult:
+        """Record a Redis lease acquisition and count the current request against it"""
+        tokens = max(result.granted - 1, 0)
+        lease = _Lease(
+            limit=result.limit,
+            window=window,
+            tokens=tokens,
+            granted=result.granted,
+            remote_remaining=result.remaining,
+            reset_at=now + result.reset_after,
+            expires_at=now + self.lease_ttl,
+            keys=keys,
+            args=args,
+            retry_at=now + min(result.retry_after, self.lease_ttl) if not result.allowed else 0.0
+        )
+        with self._lock:
+            self.stats['redis'] += 1
+            previous = self._leases.get(client_id)
+            if previous is not None and previous.tokens > 0:
+                self._retired.append(previous)
+            self._leases[client_id] = lease
+
+        result.remaining += tokens
+        return result
+
+    def prepare(
+        self,
+        client_id: str,
+        limit: Optional[int],
+        window: Optional[float],
+        now: Optional[float]
+    ) -> Tuple[int, float, float, Optional[RateLimitResult]]:
+        """Resolve defaults and try the local tier; returns (limit, window, now, local_result)"""
+        limit = limit or self.limiter.limit
+        window = window or self.limiter.window
+        now = now if now is not None else time.time()
+        return limit, window, now, self._take_local(client_id, limit, window, now)
+
+    def check(
+        self,
+        client_id: str,
+        limit: Optional[int] = None,
+        window: Optional[float] = None,
+        now: Optional[float] = None
+    ) -> RateLimitResult:
+        """
+        Count one request for client_id, going to Redis only when the local
+        lease is exhausted or expired
+
+        Raises:
+            redis.RedisError: On Redis failure while leasing
+        """
+        limit, window, now, result = self.prepare(client_id, limit, window, now)
+        if result is not None:
+            return result
+
+        limit, keys, args = self.limiter.prepare(client_id, self.lease_size(limit), limit, window, now)
+        result = self.limiter._result(self.limiter.script(keys=keys, args=args), limit)
+        return self._store_lease(client_id, result, keys, args, window, now)
+
+    def _collect_refunds(self, now: float, expire_all: bool) -> List[Tuple[List[str], List[Any], int]]:
+        """Detach expired leases and return refund invocations for their unused tokens"""
+        with self._lock:
+            expired = [
+                client_id for client_id, lease in self._leases.items()
+                if expire_all or now >= max(lease.expires_at, lease.retry_at)
+            ]
+            leases = self._retired + [self._leases.pop(client_id) for client_id in expired]
+            self._retired = []
+
+        refunds = []
+        for lease in leases:
+            if lease.tokens > 0:
+                keys, args = self.limiter.refund_invocation(lease.keys, lease.args, lease.granted, lease.tokens, now)
+                refunds.append((keys, args, lease.tokens))
+        return refunds
+
+    def reconcile(self, now: Optional[float] = None, expire_all: bool = False) -> int:
+        """
+        Return unused tokens of expired leases to Redis
+
+        Args:
+            now: Current time override (tests)
+            expire_all: Release every lease, expired or not (shutdown)
+
+        Returns:
+            Number of tokens refunded
+        """
+        refunded = 0
+        for keys, args, count in self._collect_refunds(now if now is not None else time.time(), expire_all):
+            try:
+                self.limiter.refund(keys, args)
+                refunded += count
+            except Exception as e:
+                logger.error(f"Rate limit lease refund failed: {e}")
+        self.stats['refunded'] += refunded
+        return refunded
+
+    def start(self):
+        """Start the background reconcile thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def _run():
+            while not self._stop.wait(self.lease_ttl):
+                self.reconcile()
+
+        self._thread = threading.Thread(target=_run, name='rate-limit-reconcile', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the reconcile thread and refund every outstanding lease"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.lease_ttl + 1)
+            self._thread = None
+        self.reconcile(expire_all=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get local tier statistics"""
+        decisions = self.stats['local'] + self.stats['denied_local'] + self.stats['redis']
+        return {
+            'algorithm': self.algorithm,
+            'leases': len(self._leases),
+            'local_ratio': round((decisions - self.stats['redis']) / decisions, 4) if decisions else 0.0,
+            **self.stats
+        }
+
+
+class AsyncLeasedRateLimiter(LeasedRateLimiter):
+    """LeasedRateLimiter over an AsyncRateLimiter; reconciles in an asyncio task"""
+
+    def __init__(self, limiter: AsyncRateLimiter, **kwargs):
+        super().__init__(limiter, **kwargs)
+        self._task: Optional[asyncio.Task] = None
+
+    async def check(
+        self,
+        client_id: str,
+        limit: Optional[int] = None,
+        window: Optional[float] = None,
+        now: Optional[float] = None
+    ) -> RateLimitResult:
+        """Async variant of LeasedRateLimiter.check"""
+        limit, window, now, result = self.prepare(client_id, limit, window, now)
+        if result is not None:
+            return result
+
+        limit, keys, args = self.limiter.prepare(client_id, self.lease_size(limit), limit, window, now)
+        result = self.limiter._result(await self.limiter.script(keys=keys, args=args), limit)
+        return self._store_lease(client_id, result, keys, args, window, now)
+
+    async def reconcile(self, now: Optional[float] = None, expire_all: bool = False) -> int:
+        """Async variant of LeasedRateLimiter.reconcile"""
+        refunded = 0
+        for keys, args, count in self._collect_refunds(now if now is not None else time.time(), expire_all):
+            try:
+                await self.limiter.refund(keys, args)
+                refunded += count
+            except Exception as e:
+                logger.error(f"Rate limit lease refund failed: {e}")
+        self.stats['refunded'] += refunded
+        return refunded
+
+    def start(self):
+        """Start the reconcile task on the running event loop"""
+        if self._task is not None:
+            return
+
+        async def _run():
+            while True:
+                await asyncio.sleep(self.lease_ttl)
+                await self.reconcile()
+
+        self._task = asyncio.get_running_loop().create_task(_run())
+
+    async def stop(self):
+        """Cancel the reconcile task and refund every outstanding lease"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.reconcile(expire_all=True)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+VNF Broker Redis Topology - Build2
+==================================
+Builds Redis clients from the REDIS_* settings for one of three topologies:
+
+- standalone: REDIS_HOST / REDIS_PORT / REDIS_DB
+- sentinel:   REDIS_SENTINELS ([host, port] pairs) and REDIS_SENTINEL_SERVICE;
+              the pool asks the sentinels for the current primary and follows
+              a failover on its next reconnect
+- cluster:    REDIS_CLUSTER_NODES (startup [host, port] pairs); commands are
+              routed by key slot
+
+In a cluster, a Lua script or multi-key command may only touch keys in one
+slot. Keys used together therefore share a hash tag: only the part between
+the first `{` and `}` is hashed (see hash_tag). Commands that span slots on
+purpose (batch idempotency MGET) go through mget_any_slot.
+
+Creating a client never connects and nothing here exits the process: if
+Redis is down at startup the broker still starts, Redis-backed features fail
+open like on any Redis error, and pools connect once Redis is back.
+"""
+
+import time
+import logging
+import threading
+from typing import Dict, Any, List, Tuple, Optional
+
+import redis
+import redis.asyncio as aioredis
+from redis.cluster import RedisCluster, ClusterNode
+from redis.commands.core import Script
+from redis.connection import ConnectionPool, Encoder
+from redis.exceptions import RedisClusterException
+from redis.sentinel import Sentinel
+from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster, ClusterNode as AsyncClusterNode
+from redis.asyncio.sentinel import Sentinel as AsyncSentinel
+
+logger = logging.getLogger(__name__)
+
+REDIS_MODES = ('standalone', 'sentinel', 'cluster')
+
+
+def hash_tag(value: str) -> str:
+    """
+    Wrap value in a cluster hash tag
+
+    Keys containing the same tag hash to the same slot, so they can be used
+    together in one Lua script, MULTI or multi-key command.
+    """
+    return f"{{{value}}}"
+
+
+def _nodes(pairs: List, default: Tuple[str, int]) -> List[Tuple[str, int]]:
+    nodes = [(str(host), int(port)) for host, port in pairs or []]
+    return nodes or [default]
+
+
+def redis_mode(config: Dict[str, Any]) -> str:
+    mode = config.get('REDIS_MODE', 'standalone')
+    if mode not in REDIS_MODES:
+        raise ValueError(f"Unknown REDIS_MODE: {mode} (expected one of {', '.join(REDIS_MODES)})")
+    return mode
+
+
+def describe_topology(config: Dict[str, Any]) -> str:
+    """One-line description of the configured topology for logs"""
+    mode = redis_mode(config)
+    default = (config['REDIS_HOST'], config['REDIS_PORT'])
+    if mode == 'sentinel':
+        sentinels = ', '.join(f"{h}:{p}" for h, p in _nodes(config.get('REDIS_SENTINELS'), (default[0], 26379)))
+        return f"sentinel service '{config.get('REDIS_SENTINEL_SERVICE', 'mymaster')}' via {sentinels}"
+    if mode == 'cluster':
+        return f"cluster via {', '.join(f'{h}:{p}' for h, p in _nodes(config.get('REDIS_CLUSTER_NODES'), default))}"
+    return f"{default[0]}:{default[1]}/{config.get('REDIS_DB', 0)}"
+
+
+def _connection_kwargs(config: Dict[str, Any], decode_responses: bool) -> Dict[str, Any]:
+    return {
+        'password': config.get('REDIS_PASSWORD'),
+        'decode_responses': decode_responses,
+        'socket_connect_timeout': 5,
+        'socket_keepalive': True
+    }
+
+
+class LazyRedisCluster:
+    """
+    RedisCluster that discovers the cluster on first use
+
+    RedisCluster() connects to a startup node in its constructor. Deferring
+    that keeps startup independent of Redis; while the cluster is unreachable
+    each use raises redis.ConnectionError (retried at most every
+    retry_interval seconds), like a standalone client would.
+    """
+
+    def __init__(self, retry_interval: float = 1.0, **kwargs):
+        self._kwargs = kwargs
+        self._client: Optional[RedisCluster] = None
+        self._lock = threading.Lock()
+        self._retry_at = 0.0
+        self._error: Optional[Exception] = None
+        self.retry_interval = retry_interval
+        self._encoder = Encoder('utf-8', 'strict', kwargs.get('decode_responses', False))
+
+    def _get(self) -> RedisCluster:
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None:
+                if time.monotonic() < self._retry_at:
+                    raise redis.ConnectionError(f"Redis Cluster unavailable: {self._error}")
+                try:
+                    self._client = RedisCluster(**self._kwargs)
+                except (RedisClusterException, redis.RedisError) as e:
+                    self._error = e
+                    self._retry_at = time.monotonic() + self.retry_interval
+                    raise redis.ConnectionError(f"Redis Cluster unavailable: {e}") from e
+            return self._client
+
+    def get_encoder(self) -> Encoder:
+        return self._encoder
+
+    def register_script(self, script) -> Script:
+        # Scripts are hashed locally; the cluster is contacted on first call
+        return Script(self, script)
+
+    def __getattr__(self, name: str):
+        return getattr(self._get(), name)
+
+
+class _AsyncRedisCluster(AsyncRedisCluster):
+    """Async RedisCluster whose discovery failures are redis.ConnectionError (retried at most every second)"""
+
+    _retry_at = 0.0
+    _error: Optional[Exception] = None
+
+    async def initialize(self, *args, **kwargs):
+        if time.monotonic() < self._retry_at:
+            raise redis.ConnectionError(f"Redis Cluster unavailable: {self._error}")
+        try:
+            return await super().initialize(*args, **kwargs)
+        except (RedisClusterException, redis.RedisError) as e:
+            self._error = e
+            self._retry_at = time.monotonic() + 1.0
+            raise redis.ConnectionError(f"Redis Cluster unavailable: {e}") from e
+
+
+def create_redis_client(config: Dict[str, Any], decode_responses: bool = True):
+    """
+    Create a Redis client for the configured topology (does not connect)
+
+    Args:
+        config: Broker CONFIG (REDIS_* keys)
+        decode_responses: Return str (True) or raw bytes (False)
+
+    Returns:
+        redis.Redis (standalone / sentinel primary) or a lazily discovered RedisCluster
+    """
+    mode = redis_mode(config)
+    kwargs = _connection_kwargs(config, decode_responses)
+    max_connections = config.get('REDIS_MAX_CONNECTIONS', 10)
+    default = (config['REDIS_HOST'], config['REDIS_PORT'])
+
+    if mode == 'sentinel':
+        sentinel = Sentinel(
+            _nodes(config.get('REDIS_SENTINELS'), (default[0], 26379)),
+            socket_timeout=5,
+            sentinel_kwargs={'password': config.get('REDIS_SENTINEL_PASSWORD'), 'socket_timeout': 5}
+        )
+        return sentinel.master_for(
+            config.get('REDIS_SENTINEL_SERVICE', 'mymaster'),
+            db=config.get('REDIS_DB', 0),
+            max_connections=max_connections,
+            **kwargs
+        )
+
+    if mode == 'cluster':
+        if config.get('REDIS_DB', 0):
+            logger.warning("REDIS_DB is ignored in cluster mode (clusters only have db 0)")
+        return LazyRedisCluster(
+            startup_nodes=[ClusterNode(host, port) for host, port in _nodes(config.get('REDIS_CLUSTER_NODES'), default)],
+            max_connections=max_connections,
+            **kwargs
+        )
+
+    return redis.Redis(connection_pool=ConnectionPool(
+        host=default[0],
+        port=default[1],
+        db=config.get('REDIS_DB', 0),
+        max_connections=max_connections,
+        **kwargs
+    ))
+
+
+def create_async_redis_client(config: Dict[str, Any], decode_responses: bool = True):
+    """
+    Async counterpart of create_redis_client (redis.asyncio)
+
+    The async RedisCluster already discovers the cluster on its first
+    command; it only needs its discovery errors mapped to ConnectionError.
+    """
+    mode = redis_mode(config)
+    kwargs = _connection_kwargs(config, decode_responses)
+    max_connections = config.get('REDIS_MAX_CONNECTIONS', 10)
+    default = (config['REDIS_HOST'], config['REDIS_PORT'])
+
+    if mode == 'sentinel':
+        sentinel = AsyncSentinel(
+            _nodes(config.get('REDIS_SENTINELS'), (default[0], 26379)),
+            socket_timeout=5,
+            sentinel_kwargs={'password': config.get('REDIS_SENTINEL_PASSWORD'), 'socket_timeout': 5}
+        )
+        return sentinel.master_for(
+            config.get('REDIS_SENTINEL_SERVICE', 'mymaster'),
+            db=config.get('REDIS_DB', 0),
+            max_connections=max_connections,
+            **kwargs
+        )
+
+    if mode == 'cluster':
+        return _AsyncRedisCluster(
+            startup_nodes=[AsyncClusterNode(host, port) for host, port in _nodes(config.get('REDIS_CLUSTER_NODES'), default)],
+            max_connections=max_connections,
+            **kwargs
+        )
+
+    return aioredis.Redis(connection_pool=aioredis.ConnectionPool(
+        host=default[0],
+        port=default[1],
+        db=config.get('REDIS_DB', 0),
+        max_connections=max_connections,
+        **kwargs
+    ))
+
+
+def mget_any_slot(client, keys: List[str]):
+    """
+    MGET keys that may live in different cluster slots
+
+    Cluster clients split the keys per slot (mget_nonatomic); other clients
+    use a plain MGET. Returns a list, or an awaitable for async clients.
+    """
+    mget = getattr(client, 'mget_nonatomic', None)
+    return mget(keys) if mget is not None else client.mget(keys)
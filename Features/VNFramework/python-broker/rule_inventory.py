@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+VNF Broker Rule Inventory - Build2
+==================================
+Per-VNF cache of firewall rule sets with content-hash versions.
+
+CloudStack polls the list endpoint constantly, while rule sets change rarely
+and mostly through this broker. RuleInventory keeps the last full rule list
+of each vnfInstanceId:
+
+- filled by a full list fetch, kept current by write-through from
+  create / update / delete, and re-fetched by a background refresh every
+  refresh interval while the VNF is still being listed
+- an entry is served for at most max_age seconds after its last fetch, so a
+  VNF that cannot be refreshed falls back to live lists
+- version is a hash of the rule contents. Every worker that holds the same
+  rules computes the same version, so list ETags agree across workers and
+  If-None-Match can be answered with 304 without touching the VNF
+
+Write-through only reaches the worker that handled the write. An
+InventoryInvalidator publishes the VNF id on a Redis channel so the other
+workers drop their copy and re-fetch on the next list.
+"""
+
+import json
+import uuid
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple, Callable, Mapping
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+def _rule_key(rule: Dict[str, Any]) -> str:
+    return str(rule.get('ruleId', rule.get('id')))
+
+
+class InventorySnapshot:
+    """Immutable view of one VNF's rules"""
+
+    __slots__ = ('rules', 'version', 'fetched_at')
+
+    def __init__(self, rules: Tuple[Dict[str, Any], ...], version: str, fetched_at: float):
+        self.rules = rules
+        self.version = version
+        self.fetched_at = fetched_at
+
+
+class _Entry:
+    __slots__ = ('rules', 'fetched_at', 'read_at', 'snapshot')
+
+    def __init__(self, rules: 'OrderedDict[str, Dict[str, Any]]', now: float):
+        self.rules = rules
+        self.fetched_at = now
+        self.read_at = now
+        self.snapshot: Optional[InventorySnapshot] = None
+
+
+class RuleInventory:
+    """Thread-safe per-VNF rule set cache"""
+
+    def __init__(self, max_vnfs: int = 1000, max_rules: int = 50000, max_age: float = 300.0, idle_ttl: float = 900.0):
+        """
+        Initialize inventory
+
+        Args:
+            max_vnfs: VNF instances kept (least recently listed dropped first)
+            max_rules: Larger rule sets are not cached (listed live instead)
+            max_age: Seconds an entry is served after its last full fetch
+            idle_ttl: Entries not listed for this long are dropped instead of refreshed
+        """
+        self.max_vnfs = max_vnfs
+        self.max_rules = max_rules
+        self.max_age = max_age
+        self.idle_ttl = idle_ttl
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+        # Writes per VNF, so a fetch that raced a write-through is not stored
+        self._writes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'fetches': 0, 'write_through': 0, 'invalidations': 0}
+
+    def get(self, vnf_instance_id: str) -> Optional[InventorySnapshot]:
+        """
+        Current rules of a VNF, or None if not cached or older than max_age
+
+        Snapshot rules are shared: callers must not modify them.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(vnf_instance_id)
+            if entry is None or now - entry.fetched_at >= self.max_age:
+                self.stats['misses'] += 1
+                return None
+            entry.read_at = now
+            self._entries.move_to_end(vnf_instance_id)
+            self.stats['hits'] += 1
+            return self._snapshot(entry)
+
+    @staticmethod
+    def _snapshot(entry: _Entry) -> InventorySnapshot:
+        if entry.snapshot is None:
+            rules = tuple(entry.rules.values())
+            digest = hashlib.sha256(json.dumps(rules, sort_keys=True, default=str).encode()).hexdigest()
+            entry.snapshot = InventorySnapshot(rules, digest[:16], entry.fetched_at)
+        return entry.snapshot
+
+    def fetch_token(self, vnf_instance_id: str) -> int:
+        """Call before a full fetch and pass the token to replace()"""
+        with self._lock:
+            return self._writes.get(vnf_instance_id, 0)
+
+    def replace(self, vnf_instance_id: str, rules: List[Dict[str, Any]],
+                token: Optional[int] = None) -> Optional[InventorySnapshot]:
+        """
+        Store the result of a full list fetch
+
+        Args:
+            vnf_instance_id: VNF the rules were fetched from
+            rules: Complete rule list in vendor order
+            token: fetch_token() taken before the fetch; if a write happened
+                   since, the fetch may predate it and is not stored
+
+        Returns:
+            The new snapshot, or None if not stored (too many rules, or raced a write)
+        """
+        if len(rules) > self.max_rules:
+            self.invalidate(vnf_instance_id)
+            return None
+        now = time.monotonic()
+        entry = _Entry(OrderedDict((_rule_key(rule), rule) for rule in rules), now)
+        with self._lock:
+            if token is not None and self._writes.get(vnf_instance_id, 0) != token:
+                return None
+            previous = self._entries.get(vnf_instance_id)
+            if previous is not None:
+                entry.read_at = previous.read_at
+            self._entries[vnf_instance_id] = entry
+            self._entries.move_to_end(vnf_instance_id)
+            while len(self._entries) > self.max_vnfs:
+                self._entries.popitem(last=False)
+            self.stats['fetches'] += 1
+            return self._snapshot(entry)
+
+    def upsert(self, vnf_instance_id: str, rule: Dict[str, Any]) -> bool:
+        """
+        Write-through of a created or updated rule (position kept on update)
+
+        Returns:
+            True if the VNF is cached (nothing to do otherwise)
+        """
+        with self._lock:
+            self._writes[vnf_instance_id] = self._writes.get(vnf_instance_id, 0) + 1
+            entry = self._entries.get(vnf_instance_id)
+            if entry is None:
+                return False
+            entry.rules[_rule_key(rule)] = rule
+            entry.snapshot = None
+            self.stats['write_through'] += 1
+            if len(entry.rules) > self.max_rules:
+                del self._entries[vnf_instance_id]
+            return True
+
+    def remove(self, vnf_instance_id: str, rule_id: str) -> bool:
+        """Write-through of a deleted rule; True if the VNF is cached"""
+        with self._lock:
+            self._writes[vnf_instance_id] = self._writes.get(vnf_instance_id, 0) + 1
+            entry = self._entries.get(vnf_instance_id)
+            if entry is None:
+                return False
+            if entry.rules.pop(str(rule_id), None) is not None:
+                entry.snapshot = None
+            self.stats['write_through'] += 1
+            return True
+
+    def invalidate(self, vnf_instance_id: str) -> bool:
+        """Drop a VNF's entry; True if it was cached"""
+        with self._lock:
+            self._writes[vnf_instance_id] = self._writes.get(vnf_instance_id, 0) + 1
+            if self._entries.pop(vnf_instance_id, None) is None:
+                return False
+            self.stats['invalidations'] += 1
+            return True
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self.stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+
+    def due_for_refresh(self, interval: float) -> List[str]:
+        """
+        VNFs whose rules were fetched at least interval seconds ago and that
+        were listed within idle_ttl (idle entries are dropped)
+        """
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for vnf_instance_id, entry in list(self._entries.items()):
+                if now - entry.read_at >= self.idle_ttl:
+                    del self._entries[vnf_instance_id]
+                elif now - entry.fetched_at >= interval:
+                    due.append(vnf_instance_id)
+            if len(self._writes) > 2 * self.max_vnfs:
+                self._writes = {vnf: n for vnf, n in self._writes.items() if vnf in self._entries}
+        return due
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get inventory statistics"""
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            'vnfs': len(self._entries),
+            'rules': sum(len(entry.rules) for entry in list(self._entries.values())),
+            'max_age': self.max_age,
+            'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else 0.0,
+            **self.stats
+        }
+
+
+def list_etag(version: str, query: Mapping[str, str]) -> str:
+    """
+    ETag of one list response: inventory version plus the query that shaped it
+
+    Weak, since timestamp and request_id differ between otherwise equal bodies.
+
+    Args:
+        version: InventorySnapshot.version
+        query: Query parameters (filters, limit, cursor, format)
+    """
+    shape = json.dumps(sorted((k, v) for k, v in query.items() if k != 'vnfInstanceId'))
+    return f'W/"{version}-{hashlib.sha256(shape.encode()).hexdigest()[:8]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header lists etag (weak comparison, '*' matches)"""
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix('W/')
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == opaque:
+            return True
+    return False
+
+
+class InventoryRefresher:
+    """Background thread re-fetching cached rule sets that are due"""
+
+    def __init__(self, inventory: RuleInventory, refresh: Callable[[str], Any], interval: float = 60.0):
+        """
+        Initialize refresher
+
+        Args:
+            inventory: Inventory to keep fresh
+            refresh: Fetches one VNF's rules and stores them with inventory.replace
+            interval: Seconds between refreshes of one VNF (keep below max_age)
+        """
+        self.inventory = inventory
+        self.refresh = refresh
+        self.interval = interval
+        self.stats = {'refreshed': 0, 'errors': 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the refresh thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='rule-inventory-refresh', daemon=True)
+            self._thread.start()
+
+    def run_once(self) -> int:
+        """Refresh every due VNF once; returns the number refreshed"""
+        refreshed = 0
+        for vnf_instance_id in self.inventory.due_for_refresh(self.interval):
+            if self._stop.is_set():
+                break
+            try:
+                self.refresh(vnf_instance_id)
+                refreshed += 1
+            except Exception as e:
+                # Left as is: served until max_age, then listed live
+                self.stats['errors'] += 1
+                logger.warning(f"Rule inventory refresh failed for {vnf_instance_id}: {e}")
+        self.stats['refreshed'] += refreshed
+        return refreshed
+
+    def _run(self):
+        while not self._stop.wait(min(self.interval, 5.0)):
+            self.run_once()
+
+    def stop(self):
+        """Stop the refresh thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+class InventoryInvalidator:
+    """Tells other workers to drop a VNF's inventory after a local write"""
+
+    def __init__(self, redis_client, inventory: RuleInventory, channel: str = 'rule_inventory:invalidate',
+                 subscribe: bool = True):
+        """
+        Initialize invalidator
+
+        Args:
+            redis_client: Redis client (str responses)
+            inventory: Local inventory to invalidate
+            channel: Pub/sub channel shared by all workers
+            subscribe: Start the listener thread immediately
+        """
+        self.redis = redis_client
+        self.inventory = inventory
+        self.channel = channel
+        self.origin = uuid.uuid4().hex[:12]
+        self.stats = {'published': 0, 'received': 0, 'publish_errors': 0}
+        self._pubsub = None
+        self._listener = None
+        if subscribe:
+            self._pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(**{channel: self._handle_message})
+            self._listener = self._pubsub.run_in_thread(
+                sleep_time=0.01, daemon=True, exception_handler=self._handle_error)
+
+    def publish(self, vnf_instance_id: str):
+        """Announce a write to vnf_instance_id (errors are logged; entries still expire by max_age)"""
+        try:
+            self.redis.publish(self.channel, f"{self.origin}:{vnf_instance_id}")
+            self.stats['published'] += 1
+        except redis.RedisError as e:
+            self.stats['publish_errors'] += 1
+            logger.warning(f"Rule inventory invalidation not published for {vnf_instance_id}: {e}")
+
+    def _handle_message(self, message: Dict[str, Any]):
+        data = message.get('data')
+        if isinstance(data, bytes):
+            data = data.decode()
+        origin, _, vnf_instance_id = str(data).partition(':')
+        if origin != self.origin and vnf_instance_id:
+            self.stats['received'] += 1
+            self.inventory.invalidate(vnf_instance_id)
+
+    def _handle_error(self, error: Exception, pubsub, worker):
+        """Connection lost: invalidations may have been missed, so start from an empty inventory"""
+        logger.warning(f"Rule inventory invalidation listener error, clearing inventory: {error}")
+        self.inventory.clear()
+        # The pubsub reconnects and resubscribes on its next read
+        time.sleep(1.0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get invalidation statistics"""
+        return {'listening': self._listener is not None, **self.stats}
+
+    def close(self):
+        """Stop the listener thread"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except redis.RedisError:
+                pass
+            self._pubsub = None
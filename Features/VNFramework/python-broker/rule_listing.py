@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+VNF Broker Rule Listing - Build2
+================================
+Filtering and cursor pagination over a streamed rule list.
+
+Appliances with 10k+ rules return their whole rule table from one list
+call. Listing handles rules as an iterator from end to end, so a page never
+holds more than `limit` rules in memory:
+
+- iter_json_items / aiter_json_items parse the vendor response
+  incrementally at the dictionary's listPath (e.g. `$.data`). This uses the
+  optional ijson package; without it, the body is buffered and parsed once.
+- RuleFilter drops non-matching rules on the broker (protocol, port range,
+  CIDR containment of source / destination)
+- RulePager selects one page and stops reading the vendor list once the page
+  is full; it issues an opaque cursor for the next page
+
+Cursors hold the last rule id, the position in the filtered list and a
+fingerprint of the filters. A page resumes right after that rule, or at the
+same position if the rule has since been deleted. Rules inserted before the
+cursor position may therefore be listed twice; none are skipped unless the
+cursor rule itself was deleted.
+"""
+
+import json
+import base64
+import hashlib
+import logging
+import ipaddress
+from typing import Dict, Any, Optional, List, Tuple, Iterable, Iterator, AsyncIterable, AsyncIterator, Mapping
+
+logger = logging.getLogger(__name__)
+
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
+
+# ============================================================================
+# Incremental vendor list parsing
+# ============================================================================
+
+def _path_keys(list_path: str) -> List[str]:
+    """Keys of a dotted JSONPath ($, $.data, $.results.items)"""
+    path = (list_path or '$').strip()
+    if path != '$' and not path.startswith('$.'):
+        raise ValueError(f"Unsupported listPath: {list_path} (expected $ or $.key[.key...])")
+    return [key for key in path[2:].split('.') if key]
+
+
+def _ijson_prefix(list_path: str) -> str:
+    return '.'.join(_path_keys(list_path) + ['item'])
+
+
+def _items_from_document(body: bytes, list_path: str) -> Iterator[Any]:
+    node = json.loads(body) if body else None
+    for key in _path_keys(list_path):
+        node = node.get(key) if isinstance(node, dict) else None
+    if node is None:
+        return iter(())
+    if not isinstance(node, list):
+        raise ValueError(f"listPath {list_path} does not select a list")
+    return iter(node)
+
+
+def iter_json_items(chunks: Iterable[bytes], list_path: str = '$') -> Iterator[Any]:
+    """
+    Yield the elements of the list at list_path as the response body arrives
+
+    Args:
+        chunks: Response body chunks (e.g. requests' iter_content())
+        list_path: Dictionary listPath selecting the rule array
+
+    Returns:
+        Iterator over decoded list elements
+    """
+    if not IJSON_AVAILABLE:
+        yield from _items_from_document(b''.join(chunks), list_path)
+        return
+    items = ijson.sendable_list()
+    parser = ijson.items_coro(items, _ijson_prefix(list_path), use_float=True)
+    for chunk in chunks:
+        parser.send(chunk)
+        yield from items
+        del items[:]
+    parser.close()
+    yield from items
+
+
+async def aiter_json_items(chunks: AsyncIterable[bytes], list_path: str = '$') -> AsyncIterator[Any]:
+    """Async counterpart of iter_json_items (e.g. httpx Response.aiter_bytes())"""
+    if not IJSON_AVAILABLE:
+        body = b''.join([chunk async for chunk in chunks])
+        for item in _items_from_document(body, list_path):
+            yield item
+        return
+    items = ijson.sendable_list()
+    parser = ijson.items_coro(items, _ijson_prefix(list_path), use_float=True)
+    async for chunk in chunks:
+        parser.send(chunk)
+        for item in items:
+            yield item
+        del items[:]
+    parser.close()
+    for item in items:
+        yield item
+
+
+# ============================================================================
+# Filtering
+# ============================================================================
+
+def _port_range(value) -> Optional[Tuple[int, int]]:
+    """Parse 443, '443', '1000-2000' or '1000:2000' (None = any port)"""
+    if value is None or value == '' or str(value).lower() == 'any':
+        return None
+    text = str(value).replace(':', '-')
+    low, _, high = text.partition('-')
+    low, high = int(low), int(high or low)
+    if not 1 <= low <= high <= 65535:
+        raise ValueError(f"Invalid port range: {value}")
+    return low, high
+
+
+def _network(value) -> Optional[Any]:
+    if not value or str(value).lower() == 'any':
+        return None
+    try:
+        return ipaddress.ip_network(str(value), strict=False)
+    except ValueError:
+        return None
+
+
+class RuleFilter:
+    """Server-side rule filter built from list query parameters"""
+
+    def __init__(
+        self,
+        protocol: Optional[str] = None,
+        port: Optional[str] = None,
+        source_cidr: Optional[str] = None,
+        destination_cidr: Optional[str] = None
+    ):
+        """
+        Initialize filter (every criterion is optional)
+
+        Args:
+            protocol: Rule protocol (tcp, udp, icmp, any)
+            port: Destination port or range; matches rules whose port (range) overlaps it
+            source_cidr: Matches rules whose source lies within this network
+            destination_cidr: Matches rules whose destination lies within this network
+
+        Raises:
+            ValueError: Malformed port range or network
+        """
+        self.protocol = protocol.lower() if protocol else None
+        self.port = _port_range(port)
+        self.source = ipaddress.ip_network(source_cidr, strict=False) if source_cidr else None
+        self.destination = ipaddress.ip_network(destination_cidr, strict=False) if destination_cidr else None
+
+    @classmethod
+    def from_query(cls, args: Mapping[str, str]) -> 'RuleFilter':
+        """Build from query parameters protocol, port, sourceCidr, destinationCidr"""
+        return cls(
+            protocol=args.get('protocol'),
+            port=args.get('port'),
+            source_cidr=args.get('sourceCidr'),
+            destination_cidr=args.get('destinationCidr')
+        )
+
+    @staticmethod
+    def _within(value, network) -> bool:
+        rule_network = _network(value)
+        return (rule_network is not None and rule_network.version == network.version
+                and rule_network.subnet_of(network))
+
+    def matches(self, rule: Dict[str, Any]) -> bool:
+        """True if the rule passes every criterion"""
+        if self.protocol and str(rule.get('protocol', '')).lower() != self.protocol:
+            return False
+        if self.port:
+            try:
+                rule_port = _port_range(rule.get('destinationPort'))
+            except ValueError:
+                return False
+            if rule_port is None or rule_port[1] < self.port[0] or rule_port[0] > self.port[1]:
+                return False
+        if self.source and not self._within(rule.get('sourceIp'), self.source):
+            return False
+        if self.destination and not self._within(rule.get('destinationIp'), self.destination):
+            return False
+        return True
+
+    def fingerprint(self) -> str:
+        """Short digest of the criteria (cursors are only valid for the same filter)"""
+        criteria = [self.protocol, self.port, str(self.source or ''), str(self.destination or '')]
+        return hashlib.sha256(json.dumps(criteria).encode()).hexdigest()[:8]
+
+
+# ============================================================================
+# Pagination
+# ============================================================================
+
+def _rule_key(rule: Dict[str, Any]) -> Optional[str]:
+    key = rule.get('ruleId', rule.get('id'))
+    return None if key is None else str(key)
+
+
+class RulePager:
+    """
+    Selects one page from a stream of rules
+
+    Feed rules in vendor order to accept(); emit those it accepts and stop
+    reading as soon as done is True.
+    """
+
+    def __init__(self, rule_filter: RuleFilter, limit: Optional[int] = None, cursor: Optional[str] = None):
+        """
+        Initialize pager
+
+        Args:
+            rule_filter: Criteria rules must match
+            limit: Page size (None = every remaining rule)
+            cursor: nextCursor of the previous page
+
+        Raises:
+            ValueError: Cursor malformed or issued for other filters
+        """
+        self.filter = rule_filter
+        self.limit = limit
+        self.next_cursor: Optional[str] = None
+        self.done = False
+        self.count = 0
+        self._position = 0  # matching rules passed so far
+        self._last_key: Optional[str] = None
+        self._skip_to: Optional[Tuple[Optional[str], int]] = None
+        if cursor:
+            after, position = self._decode(cursor)
+            if position > 0:
+                self._skip_to = (after, position)
+
+    def _decode(self, cursor: str) -> Tuple[Optional[str], int]:
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            after, position, fingerprint = data['k'], int(data['n']), data['f']
+        except Exception:
+            raise ValueError("Invalid cursor")
+        if fingerprint != self.filter.fingerprint():
+            raise ValueError("Cursor was issued for different filters")
+        return after, position
+
+    def _encode(self) -> str:
+        data = json.dumps({'k': self._last_key, 'n': self._position, 'f': self.filter.fingerprint()},
+                          separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def accept(self, rule: Dict[str, Any]) -> bool:
+        """
+        Offer the next rule of the list
+
+        Returns:
+            True if the rule belongs to this page
+        """
+        if self.done or not isinstance(rule, dict) or not self.filter.matches(rule):
+            return False
+        key = _rule_key(rule)
+        if self._skip_to is not None:
+            after, position = self._skip_to
+            self._position += 1
+            if (after is not None and key == after) or self._position >= position:
+                self._skip_to = None
+            return False
+        if self.limit is not None and self.count >= self.limit:
+            # A further match exists: the page is full and there is a next page
+            self.done = True
+            self.next_cursor = self._encode()
+            return False
+        self.count += 1
+        self._position += 1
+        self._last_key = key
+        return True
+
+
+def paginate(rules: Iterable[Dict[str, Any]], pager: RulePager) -> List[Dict[str, Any]]:
+    """
+    Collect one page from an iterable of rules (reading stops once it is full)
+
+    Returns:
+        Rules on this page; the next page's cursor is pager.next_cursor
+    """
+    page = []
+    iterator = iter(rules)
+    try:
+        for rule in iterator:
+            if pager.accept(rule):
+                page.append(rule)
+            if pager.done:
+                break
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+    return page
+
+
+def ndjson_line(obj: Any) -> bytes:
+    """One NDJSON record"""
+    return json.dumps(obj, separators=(',', ':')).encode() + b'\n'
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+VNF Broker Single-Flight Deduplication - Build2
+===============================================
+Collapses concurrent identical requests into one execution.
+
+check_idempotency / store_idempotency is check-then-act: when CloudStack
+retries a slow create, both copies miss the cache and both call the
+appliance. Single-flight closes that gap at two levels, keyed by the
+idempotency key:
+
+- in-process: the first caller runs the operation; concurrent duplicates in
+  the same worker wait on it and share its outcome (success or failure)
+- across workers: the runner holds a Redis `SET NX PX` lease. A duplicate in
+  another worker polls the idempotency cache for the stored result until the
+  lease is released or expires. If the lease goes away without a stored
+  result (the first attempt failed), it takes the lease and runs the
+  operation itself.
+
+Redis trouble never blocks a request: without a lease the operation simply
+runs (the in-process layer still applies).
+"""
+
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, Optional, Callable, Tuple, Awaitable
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Delete the lease only if this caller still owns it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class _Call:
+    """Outcome of one in-flight execution, shared with in-process duplicates"""
+
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self, done):
+        self.done = done
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _SingleFlightBase:
+    """Shared configuration and statistics"""
+
+    def __init__(
+        self,
+        redis_client=None,
+        lease_ttl: float = 30.0,
+        poll_interval: float = 0.05,
+        key_prefix: str = 'singleflight:'
+    ):
+        """
+        Initialize single-flight group
+
+        Args:
+            redis_client: Redis client for cross-worker leases (None = in-process only)
+            lease_ttl: Seconds a lease is held at most; also the longest a
+                       duplicate waits for another worker's result
+            poll_interval: Seconds between result polls while another worker runs
+            key_prefix: Prefix for lease keys
+        """
+        self.redis = redis_client
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.key_prefix = key_prefix
+        self._release = redis_client.register_script(RELEASE_SCRIPT) if redis_client is not None else None
+        self.stats = {'executed': 0, 'shared_local': 0, 'shared_remote': 0, 'lease_errors': 0}
+
+    def _lease_args(self) -> Dict[str, Any]:
+        return {'nx': True, 'px': max(int(self.lease_ttl * 1000), 1)}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get deduplication statistics"""
+        return {'in_flight': len(self._calls), **self.stats}
+
+
+class SingleFlight(_SingleFlightBase):
+    """Thread-safe single-flight group for the Flask broker"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any], load: Callable[[], Optional[Any]]) -> Tuple[Any, bool]:
+        """
+        Run fn once for all concurrent callers with the same key
+
+        Args:
+            key: Idempotency key of the operation
+            fn: Executes the operation (and stores its result for load)
+            load: Returns the stored result of a completed execution, or None
+
+        Returns:
+            (result, executed) - executed is False when the result was shared
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            owner = call is None
+            if owner:
+                call = self._calls[key] = _Call(threading.Event())
+
+        if not owner:
+            self.stats['shared_local'] += 1
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, False
+
+        try:
+            call.value, executed = self._run_leased(key, fn, load)
+            return call.value, executed
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _run_leased(self, key: str, fn: Callable[[], Any], load: Callable[[], Optional[Any]]) -> Tuple[Any, bool]:
+        if self.redis is None:
+            return self._execute(fn), True
+
+        lease = f"{self.key_prefix}{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lease_ttl
+        while True:
+            try:
+                acquired = self.redis.set(lease, token, **self._lease_args())
+            except redis.RedisError as e:
+                logger.error(f"Single-flight lease failed for {key}: {e}")
+                self.stats['lease_errors'] += 1
+                return self._execute(fn), True
+
+            if acquired:
+                try:
+                    return self._execute(fn), True
+                finally:
+                    try:
+                        self._release(keys=[lease], args=[token])
+                    except redis.RedisError as e:
+                        logger.error(f"Single-flight lease release failed for {key}: {e}")
+
+            # Another worker is running this operation - wait for its result
+            try:
+                while time.monotonic() < deadline:
+                    value = load()
+                    if value is not None:
+                        self.stats['shared_remote'] += 1
+                        return value, False
+                    if not self.redis.exists(lease):
+                        break
+                    time.sleep(self.poll_interval)
+            except redis.RedisError as e:
+                logger.error(f"Single-flight wait failed for {key}: {e}")
+                self.stats['lease_errors'] += 1
+                return self._execute(fn), True
+
+            if time.monotonic() >= deadline:
+                logger.warning(f"Single-flight lease for {key} outlived {self.lease_ttl}s, executing anyway")
+                return self._execute(fn), True
+            # Lease released without a stored result: the other attempt failed, take over
+
+    def _execute(self, fn: Callable[[], Any]) -> Any:
+        self.stats['executed'] += 1
+        return fn()
+
+
+class AsyncSingleFlight(_SingleFlightBase):
+    """Single-flight group for the ASGI broker (redis.asyncio client)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._calls: Dict[str, _Call] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]],
+                 load: Callable[[], Awaitable[Optional[Any]]]) -> Tuple[Any, bool]:
+        """Async counterpart of SingleFlight.do (fn and load are coroutine functions)"""
+        call = self._calls.get(key)
+        if call is not None:
+            self.stats['shared_local'] += 1
+            await call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, False
+
+        call = self._calls[key] = _Call(asyncio.Event())
+        try:
+            call.value, executed = await self._run_leased(key, fn, load)
+            return call.value, executed
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._calls.pop(key, None)
+            call.done.set()
+
+    async def _run_leased(self, key: str, fn: Callable[[], Awaitable[Any]],
+                          load: Callable[[], Awaitable[Optional[Any]]]) -> Tuple[Any, bool]:
+        if self.redis is None:
+            return await self._execute(fn), True
+
+        lease = f"{self.key_prefix}{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lease_ttl
+        while True:
+            try:
+                acquired = await self.redis.set(lease, token, **self._lease_args())
+            except redis.RedisError as e:
+                logger.error(f"Single-flight lease failed for {key}: {e}")
+                self.stats['lease_errors'] += 1
+                return await self._execute(fn), True
+
+            if acquired:
+                try:
+                    return await self._execute(fn), True
+                finally:
+                    try:
+                        await self._release(keys=[lease], args=[token])
+                    except redis.RedisError as e:
+                        logger.error(f"Single-flight lease release failed for {key}: {e}")
+
+            try:
+                while time.monotonic() < deadline:
+                    value = await load()
+                    if value is not None:
+                        self.stats['shared_remote'] += 1
+                        return value, False
+                    if not await self.redis.exists(lease):
+                        break
+                    await asyncio.sleep(self.poll_interval)
+            except redis.RedisError as e:
+                logger.error(f"Single-flight wait failed for {key}: {e}")
+                self.stats['lease_errors'] += 1
+                return await self._execute(fn), True
+
+            if time.monotonic() >= deadline:
+                logger.warning(f"Single-flight lease for {key} outlived {self.lease_ttl}s, executing anyway")
+                return await self._execute(fn), True
+
+    async def _execute(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.stats['executed'] += 1
+        return await fn()
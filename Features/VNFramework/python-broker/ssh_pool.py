@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+VNF Broker SSH Session Pool - Build2
+====================================
+Persistent SSH connections for CLI-driven appliances (VyOS and friends).
+
+Opening an SSH connection costs a TCP handshake, key exchange and user
+authentication - seconds per rule on a small appliance - while running a
+command on an established connection only opens a channel. SSHSessionPool
+keeps one authenticated connection per (target, port, user, credentials)
+and multiplexes commands over it as channels:
+
+- at most max_channels concurrent commands per target (sshd's MaxSessions
+  defaults to 10); further callers wait up to acquire_timeout seconds and
+  then get SSHPoolExhausted
+- a pooled connection is health-checked before use (transport active and
+  authenticated, younger than max_lifetime) and kept alive with SSH
+  keepalives. If opening a channel on a reused connection fails, the
+  connection is replaced once; a command that was already sent is never
+  re-run.
+- connections idle for idle_timeout seconds are closed by a reaper thread
+
+The pool is generic: any operation that needs a CLI on an appliance calls
+execute() (or execute_async() from asyncio code; paramiko is blocking, so it
+runs in a worker thread).
+"""
+
+import os
+import time
+import socket
+import select
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, Optional, Tuple, Callable
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 32768
+
+
+class SSHPoolExhausted(Exception):
+    """Raised when no channel slot on a target frees up within acquire_timeout"""
+
+    def __init__(self, target: str, waited: float):
+        super().__init__(f"All SSH channels to {target} busy (waited {waited:.1f}s)")
+        self.target = target
+
+
+class _Target:
+    """One pooled connection and its channel slots"""
+
+    __slots__ = ('name', 'slots', 'lock', 'client', 'connected_at', 'last_used', 'users', 'active')
+
+    def __init__(self, name: str, max_channels: int):
+        self.name = name
+        self.slots = threading.BoundedSemaphore(max_channels)
+        self.lock = threading.Lock()  # one (re)connect at a time
+        self.client = None
+        self.connected_at = 0.0
+        self.last_used = time.monotonic()
+        self.users = 0  # callers waiting for or holding a slot (pool lock)
+        self.active = 0  # open channels
+
+
+def _credential_digest(password: Optional[str]) -> str:
+    """Callers with different passwords never share an authenticated connection"""
+    return hashlib.sha256((password or '').encode()).hexdigest()[:16]
+
+
+def _drain(channel, timeout: Optional[float]) -> Tuple[bytes, bytes]:
+    """
+    Read stdout and stderr until the command exits
+
+    Both streams are read as data arrives, so a command that writes a lot to
+    one of them cannot stall on a full SSH window.
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    stdout, stderr = [], []
+    while True:
+        if channel.recv_ready():
+            stdout.append(channel.recv(CHUNK_SIZE))
+        elif channel.recv_stderr_ready():
+            stderr.append(channel.recv_stderr(CHUNK_SIZE))
+        elif channel.exit_status_ready():
+            return b''.join(stdout), b''.join(stderr)
+        elif deadline is not None and time.monotonic() >= deadline:
+            raise socket.timeout(f"SSH command did not finish within {timeout}s")
+        else:
+            # Wakes on stdout data or close; stderr and exit status are polled
+            select.select([channel], [], [], 0.05)
+
+
+class SSHSessionPool:
+    """Thread-safe pool of authenticated SSH connections, one per target and user"""
+
+    def __init__(
+        self,
+        max_channels: int = 4,
+        idle_timeout: float = 300.0,
+        max_lifetime: float = 3600.0,
+        acquire_timeout: float = 30.0,
+        connect_timeout: float = 30.0,
+        keepalive: int = 30,
+        key_path: Optional[str] = None,
+        connect: Optional[Callable[[str, int, str, Optional[str]], Any]] = None
+    ):
+        """
+        Initialize pool
+
+        Args:
+            max_channels: Concurrent commands per target connection
+            idle_timeout: Seconds an unused connection stays open
+            max_lifetime: Seconds after which a connection is replaced on next use
+            acquire_timeout: Seconds a caller waits for a channel slot
+            connect_timeout: Seconds allowed for connecting and opening a channel
+            keepalive: SSH keepalive interval in seconds (0 = off)
+            key_path: Private key tried before password authentication
+            connect: Factory (host, port, username, password) -> connected
+                     paramiko.SSHClient (default: key, then password auth)
+        """
+        self.max_channels = max_channels
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.acquire_timeout = acquire_timeout
+        self.connect_timeout = connect_timeout
+        self.keepalive = keepalive
+        self.key_path = key_path
+        self.connect = connect or self._connect
+        self._targets: Dict[Tuple[str, int, str, str], _Target] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+        self.stats = {'connects': 0, 'reuses': 0, 'reconnects': 0, 'evictions': 0, 'exhausted': 0, 'errors': 0}
+
+    def _connect(self, host: str, port: int, username: str, password: Optional[str]) -> paramiko.SSHClient:
+        """Key-based auth first, then password (same order as the per-command client used)"""
+        options = dict(port=port, username=username, timeout=self.connect_timeout,
+                       banner_timeout=self.connect_timeout, auth_timeout=self.connect_timeout)
+        use_key = bool(self.key_path and os.path.exists(self.key_path))
+        try:
+            if use_key:
+                client = self._open(host, key_filename=self.key_path, **options)
+            else:
+                client = self._open(host, password=password, **options)
+        except paramiko.AuthenticationException:
+            # Only a refused key falls back to the password (a refused password would just repeat)
+            if not (use_key and password):
+                raise
+            client = self._open(host, password=password, **options)
+        if self.keepalive:
+            client.get_transport().set_keepalive(self.keepalive)
+        return client
+
+    @staticmethod
+    def _open(host: str, **options) -> paramiko.SSHClient:
+        """One connection attempt on a fresh client (closed again if it fails)"""
+        client = paramiko.SSHClient()
+        # Appliances are addressed by IP and often re-keyed on reinstall
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            client.connect(host, **options)
+        except Exception:
+            client.close()
+            raise
+        return client
+
+    def _checkout(self, host: str, port: int, username: str, password: Optional[str]) -> _Target:
+        """Target for a caller; it is not evicted until _checkin"""
+        key = (host, port, username, _credential_digest(password))
+        with self._lock:
+            target = self._targets.get(key)
+            if target is None:
+                target = self._targets[key] = _Target(f"{username}@{host}:{port}", self.max_channels)
+            target.users += 1
+            return target
+
+    def _checkin(self, target: _Target):
+        with self._lock:
+            target.users -= 1
+            target.last_used = time.monotonic()
+
+    def _healthy(self, target: _Target) -> bool:
+        transport = target.client.get_transport() if target.client is not None else None
+        if transport is None or not transport.is_active() or not transport.is_authenticated():
+            return False
+        # An aged connection is only replaced once no other command runs on it
+        return time.monotonic() - target.connected_at < self.max_lifetime or target.active > 1
+
+    def _discard(self, target: _Target):
+        """Close the target's connection (caller holds target.lock)"""
+        if target.client is not None:
+            try:
+                target.client.close()
+            except Exception:
+                pass
+            target.client = None
+
+    def _open_channel(self, target: _Target, host: str, port: int, username: str, password: Optional[str],
+                      retry: bool = True):
+        """Channel on the pooled connection; (re)connects as needed"""
+        with target.lock:
+            reused = self._healthy(target)
+            if not reused:
+                if target.client is not None:
+                    self.stats['reconnects'] += 1
+                self._discard(target)
+                target.client = self.connect(host, port, username, password)
+                target.connected_at = time.monotonic()
+                self.stats['connects'] += 1
+            client = target.client
+        try:
+            channel = client.get_transport().open_session(timeout=self.connect_timeout)
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            if not reused or not retry:
+                raise
+            # The peer dropped the connection since its last use: replace it once
+            logger.info(f"SSH connection to {target.name} went stale, reconnecting: {e}")
+            with target.lock:
+                if target.client is client:
+                    self._discard(target)
+            return self._open_channel(target, host, port, username, password, retry=False)
+        if reused:
+            self.stats['reuses'] += 1
+        return channel
+
+    def execute(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: Optional[str],
+        command: str,
+        timeout: Optional[float] = None
+    ) -> Tuple[int, str, str]:
+        """
+        Run a command on a pooled connection
+
+        Args:
+            host: Appliance address
+            port: SSH port
+            username: Login user
+            password: Password (used if key auth is unavailable or fails)
+            command: Command line to execute
+            timeout: Seconds the command may run (None = no limit)
+
+        Returns:
+            (exit status, stdout, stderr)
+
+        Raises:
+            SSHPoolExhausted: No channel slot freed up within acquire_timeout
+            paramiko.SSHException, OSError: Connection or command failure
+        """
+        port = int(port)
+        target = self._checkout(host, port, username, password)
+        started = time.monotonic()
+        if not target.slots.acquire(timeout=self.acquire_timeout):
+            self._checkin(target)
+            self.stats['exhausted'] += 1
+            raise SSHPoolExhausted(target.name, time.monotonic() - started)
+        with self._lock:
+            target.active += 1
+        try:
+            channel = self._open_channel(target, host, port, username, password)
+            try:
+                channel.settimeout(timeout)
+                channel.exec_command(command)
+                stdout, stderr = _drain(channel, timeout)
+                exit_code = channel.recv_exit_status()
+            finally:
+                channel.close()
+            return exit_code, stdout.decode('utf-8', errors='replace'), stderr.decode('utf-8', errors='replace')
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                target.active -= 1
+            target.slots.release()
+            self._checkin(target)
+
+    async def execute_async(self, host: str, port: int, username: str, password: Optional[str],
+                            command: str, timeout: Optional[float] = None) -> Tuple[int, str, str]:
+        """execute() for asyncio callers (runs in the default executor)"""
+        return await asyncio.to_thread(self.execute, host, port, username, password, command, timeout)
+
+    def evict_idle(self) -> int:
+        """
+        Close connections unused for idle_timeout seconds
+
+        Returns:
+            Number of connections closed
+        """
+        now = time.monotonic()
+        evicted = 0
+        with self._lock:
+            for key, target in list(self._targets.items()):
+                if target.users or now - target.last_used < self.idle_timeout:
+                    continue
+                if not target.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if target.client is not None:
+                        self._discard(target)
+                        evicted += 1
+                    del self._targets[key]
+                finally:
+                    target.lock.release()
+        self.stats['evictions'] += evicted
+        return evicted
+
+    def start(self):
+        """Start the idle reaper thread"""
+        if self._reaper is None:
+            self._stop.clear()
+            self._reaper = threading.Thread(target=self._run_reaper, name='ssh-pool-reaper', daemon=True)
+            self._reaper.start()
+
+    def _run_reaper(self):
+        while not self._stop.wait(max(1.0, min(self.idle_timeout / 2, 30.0))):
+            self.evict_idle()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pool statistics"""
+        with self._lock:
+            targets = list(self._targets.values())
+        return {
+            'targets': len(targets),
+            'connections': sum(1 for target in targets if target.client is not None),
+            'active_channels': sum(target.active for target in targets),
+            'max_channels': self.max_channels,
+            **self.stats
+        }
+
+    def close(self):
+        """Stop the reaper and close every connection"""
+        self._stop.set()
+        if self._reaper is not None:
+            self._reaper.join(timeout=5)
+            self._reaper = None
+        with self._lock:
+            targets = list(self._targets.values())
+            self._targets.clear()
+        for target in targets:
+            with target.lock:
+                self._discard(target)
@@ -2,14 +2,16 @@ import os
 import time
 import types
 import pytest
+import fakeredis
 
 # Import the broker module
 import importlib
 
 
 class FakePipeline:
-    def __init__(self, store):
+    def __init__(self, store, kv=None):
         self.store = store
+        self.kv = kv if kv is not None else {}
         self.ops = []
 
     def zremrangebyscore(self, key, min_score, max_score):
@@ -28,6 +30,10 @@ class FakePipeline:
         self.ops.append(("expire", key, ttl))
         return self
 
+    def setex(self, key, ttl, value):
+        self.ops.append(("setex", key, ttl, value))
+        return self
+
     def execute(self):
         # Very small in-memory simulation for rate limiting pipeline
         results = []
@@ -52,6 +58,10 @@ class FakePipeline:
             elif op[0] == "expire":
                 # No-op for unit tests
                 results.append(True)
+            elif op[0] == "setex":
+                _, key, _ttl, value = op
+                self.kv[key] = value
+                results.append(True)
         self.ops.clear()
         return results
 
@@ -60,21 +70,78 @@ class FakeRedis:
     def __init__(self):
         self.zsets = {}
         self.kv = {}
+        self.mget_calls = 0
+        # Lua scripts (rate limiter) run on fakeredis' embedded interpreter
+        self.lua = fakeredis.FakeRedis(decode_responses=True)
+
+    def register_script(self, script):
+        return self.lua.register_script(script)
 
     def pipeline(self):
-        return FakePipeline(self.zsets)
+        return FakePipeline(self.zsets, self.kv)
 
     def get(self, key):
         return self.kv.get(key)
 
+    def mget(self, keys):
+        self.mget_calls += 1
+        return [self.kv.get(key) for key in keys]
+
     def setex(self, key, ttl, value):
         self.kv[key] = value
         return True
 
+    def expire(self, key, ttl):
+        return key in self.kv
+
+    def delete(self, *keys):
+        return sum(self.kv.pop(key, None) is not None for key in keys)
+
+    # Leases (single-flight) live next to the Lua state so scripts can release them
+    def set(self, key, value, **kwargs):
+        return self.lua.set(key, value, **kwargs)
+
+    def exists(self, *keys):
+        return self.lua.exists(*keys)
+
     def ping(self):
         return True
 
 
+class AsyncFakePipeline(FakePipeline):
+    async def execute(self):
+        return FakePipeline.execute(self)
+
+
+class AsyncFakeRedis(FakeRedis):
+    """redis.asyncio-style facade over FakeRedis for the ASGI app"""
+
+    def __init__(self):
+        super().__init__()
+        self.lua = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    def pipeline(self):
+        return AsyncFakePipeline(self.zsets, self.kv)
+
+    async def get(self, key):
+        return FakeRedis.get(self, key)
+
+    async def mget(self, keys):
+        return FakeRedis.mget(self, keys)
+
+    async def setex(self, key, ttl, value):
+        return FakeRedis.setex(self, key, ttl, value)
+
+    async def expire(self, key, ttl):
+        return FakeRedis.expire(self, key, ttl)
+
+    async def delete(self, *keys):
+        return FakeRedis.delete(self, *keys)
+
+    async def ping(self):
+        return True
+
+
 @pytest.fixture(scope="session")
 def broker_module():
     # Import fresh to ensure globals are set per-session
@@ -112,10 +179,51 @@ def app_client(monkeypatch):
 
     monkeypatch.setattr(broker, 'validate_jwt', _ok_jwt)
 
-    # Ensure clean circuit breaker state between tests
+    # Ensure clean circuit breaker state (and rolling windows) between tests
     broker.circuit_breaker_state.clear()
+    monkeypatch.setattr(broker, 'circuit_breaker', None)
+    monkeypatch.setattr(broker, 'bulkhead', None)
+    monkeypatch.setattr(broker, 'idempotency_near_cache', None)
+    monkeypatch.setattr(broker, 'idempotency_invalidator', None)
+    monkeypatch.setattr(broker, 'durable_store', None)
+    monkeypatch.setattr(broker, '_idempotency_marker', {'checked': 0.0, 'complete': False, 'reset': False})
+    monkeypatch.setattr(broker, 'rule_inventory', None)
+    monkeypatch.setattr(broker, 'inventory_refresher', None)
+    monkeypatch.setattr(broker, 'inventory_invalidator', None)
 
     app = broker.app
     app.testing = True
     client = app.test_client()
-    return client, broker, fake
+    yield client, broker, fake
+
+    if broker.inventory_refresher is not None:
+        broker.inventory_refresher.stop()
+
+
+@pytest.fixture()
+def asgi_client(app_client, monkeypatch):
+    # Reuses the Flask fixture's config, JWT stub and circuit breaker reset
+    from starlette.testclient import TestClient
+    import vnf_broker_asgi as asgi
+
+    fake = AsyncFakeRedis()
+    monkeypatch.setattr(asgi, 'redis_client', fake)
+
+    # No context manager: skip lifespan (config files, real Redis, key loading)
+    client = TestClient(asgi.app)
+    return client, asgi, fake
+
+
+@pytest.fixture()
+def jwt_keys(monkeypatch):
+    # Real RS256 key pair; validate_jwt is NOT stubbed here
+    os.makedirs('/var/log/vnf-broker', exist_ok=True)
+    import sys
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+    import vnf_broker_enhanced as broker
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    monkeypatch.setattr(broker, 'JWT_PUBLIC_KEY', private_key.public_key())
+    broker.jwt_cache.clear()
+    return broker, private_key
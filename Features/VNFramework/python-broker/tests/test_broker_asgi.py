@@ -0,0 +1,188 @@
+import time
+
+
+def auth_headers(token='testtoken'):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def _rule(vnf, rule_id, **overrides):
+    rule = {
+        'vnfInstanceId': vnf,
+        'ruleId': rule_id,
+        'action': 'allow',
+        'protocol': 'tcp',
+        'sourceIp': '10.0.0.0/24',
+        'destinationIp': '192.168.1.0/24',
+        'destinationPort': 443,
+        'enabled': True
+    }
+    rule.update(overrides)
+    return rule
+
+
+def test_asgi_health(asgi_client):
+    client, asgi, _ = asgi_client
+    resp = client.get('/health')
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data['mode'] == 'asgi'
+    assert data['redis']['status'] == 'connected'
+
+
+def test_asgi_create_requires_auth(asgi_client):
+    client, asgi, _ = asgi_client
+    resp = client.post('/api/vnf/firewall/create', json=_rule('vnf-a', 'a1'))
+    assert resp.status_code == 401
+    resp = client.post('/api/vnf/firewall/create', json=_rule('vnf-a', 'a1'), headers=auth_headers('bad'))
+    assert resp.status_code == 403
+
+
+def test_asgi_create_validation_and_idempotency(asgi_client):
+    client, asgi, _ = asgi_client
+    bad = client.post('/api/vnf/firewall/create', json=_rule('vnf-a', 'a1', destinationPort=70000),
+                      headers=auth_headers())
+    assert bad.status_code == 400
+    assert bad.json()['error'] == 'Validation error'
+
+    payload = _rule('vnf-a', f'asgi-{time.time()}')
+    r1 = client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers())
+    r2 = client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers())
+    assert r1.status_code == 201
+    assert r2.status_code == 200
+    assert r1.json()['ruleId'] == r2.json()['ruleId']
+
+
+def test_asgi_rate_limit(asgi_client):
+    client, asgi, _ = asgi_client
+    asgi.CONFIG['RATE_LIMIT_REQUESTS'] = 1
+    asgi.CONFIG['RATE_LIMIT_WINDOW'] = 2
+    r1 = client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-rl', headers=auth_headers())
+    r2 = client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-rl', headers=auth_headers())
+    assert r1.status_code == 200
+    assert r2.status_code == 429
+
+
+def test_asgi_batch_and_circuit_breaker(asgi_client):
+    client, asgi, fake = asgi_client
+    asgi.broker.circuit_breaker_state['vnf-open'] = {
+        'state': 'open', 'failures': 5, 'last_failure': time.time()
+    }
+    rules = [_rule('vnf-open', 'o1'), _rule('vnf-b', f'b-{time.time()}'), _rule('vnf-b', 'x', action='nope')]
+    r = client.post('/api/vnf/firewall/batch', json={'rules': rules}, headers=auth_headers())
+    assert r.status_code == 200
+    assert [item['httpStatus'] for item in r.json()['results']] == [503, 201, 400]
+    assert fake.mget_calls == 1
+
+
+def test_asgi_update_delete_list(asgi_client):
+    client, asgi, _ = asgi_client
+    r = client.put('/api/vnf/firewall/update/u1', json=_rule('vnf-u', 'u1'), headers=auth_headers())
+    assert r.json()['status'] == 'updated'
+    r = client.delete('/api/vnf/firewall/delete/d1', headers=auth_headers())
+    assert r.status_code == 400
+    r = client.delete('/api/vnf/firewall/delete/d1?vnfInstanceId=vnf-d', headers=auth_headers())
+    assert r.json()['status'] == 'deleted'
+    r = client.get('/metrics.prom')
+    assert r.status_code == 200
+
+
+def test_asgi_list_streams_ndjson(asgi_client, monkeypatch):
+    client, asgi, _ = asgi_client
+
+    async def fetch(vnf_instance_id, request_id):
+        for i in range(50):
+            yield {'ruleId': f'r{i}', 'protocol': 'udp' if i % 2 else 'tcp', 'destinationPort': 53}
+
+    monkeypatch.setattr(asgi, 'fetch_firewall_rules', fetch)
+    r = client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-s&protocol=udp&format=ndjson', headers=auth_headers())
+    assert r.headers['content-type'].startswith('application/x-ndjson')
+    lines = [line for line in r.text.splitlines() if line]
+    assert len(lines) == 26 and '"_meta"' in lines[-1]
+
+    r = client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-s&limit=10', headers=auth_headers())
+    data = r.json()
+    assert data['count'] == 10 and data['nextCursor']
+
+    # Served from the rule inventory filled by the first list
+    r = client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-s&limit=10',
+                   headers={**auth_headers(), 'If-None-Match': r.headers['etag']})
+    assert r.status_code == 304
+
+
+def test_asgi_vendor_calls_use_shared_async_client(asgi_client, monkeypatch):
+    import json
+    import httpx
+    client, asgi, _ = asgi_client
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append((request.method, str(request.url)))
+        if request.method == 'POST':
+            assert json.loads(request.content)['ruleId'] == 'v1'
+            return httpx.Response(201, json={'id': 7})
+        return httpx.Response(200, json={'data': [{'ruleId': 'v1', 'protocol': 'tcp'}]})
+
+    monkeypatch.setitem(asgi.CONFIG, 'VNF_API_ENDPOINTS', {'vnf-api': 'https://10.0.0.5/api/v1/'})
+    monkeypatch.setitem(asgi.CONFIG, 'VNF_RULES_LIST_PATH', '$.data')
+    monkeypatch.setattr(asgi, 'vendor_client', httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    r = client.post('/api/vnf/firewall/create', json=_rule('vnf-api', 'v1'), headers=auth_headers())
+    assert r.status_code == 201
+    r = client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-api', headers=auth_headers())
+    assert [rule['ruleId'] for rule in r.json()['rules']] == ['v1']
+    assert calls == [('POST', 'https://10.0.0.5/api/v1/firewall/rules'),
+                     ('GET', 'https://10.0.0.5/api/v1/firewall/rules')]
+
+    # An appliance error is a failed VNF call, not a created rule
+    monkeypatch.setattr(asgi, 'vendor_client', httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(500))))
+    r = client.post('/api/vnf/firewall/create', json=_rule('vnf-api', 'v2'), headers=auth_headers())
+    assert r.status_code == 502
+
+
+def test_asgi_blocking_broker_calls_run_off_event_loop(asgi_client, monkeypatch):
+    import asyncio
+    client, asgi, _ = asgi_client
+    broker = asgi.broker
+    threads = {}
+
+    def off_loop(name):
+        try:
+            asyncio.get_running_loop()
+            threads[name] = 'event loop'
+        except RuntimeError:
+            threads[name] = 'worker thread'
+
+    real_validate = broker.validate_jwt
+    monkeypatch.setattr(broker, 'validate_jwt', lambda token: off_loop('validate_jwt') or real_validate(token))
+    monkeypatch.setattr(broker, 'init_idempotency_invalidation', lambda: off_loop('subscribe'))
+    monkeypatch.setattr(broker, '_invalidation_retry_at', 0.0)  # a failed subscription is due for retry
+
+    r = client.post('/api/vnf/firewall/create', json=_rule('vnf-t', f't-{time.time()}'), headers=auth_headers())
+    assert r.status_code == 201
+    deadline = time.time() + 2
+    while 'subscribe' not in threads and time.time() < deadline:
+        time.sleep(0.01)
+    assert threads == {'validate_jwt': 'worker thread', 'subscribe': 'worker thread'}
+
+
+def test_asgi_bulkhead_slot_only_around_vnf_call(asgi_client, monkeypatch):
+    import asyncio
+    client, asgi, _ = asgi_client
+    monkeypatch.setitem(asgi.CONFIG, 'BULKHEAD_PER_VNF', 1)
+    monkeypatch.setitem(asgi.CONFIG, 'BULKHEAD_QUEUE_SIZE', 0)
+    payload = _rule('vnf-busy', f'bh-{time.time()}')
+    assert client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers()).status_code == 201
+
+    # Hold the VNF's only slot, as a running call would
+    bulkhead = asgi.get_bulkhead()
+    held = asyncio.run(bulkhead._acquire('vnf', 'vnf-busy', time.monotonic() + 1))
+    try:
+        assert client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers()).status_code == 200
+        r = client.post('/api/vnf/firewall/create', json=_rule('vnf-busy', 'bh-new'), headers=auth_headers())
+        assert r.status_code == 503 and r.headers['Retry-After'] == '1'
+        r = client.put('/api/vnf/firewall/update/bh-new', json=_rule('vnf-busy', 'bh-new'), headers=auth_headers())
+        assert r.status_code == 503
+    finally:
+        bulkhead._release(held, None)
+    assert asgi.get_bulkhead().get_stats()['compartments'] == {}
@@ -1,5 +1,6 @@
 import json
 import time
+import pytest
 
 
 def auth_headers(token='testtoken'):
@@ -112,6 +113,32 @@ def test_circuit_breaker_open_blocks(app_client):
     assert r.status_code == 503
 
 
+def test_idempotent_replay_does_not_take_half_open_probe(app_client, monkeypatch):
+    client, broker, _ = app_client
+    monkeypatch.setitem(broker.CONFIG, 'CIRCUIT_BREAKER_HALF_OPEN_MAX_CALLS', 1)
+    payload = {
+        'vnfInstanceId': 'vnf-probe',
+        'ruleId': 'r-probe',
+        'action': 'allow',
+        'protocol': 'tcp',
+        'sourceIp': '10.0.0.0/24',
+        'destinationIp': '192.168.1.0/24',
+        'destinationPort': 443,
+        'enabled': True
+    }
+    assert client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers()).status_code == 201
+
+    # Breaker tripped since, and its timeout has passed: the next call is the probe
+    broker.circuit_breaker_state['vnf-probe'] = {
+        'state': 'open', 'failures': 5, 'last_failure': time.time() - 3600
+    }
+    r = client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers())
+    assert r.status_code == 200
+    # The replay was served from the cache and left the probe slot free
+    assert broker.check_circuit_breaker('vnf-probe') is True
+    assert broker.check_circuit_breaker('vnf-probe') is False
+
+
 def test_update_firewall_success(app_client):
     client, broker, _ = app_client
     rid = f'upd-{int(time.time())}'
@@ -167,3 +194,1378 @@ def test_metrics_endpoints(app_client):
     assert rj.status_code == 200
     rp = client.get('/metrics.prom')
     assert rp.status_code == 200
+
+
+def _batch_rule(vnf, rule_id, **overrides):
+    rule = {
+        'vnfInstanceId': vnf,
+        'ruleId': rule_id,
+        'action': 'allow',
+        'protocol': 'tcp',
+        'sourceIp': '10.0.0.0/24',
+        'destinationIp': '192.168.1.0/24',
+        'destinationPort': 443,
+        'enabled': True
+    }
+    rule.update(overrides)
+    return rule
+
+
+def test_batch_create_per_item_results(app_client):
+    client, broker, fake = app_client
+    stamp = int(time.time() * 1000)
+    rules = [
+        _batch_rule('vnf-b1', f'b1-{stamp}'),
+        _batch_rule('vnf-b2', f'b2-{stamp}'),
+        _batch_rule('vnf-b1', f'bad-{stamp}', destinationPort=70000),
+        _batch_rule('vnf-b1', f'b1-{stamp}'),  # duplicate of the first rule
+    ]
+    r = client.post('/api/vnf/firewall/batch', json={'rules': rules}, headers=auth_headers())
+    assert r.status_code == 200
+    d = r.get_json()
+    assert d['success'] is False
+    assert [item['httpStatus'] for item in d['results']] == [201, 201, 400, 201]
+    assert d['results'][2]['error'] == 'Validation error'
+    assert d['results'][3]['ruleId'] == d['results'][0]['ruleId']
+    assert d['summary'] == {'total': 4, 'succeeded': 3, 'failed': 1, 'cached': 0}
+
+    # Replay is served from this worker's near-cache without touching Redis
+    calls_before = fake.mget_calls
+    r2 = client.post('/api/vnf/firewall/batch', json={'rules': rules[:2]}, headers=auth_headers())
+    d2 = r2.get_json()
+    assert fake.mget_calls == calls_before
+    assert [item['httpStatus'] for item in d2['results']] == [200, 200]
+    assert d2['summary']['cached'] == 2
+
+    # ...and by another worker from the idempotency cache with one MGET
+    broker.get_idempotency_near_cache().clear()
+    r3 = client.post('/api/vnf/firewall/batch', json={'rules': rules[:2]}, headers=auth_headers())
+    assert fake.mget_calls == calls_before + 1
+    assert r3.get_json()['summary']['cached'] == 2
+
+
+def test_batch_create_circuit_open(app_client):
+    client, broker, _ = app_client
+    broker.circuit_breaker_state['vnf-bcb'] = {
+        'state': 'open', 'failures': 5, 'last_failure': time.time()
+    }
+    rules = [_batch_rule('vnf-bcb', 'bcb-1'), _batch_rule('vnf-bok', f'bok-{time.time()}')]
+    r = client.post('/api/vnf/firewall/batch', json={'rules': rules}, headers=auth_headers())
+    d = r.get_json()
+    assert [item['httpStatus'] for item in d['results']] == [503, 201]
+
+
+def test_batch_requires_rules(app_client):
+    client, broker, _ = app_client
+    r = client.post('/api/vnf/firewall/batch', json={'rules': []}, headers=auth_headers())
+    assert r.status_code == 400
+
+
+def test_validate_jwt_caches_verified_claims(jwt_keys, monkeypatch):
+    import jwt
+    broker, private_key = jwt_keys
+    token = jwt.encode({'sub': 'cloudstack', 'exp': int(time.time()) + 600}, private_key, algorithm='RS256')
+
+    assert broker.validate_jwt(token)['sub'] == 'cloudstack'
+
+    # Second call must not re-verify the signature
+    def _no_decode(*args, **kwargs):
+        raise AssertionError("signature verified twice")
+    monkeypatch.setattr(broker.jwt, 'decode', _no_decode)
+    assert broker.validate_jwt(token)['sub'] == 'cloudstack'
+    assert broker.jwt_cache.get_stats()['hits'] == 1
+
+
+def test_jwt_cache_bounded_by_exp_and_invalidated_on_rotation(jwt_keys, monkeypatch):
+    import jwt
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    broker, private_key = jwt_keys
+    token = jwt.encode({'sub': 'cloudstack', 'exp': int(time.time()) + 600}, private_key, algorithm='RS256')
+    assert broker.validate_jwt(token) is not None
+
+    # Cached entry is not served past the token's exp
+    cache = broker.VerifiedTokenCache()
+    cache.put('short', {'sub': 'x', 'exp': time.time() + 0.05})
+    assert cache.get('short') is not None
+    time.sleep(0.06)
+    assert cache.get('short') is None
+
+    # Rotating the public key drops cached verifications
+    rotated = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    monkeypatch.setattr(broker, 'JWT_PUBLIC_KEY', rotated.public_key())
+    assert broker.validate_jwt(token) is None
+    assert len(broker.jwt_cache) == 0
+
+
+def test_rate_limit_headers(app_client):
+    client, broker, _ = app_client
+    broker.CONFIG['RATE_LIMIT_REQUESTS'] = 2
+    broker.CONFIG['RATE_LIMIT_WINDOW'] = 60
+
+    r1 = client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-h', headers=auth_headers())
+    assert r1.headers['X-RateLimit-Limit'] == '2'
+    assert r1.headers['X-RateLimit-Remaining'] == '1'
+    client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-h', headers=auth_headers())
+    r3 = client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-h', headers=auth_headers())
+    assert r3.status_code == 429
+    assert r3.headers['X-RateLimit-Remaining'] == '0'
+    assert 0 < int(r3.headers['Retry-After']) <= 60
+
+
+@pytest.mark.parametrize('algorithm', ['sliding_log', 'gcra', 'sliding_window'])
+def test_rate_limiter_algorithms(algorithm):
+    import fakeredis
+    from rate_limiter import RateLimiter
+
+    server = fakeredis.FakeRedis(decode_responses=True)
+    limiter = RateLimiter(server, algorithm=algorithm, limit=3, window=10)
+    now = 1000.0
+
+    # Same timestamp for every call: members must not collide
+    results = [limiter.check('client-a', now=now) for _ in range(4)]
+    assert [r.allowed for r in results] == [True, True, True, False]
+    assert [r.remaining for r in results[:3]] == [2, 1, 0]
+    assert 0 < results[3].retry_after <= 10
+    assert limiter.check('client-b', now=now).allowed
+
+    # Quota comes back once the window has passed
+    assert limiter.check('client-a', now=now + 20.1).allowed
+    # gcra / sliding_window keep O(1) keys per client
+    if algorithm != 'sliding_log':
+        assert len(server.keys('rate_limit:*client-a*')) <= 2
+
+
+def test_rate_limiter_rejects_unknown_algorithm():
+    import fakeredis
+    from rate_limiter import RateLimiter
+
+    with pytest.raises(ValueError):
+        RateLimiter(fakeredis.FakeRedis(), algorithm='leaky')
+
+
+@pytest.mark.parametrize('algorithm', ['sliding_log', 'gcra', 'sliding_window'])
+def test_leased_rate_limiter_local_tier(algorithm):
+    import fakeredis
+    from rate_limiter import RateLimiter, LeasedRateLimiter
+
+    server = fakeredis.FakeRedis(decode_responses=True)
+    remote = RateLimiter(server, algorithm=algorithm)
+    leased = LeasedRateLimiter(remote, lease_fraction=0.1, max_lease=50, lease_ttl=5)
+    now = 1000.0
+
+    results = [leased.check('client-a', limit=100, window=60, now=now) for _ in range(30)]
+    assert all(r.allowed for r in results)
+    # One Redis call per lease of 10 tokens
+    assert leased.stats['redis'] == 3
+    assert leased.stats['local'] == 27
+    assert [r.remaining for r in results[:3]] == [99, 98, 97]
+
+    # A second worker sees the leased tokens as consumed; the global limit holds
+    other = LeasedRateLimiter(RateLimiter(server, algorithm=algorithm), lease_ttl=5)
+    admitted = sum(other.check('client-a', limit=100, window=60, now=now).allowed for _ in range(100))
+    assert admitted == 70
+
+    # Denials are cached locally instead of hitting Redis per request
+    calls = other.stats['redis']
+    assert not other.check('client-a', limit=100, window=60, now=now).allowed
+    assert other.stats['redis'] == calls
+
+
+def test_leased_rate_limiter_refunds_unused_tokens():
+    import fakeredis
+    from rate_limiter import RateLimiter, LeasedRateLimiter
+
+    server = fakeredis.FakeRedis(decode_responses=True)
+    leased = LeasedRateLimiter(RateLimiter(server, algorithm='sliding_log'), lease_ttl=1)
+    now = 1000.0
+
+    assert leased.check('client-a', limit=100, window=60, now=now).allowed
+    assert server.zcard('rate_limit:{client-a}') == 10
+
+    # Lease expires: 9 unused tokens go back to Redis
+    assert leased.reconcile(now=now + 2) == 9
+    assert server.zcard('rate_limit:{client-a}') == 1
+    assert leased.get_stats()['leases'] == 0
+
+
+def test_redis_circuit_breaker_shared_across_workers():
+    import fakeredis
+    from circuit_breaker import RedisCircuitBreakerBackend, CircuitBreakerPolicy
+
+    server = fakeredis.FakeServer()
+    changes = []
+    worker_a = RedisCircuitBreakerBackend(
+        fakeredis.FakeRedis(server=server, decode_responses=True),
+        policy=CircuitBreakerPolicy(failure_threshold=3, half_open_max_calls=1)
+    )
+    worker_b = RedisCircuitBreakerBackend(
+        fakeredis.FakeRedis(server=server, decode_responses=True),
+        policy=CircuitBreakerPolicy(failure_threshold=3, half_open_max_calls=1),
+        on_change=lambda vnf, state: changes.append((vnf, state))
+    )
+    try:
+        # Worker B has seen the VNF healthy and serves it from its local cache
+        assert worker_b.allow('vnf-shared').allowed
+
+        statuses = [worker_a.record_failure('vnf-shared') for _ in range(3)]
+        assert [s.state for s in statuses] == ['closed', 'closed', 'open']
+        assert statuses[-1].changed
+
+        # Pub/sub notification reaches worker B without waiting for its cache TTL
+        deadline = time.time() + 2
+        while worker_b.allow('vnf-shared').allowed and time.time() < deadline:
+            time.sleep(0.005)
+        assert not worker_b.allow('vnf-shared').allowed
+        assert ('vnf-shared', 'open') in changes
+
+        # Success from half-open closes the breaker everywhere
+        worker_a.policy.timeout = 0
+        assert worker_a.allow('vnf-shared').state == 'half_open'
+        assert worker_a.record_success('vnf-shared').changed
+        deadline = time.time() + 2
+        while not worker_b.allow('vnf-shared').allowed and time.time() < deadline:
+            time.sleep(0.005)
+        snapshot = worker_b.snapshot()['vnf-shared']
+        assert (snapshot['state'], snapshot['failures']) == ('closed', 0)
+    finally:
+        worker_a.close()
+        worker_b.close()
+
+
+def test_circuit_breaker_backend_selection(app_client, monkeypatch):
+    client, broker, _ = app_client
+    import fakeredis
+
+    monkeypatch.setitem(broker.CONFIG, 'CIRCUIT_BREAKER_BACKEND', 'redis')
+    monkeypatch.setattr(broker, 'redis_client', fakeredis.FakeRedis(decode_responses=True))
+    try:
+        for _ in range(broker.CONFIG['CIRCUIT_BREAKER_THRESHOLD']):
+            broker.record_circuit_breaker_failure('vnf-r')
+        assert broker.check_circuit_breaker('vnf-r') is False
+        assert broker.redis_client.hget('circuit_breaker:{vnf-r}', 'state') == 'open'
+        # Process-local dict is untouched by the shared backend
+        assert 'vnf-r' not in broker.circuit_breaker_state
+
+        data = client.get('/metrics').get_json()
+        assert data['circuit_breakers']['vnf-r']['state'] == 'open'
+    finally:
+        broker.circuit_breaker.close()
+        broker.circuit_breaker = None
+
+
+def test_circuit_breaker_failure_rate_and_half_open_probes(monkeypatch):
+    from circuit_breaker import MemoryCircuitBreakerBackend, CircuitBreakerPolicy
+
+    cb = MemoryCircuitBreakerBackend(policy=CircuitBreakerPolicy(
+        failure_threshold=100, minimum_calls=4, failure_rate_threshold=0.5, half_open_max_calls=2
+    ))
+    assert cb.allow('vnf-r').allowed
+    cb.record_success('vnf-r')
+    cb.record_failure('vnf-r')
+    cb.record_success('vnf-r')
+    status = cb.record_failure('vnf-r')
+    # Never 100 consecutive failures, but half of the window failed
+    assert (status.state, status.reason) == ('open', 'failure_rate')
+    assert not cb.allow('vnf-r').allowed
+
+    # Half-open admits only half_open_max_calls probes
+    cb.state['vnf-r']['last_failure'] = time.time() - 60
+    assert [cb.allow('vnf-r').allowed for _ in range(3)] == [True, True, False]
+    assert cb.record_success('vnf-r').state == 'half_open'
+    assert cb.record_success('vnf-r').state == 'closed'
+    assert cb.snapshot()['vnf-r']['calls'] == 0
+
+
+@pytest.mark.parametrize('backend', ['memory', 'redis'])
+def test_half_open_reprobe_resets_probe_successes(backend):
+    import fakeredis
+    from circuit_breaker import MemoryCircuitBreakerBackend, RedisCircuitBreakerBackend, CircuitBreakerPolicy
+
+    policy = CircuitBreakerPolicy(failure_threshold=1, half_open_max_calls=2, timeout=30)
+    if backend == 'memory':
+        cb = MemoryCircuitBreakerBackend(policy=policy)
+    else:
+        cb = RedisCircuitBreakerBackend(fakeredis.FakeRedis(decode_responses=True), policy=policy)
+    try:
+        cb.record_failure('vnf-p')
+        policy.timeout = 0
+        assert cb.allow('vnf-p').state == 'half_open'
+        assert cb.allow('vnf-p').allowed
+        # One probe reports back, the other never does
+        assert cb.record_success('vnf-p').state == 'half_open'
+
+        # The half-open timeout re-issues probes: the stale success does not count towards them
+        time.sleep(0.01)
+        assert cb.allow('vnf-p').allowed
+        assert cb.record_success('vnf-p').state == 'half_open'
+        assert cb.record_success('vnf-p').state == 'closed'
+    finally:
+        if backend == 'redis':
+            cb.close()
+
+
+def test_circuit_breaker_opens_on_slow_calls(app_client, monkeypatch):
+    client, broker, _ = app_client
+    monkeypatch.setitem(broker.CONFIG, 'CIRCUIT_BREAKER_MIN_CALLS', 5)
+    monkeypatch.setitem(broker.CONFIG, 'CIRCUIT_BREAKER_SLOW_CALL_SECONDS', 10)
+
+    for _ in range(5):
+        assert broker.check_circuit_breaker('vnf-slow')
+        # 29s responses are successes, but they should still trip the breaker
+        broker.record_circuit_breaker_success('vnf-slow', duration=29)
+    assert broker.check_circuit_breaker('vnf-slow') is False
+
+    stats = client.get('/metrics').get_json()['circuit_breakers']['vnf-slow']
+    assert stats['state'] == 'open'
+    assert stats['slow_call_rate'] == 1.0
+    assert sum(bucket['slow'] for bucket in stats['buckets']) == 5
+
+
+def test_asgi_redis_circuit_breaker_runs_off_event_loop(asgi_client, monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+    _, asgi, _ = asgi_client
+    broker = asgi.broker
+
+    class SlowBreaker:
+        """Stands in for a Redis backend whose EVALSHA takes 100ms"""
+        policy = broker.circuit_breaker_policy()
+
+        def __init__(self):
+            self.durations = []
+
+        def allow(self, vnf_instance_id):
+            time.sleep(0.1)
+            return SimpleNamespace(allowed=True, changed=False, state='closed')
+
+        def record_success(self, vnf_instance_id, duration=None):
+            time.sleep(0.1)
+            self.durations.append(duration)
+            return SimpleNamespace(changed=False, state='closed')
+
+    slow = SlowBreaker()
+    monkeypatch.setitem(broker.CONFIG, 'CIRCUIT_BREAKER_BACKEND', 'redis')
+    monkeypatch.setattr(broker, 'get_circuit_breaker', lambda: slow)
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        assert await asgi.check_circuit_breaker('vnf-x')
+        await asgi.record_circuit_breaker_success('vnf-x')
+        task.cancel()
+        return ticks
+
+    # ~200ms spent in the breaker; the loop kept ticking meanwhile
+    assert asyncio.run(scenario()) >= 5
+    # The call timer started in the caller's context, not the worker thread's
+    assert slow.durations[0] is not None
+
+
+def test_rolling_window_expires_old_buckets():
+    from circuit_breaker import RollingWindow
+
+    window = RollingWindow(window=60, buckets=6)
+    window.record(failed=True, slow=False, now=1000)
+    window.record(failed=False, slow=True, now=1035)
+    assert window.totals(now=1040) == {'calls': 2, 'failures': 1, 'slow': 1}
+    # The first bucket ([1000, 1010)) falls out after 60s
+    assert window.totals(now=1061) == {'calls': 1, 'failures': 0, 'slow': 1}
+    assert len(window.snapshot(now=1061)) == 1
+
+
+def test_bulkhead_queues_fifo_and_rejects_when_full():
+    import threading
+    from bulkhead import Bulkhead, BulkheadRejected
+
+    bulkhead = Bulkhead({'vnf': 1}, max_queue=1, max_wait=5)
+    order = []
+    release = threading.Event()
+
+    def holder():
+        with bulkhead.slot(vnf='vnf-1'):
+            release.wait(5)
+            order.append('holder')
+
+    def waiter():
+        with bulkhead.slot(vnf='vnf-1'):
+            order.append('waiter')
+
+    threads = [threading.Thread(target=holder), threading.Thread(target=waiter)]
+    threads[0].start()
+    while bulkhead.get_stats()['compartments'].get('vnf', {}).get('vnf-1', {}).get('active') != 1:
+        time.sleep(0.01)
+    threads[1].start()
+    while bulkhead.get_stats()['compartments']['vnf']['vnf-1']['queued'] != 1:
+        time.sleep(0.01)
+
+    # Queue holds one caller; the next is turned away immediately
+    with pytest.raises(BulkheadRejected) as exc:
+        with bulkhead.slot(vnf='vnf-1'):
+            pass
+    assert exc.value.reason == 'queue_full'
+    # Other VNFs are unaffected
+    with bulkhead.slot(vnf='vnf-2'):
+        pass
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == ['holder', 'waiter']
+    assert bulkhead.get_stats()['compartments'] == {}
+
+
+def test_bulkhead_deadline_aware_rejection():
+    from bulkhead import Bulkhead, BulkheadRejected
+
+    waits = []
+    rejects = []
+    bulkhead = Bulkhead({'vnf': 1, 'subject': 2}, max_queue=10,
+                        on_admit=lambda kind, depth, waited: waits.append((kind, depth)),
+                        on_reject=lambda kind, reason: rejects.append((kind, reason)))
+    with bulkhead.slot(vnf='vnf-1', subject='tenant-a'):
+        time.sleep(0.05)
+    # The appliance is busy and each call holds it ~50ms: a caller with 10ms left is rejected up front
+    with bulkhead.slot(vnf='vnf-1', subject='tenant-a'):
+        with pytest.raises(BulkheadRejected) as exc:
+            with bulkhead.slot(vnf='vnf-1', subject='tenant-b', deadline=time.monotonic() + 0.01):
+                pass
+        assert exc.value.reason == 'deadline'
+        # A caller whose deadline looks feasible queues, then gives up when it passes
+        with pytest.raises(BulkheadRejected) as exc:
+            with bulkhead.slot(vnf='vnf-1', subject='tenant-b', deadline=time.monotonic() + 0.2):
+                pass
+        assert exc.value.reason == 'timeout'
+
+    assert ('subject', 0) in waits and ('vnf', 0) in waits
+    assert rejects[0] == ('vnf', 'deadline')
+    # Rejected callers released their subject slot
+    assert bulkhead.get_stats()['compartments'] == {}
+
+
+def test_bulkhead_limits_endpoint(app_client, monkeypatch):
+    client, broker, _ = app_client
+    monkeypatch.setitem(broker.CONFIG, 'BULKHEAD_PER_VNF', 1)
+    monkeypatch.setitem(broker.CONFIG, 'BULKHEAD_QUEUE_SIZE', 0)
+
+    with broker.get_bulkhead().slot(vnf='vnf-busy'):
+        r = client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-busy', headers=auth_headers())
+        assert r.status_code == 503
+        assert r.headers['Retry-After'] == '1'
+        assert 'concurrent request limit' in r.get_json()['message']
+        r = client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-idle', headers=auth_headers())
+        assert r.status_code == 200
+
+    r = client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-busy', headers=auth_headers())
+    assert r.status_code == 200
+    assert client.get('/metrics').get_json()['bulkhead']['rejected'] == 1
+
+
+def test_bulkhead_slot_only_around_vnf_call(app_client, monkeypatch):
+    client, broker, _ = app_client
+    monkeypatch.setitem(broker.CONFIG, 'BULKHEAD_PER_VNF', 1)
+    monkeypatch.setitem(broker.CONFIG, 'BULKHEAD_QUEUE_SIZE', 0)
+    payload = {
+        'vnfInstanceId': 'vnf-busy',
+        'ruleId': f'bh-{time.time()}',
+        'action': 'allow',
+        'protocol': 'tcp',
+        'sourceIp': '10.0.0.0/24',
+        'destinationIp': '192.168.1.0/24',
+        'destinationPort': 443,
+        'enabled': True
+    }
+    assert client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers()).status_code == 201
+    client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-busy', headers=auth_headers())
+
+    with broker.get_bulkhead().slot(vnf='vnf-busy'):
+        # Idempotency and rule-inventory hits never reach the appliance: no slot needed
+        assert client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers()).status_code == 200
+        r = client.get('/api/vnf/firewall/list?vnfInstanceId=vnf-busy', headers=auth_headers())
+        assert r.status_code == 200
+        # A new rule does
+        r = client.post('/api/vnf/firewall/create', json=dict(payload, ruleId='bh-new'), headers=auth_headers())
+        assert r.status_code == 503 and r.headers['Retry-After'] == '1'
+        r = client.delete('/api/vnf/firewall/delete/bh-new?vnfInstanceId=vnf-busy', headers=auth_headers())
+        assert r.status_code == 503
+    assert broker.get_bulkhead().get_stats()['compartments'] == {}
+
+
+def test_async_bulkhead_hands_slot_to_waiter():
+    import asyncio
+    from bulkhead import AsyncBulkhead, BulkheadRejected
+
+    async def scenario():
+        bulkhead = AsyncBulkhead({'subject': 1}, max_queue=5, max_wait=1)
+        order = []
+
+        async def call(name, hold):
+            async with bulkhead.slot(subject='tenant-a'):
+                order.append(name)
+                await asyncio.sleep(hold)
+
+        await asyncio.gather(call('first', 0.02), call('second', 0), call('third', 0))
+        assert order == ['first', 'second', 'third']
+
+        async with bulkhead.slot(subject='tenant-a'):
+            with pytest.raises(BulkheadRejected) as exc:
+                async with bulkhead.slot(subject='tenant-a', deadline=time.monotonic() + 0.05):
+                    pass
+        assert exc.value.reason == 'timeout'
+        return bulkhead.get_stats()
+
+    stats = asyncio.run(scenario())
+    assert stats['compartments'] == {}
+    assert stats['queued'] == 2
+
+
+def test_single_flight_shares_in_process_result():
+    import threading
+    from conftest import FakeRedis
+    from single_flight import SingleFlight
+
+    group = SingleFlight(FakeRedis())
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'done'
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(group.do('k', slow, lambda: None)))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=lambda: results.append(group.do('k', slow, lambda: None)))
+    second.start()
+    while group.stats['shared_local'] == 0:
+        time.sleep(0.01)
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: r[1]) == [('done', False), ('done', True)]
+    assert group.get_stats()['in_flight'] == 0
+    # The lease was released, so a later call executes again
+    assert group.do('k', lambda: 'again', lambda: None) == ('again', True)
+
+
+def test_single_flight_waits_for_other_worker():
+    import threading
+    from conftest import FakeRedis
+    from single_flight import SingleFlight
+
+    fake = FakeRedis()
+    worker_a = SingleFlight(fake, poll_interval=0.01)
+    worker_b = SingleFlight(fake, poll_interval=0.01)
+    stored = {}
+
+    # Worker A is mid-call: B polls the result cache instead of executing
+    fake.set('singleflight:k', 'worker-a', nx=True, px=5000)
+    threading.Timer(0.05, lambda: stored.update(k='from-a')).start()
+    assert worker_b.do('k', lambda: 'from-b', lambda: stored.get('k')) == ('from-a', False)
+
+    # A failed and released its lease without a result: B takes over
+    fake.set('singleflight:k2', 'worker-a', nx=True, px=5000)
+    threading.Timer(0.05, lambda: fake.lua.delete('singleflight:k2')).start()
+    assert worker_b.do('k2', lambda: 'from-b', lambda: None) == ('from-b', True)
+    assert worker_b.stats['shared_remote'] == 1
+    assert worker_a.get_stats()['executed'] == 0
+
+
+def test_concurrent_duplicate_creates_execute_once(app_client, monkeypatch):
+    import threading
+    client, broker, _ = app_client
+    release = threading.Event()
+    calls = []
+    original = broker.apply_firewall_rule
+
+    def slow_apply(req_data, request_id):
+        calls.append(req_data.ruleId)
+        release.wait(5)
+        return original(req_data, request_id)
+
+    monkeypatch.setattr(broker, 'apply_firewall_rule', slow_apply)
+    payload = {
+        'vnfInstanceId': 'vnf-sf', 'ruleId': f'sf-{time.time()}', 'action': 'allow', 'protocol': 'tcp',
+        'sourceIp': '10.0.0.0/24', 'destinationIp': '192.168.1.0/24', 'destinationPort': 443, 'enabled': True
+    }
+    statuses = []
+
+    def post():
+        resp = broker.app.test_client().post('/api/vnf/firewall/create', json=payload, headers=auth_headers())
+        statuses.append((resp.status_code, resp.get_json()['ruleId']))
+
+    threads = [threading.Thread(target=post) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while len(calls) < 1 or broker.get_single_flight().stats['shared_local'] < 1:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [payload['ruleId']]
+    assert sorted(status for status, _ in statuses) == [200, 201]
+
+
+@pytest.mark.parametrize('serializer', ['json', 'msgpack', 'cbor'])
+def test_cache_codec_roundtrip_and_legacy_entries(serializer):
+    from cache_codec import CacheCodec, MAGIC
+
+    codec = CacheCodec(serializer=serializer, compression='zstd', compress_min_size=64)
+    doc = {'success': True, 'ruleId': 'r-1', 'vnfInstanceId': 'vnf-1', 'status': 'created',
+           'message': 'Operation completed successfully ' * 8, 'count': 3}
+    data = codec.encode(doc)
+    assert isinstance(data, bytes) and data[0] == MAGIC
+    assert codec.decode(data) == doc
+    # Entries written before the codec existed (str or bytes JSON) still decode
+    assert codec.decode(json.dumps(doc)) == doc
+    assert codec.decode(json.dumps(doc).encode()) == doc
+
+    stats = codec.get_stats()
+    assert stats['legacy_decoded'] == 2 and stats['decoded'] == 1
+    assert stats['bytes_saved'] > 0 and stats['stored_bytes'] == len(data)
+
+
+def test_cache_codec_shared_dictionary_and_errors():
+    from cache_codec import CacheCodec, CodecError, train_zstd_dictionary
+
+    samples = [{'success': True, 'ruleId': f'rule-{i}', 'vnfInstanceId': f'vnf-{i % 7}',
+                'status': 'created', 'timestamp': f'2025-11-05T10:{i % 60:02d}:00', 'request_id': f'{i:08x}'}
+               for i in range(500)]
+    dictionary = train_zstd_dictionary(samples, size=2048)
+    with_dict = CacheCodec(zstd_dictionary=dictionary, compress_min_size=0)
+    plain = CacheCodec(compress_min_size=0)
+
+    data = with_dict.encode(samples[3])
+    assert len(data) < len(plain.encode(samples[3]))
+    assert with_dict.decode(data) == samples[3]
+    # A broker without the dictionary reports the entry as unreadable instead of crashing
+    with pytest.raises(CodecError):
+        plain.decode(data)
+    with pytest.raises(CodecError):
+        plain.decode(b'\xc1\x09\x01\x00')
+    assert plain.get_stats()['decode_errors'] == 2
+
+    # json + no compression is byte-for-byte the legacy format
+    legacy = CacheCodec(serializer='json', compression=None)
+    assert legacy.encode({'a': 1}) == json.dumps({'a': 1})
+
+
+def test_idempotency_entries_are_encoded(app_client, monkeypatch):
+    client, broker, fake = app_client
+    monkeypatch.setitem(broker.CONFIG, 'IDEMPOTENCY_CODEC', 'msgpack')
+    monkeypatch.setitem(broker.CONFIG, 'IDEMPOTENCY_COMPRESSION', 'zstd')
+    monkeypatch.setitem(broker.CONFIG, 'IDEMPOTENCY_NEAR_CACHE', False)  # read every entry from Redis
+    params = {'ruleId': 'enc-1'}
+
+    # An entry stored by an older broker is still a cache hit
+    legacy_key = broker.compute_idempotency_key('firewall.create', {'ruleId': 'old'})
+    fake.kv[legacy_key] = json.dumps({'ruleId': 'old', 'status': 'created'})
+    assert broker.check_idempotency('firewall.create', {'ruleId': 'old'})['ruleId'] == 'old'
+
+    broker.store_idempotency('firewall.create', params, {'ruleId': 'enc-1', 'status': 'created'})
+    stored = fake.kv[broker.compute_idempotency_key('firewall.create', params)]
+    assert isinstance(stored, bytes) and stored[0] == 0xC1
+    assert broker.check_idempotency('firewall.create', params) == {'ruleId': 'enc-1', 'status': 'created'}
+
+    # Corrupt entries read as a miss
+    fake.kv[legacy_key] = b'\xc1\x01\x01\x00\xff\xff'
+    assert broker.check_idempotency('firewall.create', {'ruleId': 'old'}) is None
+    assert client.get('/metrics').get_json()['idempotency_codec']['serializer'] == 'msgpack'
+
+
+def test_near_cache_lru_ttl_and_copies(monkeypatch):
+    from near_cache import NearCache
+    cache = NearCache(max_entries=2, max_ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr('near_cache.time.monotonic', lambda: now[0])
+
+    cache.put('a', {'rules': [1]})
+    cache.put('b', {'rules': [2]}, ttl=5)
+    assert cache.get('a') == {'rules': [1]}  # 'a' is now most recently used
+    cache.put('c', {'rules': [3]})
+    assert cache.get('b') is None and cache.stats['evictions'] == 1
+
+    # Callers get copies, never the cached object
+    cache.get('a')['rules'].append(99)
+    assert cache.get('a') == {'rules': [1]}
+
+    # Entries live until the earlier of their Redis TTL and max_ttl
+    assert cache.invalidate('a')
+    cache.put('short', {'x': 1}, ttl=5)
+    now[0] += 6
+    assert cache.get('short') is None
+    assert cache.get('c') == {'rules': [3]}
+    now[0] += 60
+    assert cache.get('c') is None
+
+
+def test_keyspace_invalidator_drops_deleted_keys(monkeypatch):
+    from near_cache import NearCache, KeyspaceInvalidator
+    cache = NearCache()
+    invalidator = KeyspaceInvalidator(None, cache, 'idempotency:', subscribe=False)
+    cache.put('idempotency:firewall.create:abc', {'ruleId': 'r1'})
+    cache.put('idempotency:firewall.create:def', {'ruleId': 'r2'})
+
+    # Writes by other replicas carry the same result for the same key
+    invalidator._handle_message({'channel': '__keyspace@0__:idempotency:firewall.create:abc', 'data': 'set'})
+    assert cache.get('idempotency:firewall.create:abc') is not None
+
+    invalidator._handle_message({'channel': b'__keyspace@0__:idempotency:firewall.create:abc', 'data': b'del'})
+    invalidator._handle_message({'channel': '__keyspace@0__:idempotency:firewall.create:def', 'data': 'expired'})
+    assert len(cache) == 0
+    assert invalidator.get_stats()['invalidated'] == 2
+
+    # A dropped subscription may have missed events: start over
+    cache.put('idempotency:firewall.create:abc', {'ruleId': 'r1'})
+    monkeypatch.setattr('near_cache.time.sleep', lambda seconds: None)
+    invalidator._handle_error(ConnectionError('lost'), None, None)
+    assert len(cache) == 0 and invalidator.stats['resets'] == 1
+
+
+def test_idempotency_hit_served_from_near_cache(app_client):
+    client, broker, fake = app_client
+    payload = {
+        'vnfInstanceId': 'vnf-near',
+        'ruleId': f'near-{int(time.time() * 1000)}',
+        'action': 'allow',
+        'protocol': 'tcp',
+        'sourceIp': '10.0.0.0/24',
+        'destinationIp': '192.168.1.0/24',
+        'destinationPort': 443
+    }
+    r1 = client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers())
+    assert r1.status_code == 201
+
+    # The retry never reaches Redis
+    fake.get = lambda key: pytest.fail('near-cache hit should not GET from Redis')
+    r2 = client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers())
+    assert r2.status_code == 200
+    assert r2.get_json() == r1.get_json()
+
+    stats = client.get('/metrics').get_json()['idempotency_near_cache']
+    assert stats['hits'] >= 1 and stats['size'] >= 1
+
+
+def test_redis_topology_clients_connect_lazily():
+    import redis
+    from redis.sentinel import SentinelConnectionPool
+    from redis_topology import create_redis_client, LazyRedisCluster
+    config = {'REDIS_HOST': '127.0.0.1', 'REDIS_PORT': 1, 'REDIS_DB': 0, 'REDIS_MAX_CONNECTIONS': 2}
+
+    # Nothing is contacted while clients and scripts are created
+    sentinel = create_redis_client({**config, 'REDIS_MODE': 'sentinel', 'REDIS_SENTINELS': [['127.0.0.1', 1]]})
+    assert isinstance(sentinel.connection_pool, SentinelConnectionPool)
+    cluster = create_redis_client({**config, 'REDIS_MODE': 'cluster'})
+    assert isinstance(cluster, LazyRedisCluster)
+    cluster.register_script("return 1")
+
+    # An unreachable topology surfaces as an ordinary Redis error
+    for client in (create_redis_client({**config, 'REDIS_MODE': 'standalone'}), cluster):
+        with pytest.raises(redis.ConnectionError):
+            client.ping()
+    with pytest.raises(ValueError):
+        create_redis_client({**config, 'REDIS_MODE': 'replicated'})
+
+
+def test_keys_used_together_share_a_cluster_slot(app_client):
+    from redis.crc import key_slot
+    from rate_limiter import RateLimiter
+    client, broker, fake = app_client
+
+    key = broker.compute_idempotency_key('firewall.create', {'ruleId': 'slot-1'})
+    lease = f"{broker.get_single_flight().key_prefix}{key}"
+    assert key_slot(key.encode()) == key_slot(lease.encode())
+
+    limiter = RateLimiter(fake, algorithm='sliding_window')
+    keys, _ = limiter._invocation('client-a', 1, 10, 60, time.time())
+    assert len({key_slot(k.encode()) for k in keys}) == 1
+
+
+def test_init_redis_survives_unreachable_redis(app_client, monkeypatch):
+    client, broker, fake = app_client
+    monkeypatch.setattr(broker, 'redis_binary_client', None)
+    monkeypatch.setattr(broker, 'redis_pool', None)
+    monkeypatch.setitem(broker.CONFIG, 'REDIS_HOST', '127.0.0.1')
+    monkeypatch.setitem(broker.CONFIG, 'REDIS_PORT', 1)
+
+    broker.init_redis()  # logs the outage instead of exiting
+
+    assert broker.check_idempotency('firewall.create', {'ruleId': 'down'}) is None
+    assert client.get('/health').get_json()['redis']['status'].startswith('error')
+
+
+def _ssh_server(accepted):
+    """Minimal paramiko SSH server on localhost: runs 'echo', sleeps on 'sleep' (password admin/secret)"""
+    import socket
+    import threading
+    import paramiko
+
+    host_key = paramiko.RSAKey.generate(1024)
+
+    class Server(paramiko.ServerInterface):
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_auth_password(self, username, password):
+            ok = (username, password) == ('admin', 'secret')
+            return paramiko.AUTH_SUCCESSFUL if ok else paramiko.AUTH_FAILED
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+        def check_channel_exec_request(self, channel, command):
+            def run():
+                # Reply only after paramiko has acknowledged the exec request
+                time.sleep(0.02)
+                if command.startswith(b'sleep'):
+                    time.sleep(float(command.split()[1]))
+                channel.sendall(command.partition(b' ')[2] * 20000)
+                channel.sendall_stderr(b'warn')
+                channel.send_exit_status(3 if command.startswith(b'fail') else 0)
+                channel.close()
+            threading.Thread(target=run, daemon=True).start()
+            return True
+
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+
+    def serve():
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(host_key)
+            transport.start_server(server=Server())
+            accepted.append(transport)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener
+
+
+def test_ssh_pool_reuses_connections_and_caps_channels():
+    import threading
+    from ssh_pool import SSHSessionPool, SSHPoolExhausted
+
+    accepted = []
+    listener = _ssh_server(accepted)
+    port = listener.getsockname()[1]
+    pool = SSHSessionPool(max_channels=2, acquire_timeout=0.2, connect_timeout=5, keepalive=0)
+    try:
+        # Large stdout plus stderr drains without stalling; connection reused
+        exit_code, stdout, stderr = pool.execute('127.0.0.1', port, 'admin', 'secret', 'echo ab', timeout=10)
+        assert (exit_code, len(stdout), stderr) == (0, 40000, 'warn')
+        assert pool.execute('127.0.0.1', port, 'admin', 'secret', 'fail x')[0] == 3
+        assert len(accepted) == 1 and pool.stats['reuses'] == 1
+
+        # Third concurrent command waits for a channel, then gives up
+        sleepers = [threading.Thread(target=pool.execute, args=('127.0.0.1', port, 'admin', 'secret', 'sleep 0.5'))
+                    for _ in range(2)]
+        for thread in sleepers:
+            thread.start()
+        time.sleep(0.1)
+        with pytest.raises(SSHPoolExhausted):
+            pool.execute('127.0.0.1', port, 'admin', 'secret', 'echo c')
+        for thread in sleepers:
+            thread.join()
+        assert pool.get_stats()['active_channels'] == 0 and len(accepted) == 1
+
+        # A connection the appliance dropped is replaced transparently
+        accepted[0].close()
+        time.sleep(0.1)
+        assert pool.execute('127.0.0.1', port, 'admin', 'secret', 'echo d')[1] == 'd' * 20000
+        assert len(accepted) == 2
+
+        # Different credentials never share an authenticated connection
+        import paramiko
+        with pytest.raises(paramiko.AuthenticationException):
+            pool.execute('127.0.0.1', port, 'admin', 'wrong', 'echo e')
+
+        pool.idle_timeout = 0
+        assert pool.evict_idle() == 1 and pool.get_stats()['connections'] == 0
+    finally:
+        pool.close()
+        listener.close()
+
+
+def test_ssh_pool_password_fallback_only_after_key(tmp_path, monkeypatch):
+    import paramiko
+    import ssh_pool
+    from ssh_pool import SSHSessionPool
+
+    clients = []
+
+    class FakeClient:
+        def __init__(self):
+            self.attempts = []
+            self.closed = False
+            clients.append(self)
+
+        def set_missing_host_key_policy(self, policy):
+            pass
+
+        def connect(self, host, password=None, key_filename=None, **options):
+            self.attempts.append('key' if key_filename else 'password')
+            if key_filename or password != 'secret':
+                raise paramiko.AuthenticationException('refused')
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(ssh_pool.paramiko, 'SSHClient', FakeClient)
+    key = tmp_path / 'id_ed25519'
+    key.write_text('key')
+
+    # Refused key: the password is tried once, on a fresh client
+    client = SSHSessionPool(key_path=str(key), keepalive=0)._connect('10.0.0.1', 22, 'admin', 'secret')
+    assert [c.attempts for c in clients] == [['key'], ['password']]
+    assert clients[0].closed and client is clients[1] and not client.closed
+
+    # No key: a refused password is not retried
+    clients.clear()
+    with pytest.raises(paramiko.AuthenticationException):
+        SSHSessionPool(key_path=str(tmp_path / 'missing'), keepalive=0)._connect('10.0.0.1', 22, 'admin', 'wrong')
+    assert [c.attempts for c in clients] == [['password']] and clients[0].closed
+
+
+def test_proxy_stream_relays_upstream_bytes():
+    import gzip
+    import threading
+    import requests
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from flask import Flask
+    import proxy_stream
+
+    payload = gzip.compress(bytes(range(256)) * 4096)
+
+    class Upstream(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(206)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(payload)))
+            self.send_header('Connection', 'X-Appliance-Hop')
+            self.send_header('X-Appliance-Hop', 'drop me')
+            self.send_header('X-Backup-Id', '42')
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Upstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/backup'
+    completed = []
+    app = Flask('proxy-stream-test')
+
+    @app.route('/relay')
+    def relay():
+        started = time.time()
+        upstream = requests.get(url, stream=True)
+        return proxy_stream.streaming_response(
+            upstream, '127.0.0.1', started, chunk_size=4096,
+            on_complete=lambda relayed, duration, error: completed.append((relayed, error)))
+
+    try:
+        r = app.test_client().get('/relay')
+        # Status, body bytes and end-to-end headers as sent by the appliance (still gzip-encoded)
+        assert r.status_code == 206 and r.data == payload
+        assert r.headers['Content-Encoding'] == 'gzip' and r.headers['Content-Length'] == str(len(payload))
+        assert r.headers['X-Backup-Id'] == '42' and 'X-Appliance-Hop' not in r.headers
+        assert 'Connection' not in r.headers and int(r.headers['X-VNF-Proxy-Duration-Ms']) >= 0
+        r.close()
+        assert completed == [(len(payload), None)]
+
+        chunks = list(proxy_stream.iter_upstream(requests.get(url, stream=True), chunk_size=1000))
+        assert max(len(chunk) for chunk in chunks) <= 1000 and b''.join(chunks) == payload
+
+        # A client that goes away releases the upstream connection
+        body = proxy_stream.iter_upstream(requests.get(url, stream=True), 1000,
+                                          lambda relayed, error: completed.append((relayed, error)))
+        next(body)
+        body.close()
+        assert completed[-1][0] == 1000 and isinstance(completed[-1][1], ConnectionAbortedError)
+    finally:
+        server.shutdown()
+
+
+
+def test_session_registry_keeps_connections_alive_and_retries():
+    import threading
+    import requests
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from http_sessions import SessionRegistry
+
+    calls = {}
+    connections = set()
+
+    class Appliance(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+
+        def _reply(self):
+            key = (self.command, self.path)
+            calls[key] = calls.get(key, 0) + 1
+            connections.add(self.client_address)
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            flaky = self.path == '/flaky' and calls[key] % 2
+            body = b'{"ok": true}'
+            self.send_response(503 if flaky else 200)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Set-Cookie', 'session=appliance')
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = _reply
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Appliance)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    registry = SessionRegistry(pool_maxsize=2, backoff_factor=0, idle_timeout=0.05)
+    try:
+        for _ in range(3):
+            assert registry.request('127.0.0.1', 'GET', f'{base}/rules', timeout=5).status_code == 200
+        # One keep-alive connection served every request; appliance cookies are not kept
+        assert len(connections) == 1
+        assert not registry.session('127.0.0.1').cookies
+
+        # 503 is retried for GET, not for POST (the appliance may have applied it)
+        assert registry.request('127.0.0.1', 'GET', f'{base}/flaky', timeout=5).status_code == 200
+        assert registry.stats['retries'] == 1
+        assert registry.request('127.0.0.1', 'POST', f'{base}/flaky', data='{}', timeout=5).status_code == 503
+        assert calls[('GET', '/flaky')] == 2 and calls[('POST', '/flaky')] == 1
+
+        # Open streams hold connections: a third concurrent request finds the pool saturated
+        streams = [registry.request('127.0.0.1', 'GET', f'{base}/rules', timeout=5, stream=True) for _ in range(3)]
+        stats = registry.get_stats()
+        assert stats['in_use'] == 2 and stats['saturation'] == 1.0 and stats['saturated'] == 1
+        time.sleep(0.1)
+        assert registry.evict_idle() == 0  # connections still in use
+        for stream in streams:
+            stream.close()
+        assert registry.get_stats()['in_use'] == 0
+        assert registry.evict_idle() == 1 and registry.get_stats()['targets'] == 0
+
+        with pytest.raises(requests.ConnectionError):
+            SessionRegistry(max_retries=1, backoff_factor=0).request('127.0.0.1', 'GET', 'http://127.0.0.1:1/', timeout=1)
+    finally:
+        registry.close()
+        server.shutdown()
+
+def test_write_behind_store_batches_and_audits(tmp_path):
+    import sqlite3
+    from durable_store import create_durable_store
+    url = f"sqlite://{tmp_path / 'ops.db'}"
+    store = create_durable_store(url, batch_size=2, flush_interval=60, max_queue=3)
+    db = sqlite3.connect(tmp_path / 'ops.db')
+    store._open().close()  # create the stand-in schema
+    db.execute("INSERT INTO vnf_appliances (uuid) VALUES ('vnf-known')")
+    db.commit()
+
+    assert store.record('k1', 'firewall.create', 'vnf-known', {'ruleId': 'r1', 'success': True}, 60)
+    assert store.record('k2', 'firewall.create', 'vnf-other', {'ruleId': 'r2'}, 60)
+    assert store.record('k3', 'nat.create', None, {'ruleId': 'r3'}, 60)
+    assert not store.record('k4', 'nat.create', None, {'ruleId': 'r4'}, 60)  # queue full
+    assert store.stats['dropped'] == 1
+
+    # Queued records answer lookups before they are written
+    assert store.lookup('k1')[0] == {'ruleId': 'r1', 'success': True}
+    assert db.execute("SELECT COUNT(*) FROM vnf_broker_operations").fetchone()[0] == 0
+
+    store.start()
+    assert store.flush()
+    assert store.stats['written'] == 3 and not store._pending
+    assert db.execute("SELECT COUNT(*) FROM vnf_broker_operations").fetchone()[0] == 3
+    # Only operations on known appliances are audited
+    assert db.execute("SELECT operation, method, success FROM vnf_broker_audit").fetchall() == [('firewall.create', 'BROKER', 1)]
+
+    found = store.lookup_many(['k2', 'k3', 'missing'])
+    assert found['k2'][0] == {'ruleId': 'r2'} and 0 < found['k2'][1] <= 60
+    assert set(found) == {'k2', 'k3'}
+
+    # Expired operations are neither returned nor kept
+    db.execute("UPDATE vnf_broker_operations SET expires = '2000-01-01 00:00:00' WHERE idempotency_key = 'k3'")
+    db.commit()
+    assert store.lookup('k3') is None
+
+    store.close()
+    assert not store.record('k5', 'nat.create', None, {}, 60)
+    store._purge()  # normally run by the writer thread every purge_interval
+    assert store.stats['purged'] == 1
+    with pytest.raises(ValueError):
+        create_durable_store('postgres://db/cloud')
+
+
+def test_idempotency_survives_redis_flush_via_durable_store(app_client, monkeypatch, tmp_path):
+    client, broker, fake = app_client
+    monkeypatch.setitem(broker.CONFIG, 'DURABLE_STORE_URL', f"sqlite://{tmp_path / 'ops.db'}")
+    monkeypatch.setitem(broker.CONFIG, 'IDEMPOTENCY_NEAR_CACHE', False)
+    payload = {
+        'vnfInstanceId': 'vnf-durable',
+        'ruleId': f'durable-{int(time.time() * 1000)}',
+        'action': 'allow',
+        'protocol': 'tcp',
+        'sourceIp': '10.0.0.0/24',
+        'destinationIp': '192.168.1.0/24',
+        'destinationPort': 22
+    }
+    try:
+        r1 = client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers())
+        assert r1.status_code == 201
+        store = broker.get_durable_store()
+        assert store.flush()
+
+        # Redis loses everything; the retry is still answered from the database
+        fake.kv.clear()
+        r2 = client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers())
+        assert r2.status_code == 200
+        assert r2.get_json() == r1.get_json()
+        assert len(fake.kv) == 1  # written back to Redis
+
+        # Batch lookups fall back for every Redis miss in one query
+        fake.kv.clear()
+        params = broker.CreateFirewallRuleRequest(**payload).dict()
+        results = broker.check_idempotency_many('firewall.create', [params, {'ruleId': 'never-seen'}])
+        assert results[0] is not None and results[1] is None
+        assert client.get('/metrics').get_json()['durable_store']['written'] == 1
+    finally:
+        if broker.durable_store is not None:
+            broker.durable_store.close()
+
+
+def test_durable_store_consulted_only_while_redis_may_lack_entries(app_client, monkeypatch, tmp_path):
+    import redis
+    client, broker, fake = app_client
+    monkeypatch.setitem(broker.CONFIG, 'DURABLE_STORE_URL', f"sqlite://{tmp_path / 'ops.db'}")
+    monkeypatch.setitem(broker.CONFIG, 'IDEMPOTENCY_NEAR_CACHE', False)
+    monkeypatch.setitem(broker.CONFIG, 'DURABLE_STORE_MARKER_INTERVAL', 0)
+    ttl = broker.CONFIG['IDEMPOTENCY_TTL_SECONDS']
+    params = {'ruleId': 'never-seen'}
+    try:
+        store = broker.get_durable_store()
+        lookups = []
+        real_lookup = store.lookup_many
+        monkeypatch.setattr(store, 'lookup_many', lambda keys: lookups.append(keys) or real_lookup(keys))
+
+        # Redis has been filling in for longer than the TTL: a miss is a new request
+        fake.kv[broker.IDEMPOTENCY_MARKER_KEY] = repr(time.time() - ttl - 1).encode()
+        assert broker.check_idempotency('firewall.create', params) is None
+        assert broker.check_idempotency_many('firewall.create', [params]) == [None]
+        assert lookups == []
+
+        # Redis unreachable: the database answers
+        def unavailable(*args, **kwargs):
+            raise redis.ConnectionError('down')
+        fake.get = unavailable
+        assert broker.check_idempotency('firewall.create', params) is None
+        assert len(lookups) == 1
+        del fake.get
+
+        # Redis flushed: the marker is gone and the clock starts again
+        fake.kv.clear()
+        assert broker.check_idempotency('firewall.create', params) is None
+        assert len(lookups) == 2
+        assert float(fake.kv[broker.IDEMPOTENCY_MARKER_KEY]) == pytest.approx(time.time(), abs=5)
+
+        # A write that only reached the durable store resets an old marker
+        fake.kv[broker.IDEMPOTENCY_MARKER_KEY] = repr(time.time() - ttl - 1).encode()
+        fake.setex = unavailable
+        broker.store_idempotency('firewall.create', {'ruleId': 'written'}, {'success': True})
+        del fake.setex
+        assert broker.check_idempotency('firewall.create', params) is None
+        assert len(lookups) == 3
+
+        # 'always' restores the lookup on every miss
+        fake.kv[broker.IDEMPOTENCY_MARKER_KEY] = repr(time.time() - ttl - 1).encode()
+        monkeypatch.setitem(broker.CONFIG, 'DURABLE_STORE_LOOKUP', 'always')
+        assert broker.check_idempotency('firewall.create', params) is None
+        assert len(lookups) == 4
+    finally:
+        if broker.durable_store is not None:
+            broker.durable_store.close()
+
+
+def _vendor_rules(count):
+    for i in range(count):
+        yield {
+            'ruleId': f'r{i}',
+            'protocol': 'tcp' if i % 2 == 0 else 'udp',
+            'sourceIp': f'10.{i % 4}.0.0/16',
+            'destinationIp': '192.168.1.10',
+            'destinationPort': 22 if i % 3 == 0 else '8000-8100'
+        }
+
+
+@pytest.mark.parametrize('use_ijson', [True, False])
+def test_rule_listing_parses_incrementally_and_filters(monkeypatch, use_ijson):
+    import rule_listing
+    from rule_listing import RuleFilter, RulePager, iter_json_items, paginate
+    monkeypatch.setattr(rule_listing, 'IJSON_AVAILABLE', use_ijson and rule_listing.IJSON_AVAILABLE)
+    body = json.dumps({'data': list(_vendor_rules(5)), 'status': 'ok'}).encode()
+    chunks = [body[i:i + 7] for i in range(0, len(body), 7)]
+    assert [rule['ruleId'] for rule in iter_json_items(chunks, '$.data')] == ['r0', 'r1', 'r2', 'r3', 'r4']
+    assert list(iter_json_items([b'{"results": null}'], '$.results')) == []
+
+    rule_filter = RuleFilter(protocol='TCP', port='8050', source_cidr='10.0.0.0/9')
+    assert [r['ruleId'] for r in _vendor_rules(12) if rule_filter.matches(r)] == ['r2', 'r4', 'r8', 'r10']
+    assert RuleFilter(destination_cidr='192.168.0.0/16').matches({'destinationIp': '192.168.1.10'})
+    assert not RuleFilter(destination_cidr='192.168.0.0/16').matches({'destinationIp': 'any'})
+    with pytest.raises(ValueError):
+        RuleFilter(port='70000')
+
+    # Reading stops once the page is full
+    consumed = []
+    source = (consumed.append(rule) or rule for rule in _vendor_rules(10000))
+    pager = RulePager(RuleFilter(), limit=3)
+    assert [r['ruleId'] for r in paginate(source, pager)] == ['r0', 'r1', 'r2']
+    assert len(consumed) == 4 and pager.next_cursor
+
+    # Cursors resume after the last rule, even if earlier rules were deleted
+    remaining = [r for r in _vendor_rules(10) if r['ruleId'] != 'r1']
+    assert [r['ruleId'] for r in paginate(remaining, RulePager(RuleFilter(), 3, pager.next_cursor))] == ['r3', 'r4', 'r5']
+    with pytest.raises(ValueError):
+        RulePager(RuleFilter(protocol='udp'), 3, pager.next_cursor)
+    with pytest.raises(ValueError):
+        RulePager(RuleFilter(), 3, 'not-a-cursor')
+
+
+def test_list_firewall_rules_pages_and_streams_ndjson(app_client, monkeypatch):
+    client, broker, _ = app_client
+    held = []
+
+    def active(vnf_id):
+        return broker.get_bulkhead().get_stats()['compartments'].get('vnf', {}).get(vnf_id, {}).get('active', 0)
+
+    def fetch(vnf_id, request_id):
+        held.append(active(vnf_id))
+        yield from _vendor_rules(10000)
+
+    monkeypatch.setattr(broker, 'fetch_firewall_rules', fetch)
+    # Too large for the rule inventory: every request lists the VNF live
+    monkeypatch.setitem(broker.CONFIG, 'RULE_INVENTORY_MAX_RULES', 1000)
+    url = '/api/vnf/firewall/list?vnfInstanceId=vnf-big&protocol=tcp&port=22'
+
+    ids, cursor = [], None
+    for _ in range(5):
+        r = client.get(url + '&limit=500' + (f'&cursor={cursor}' if cursor else ''), headers=auth_headers())
+        assert r.status_code == 200
+        data = r.get_json()
+        ids += [rule['ruleId'] for rule in data['rules']]
+        cursor = data['nextCursor']
+        if not cursor:
+            break
+    # Every 6th rule is tcp/22
+    assert ids == [f'r{i}' for i in range(0, 10000, 6)] and cursor is None
+
+    r = client.get(url + '&format=ndjson&limit=2', headers=auth_headers())
+    assert r.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in r.data.splitlines()]
+    assert [line['ruleId'] for line in lines[:-1]] == ['r0', 'r6']
+    assert lines[-1]['_meta']['count'] == 2 and lines[-1]['_meta']['nextCursor']
+    # The bulkhead slot is held while the VNF list streams, and released when the server closes it
+    r.close()
+    assert held[-1] == 1 and active('vnf-big') == 0
+
+    assert client.get(url + '&limit=0', headers=auth_headers()).status_code == 400
+    assert client.get(url + '&cursor=bogus', headers=auth_headers()).status_code == 400
+    assert len(held) == 5 and len(broker.rule_inventory) == 0
+
+
+def test_rule_inventory_versions_write_through_and_refresh():
+    from rule_inventory import RuleInventory, InventoryRefresher, list_etag, etag_matches
+
+    inventory = RuleInventory(max_rules=5, max_age=60)
+    rules = list(_vendor_rules(3))
+    snapshot = inventory.replace('vnf-1', rules)
+    assert [r['ruleId'] for r in inventory.get('vnf-1').rules] == ['r0', 'r1', 'r2']
+    # Same rules, same version (on every worker)
+    assert RuleInventory().replace('vnf-1', list(_vendor_rules(3))).version == snapshot.version
+
+    assert inventory.upsert('vnf-1', {**rules[1], 'protocol': 'icmp'})
+    assert inventory.upsert('vnf-1', {'ruleId': 'r9', 'protocol': 'tcp'})
+    assert inventory.remove('vnf-1', 'r0')
+    updated = inventory.get('vnf-1')
+    assert [(r['ruleId'], r['protocol']) for r in updated.rules] == [('r1', 'icmp'), ('r2', 'tcp'), ('r9', 'tcp')]
+    assert updated.version != snapshot.version
+    assert not inventory.upsert('vnf-2', rules[0])
+
+    # A fetch that started before a write does not overwrite it
+    token = inventory.fetch_token('vnf-1')
+    inventory.remove('vnf-1', 'r9')
+    assert inventory.replace('vnf-1', rules, token) is None
+    assert inventory.replace('vnf-2', list(_vendor_rules(6))) is None and inventory.get('vnf-2') is None
+
+    etag = list_etag(updated.version, {'vnfInstanceId': 'vnf-1', 'limit': '10'})
+    assert etag == list_etag(updated.version, {'limit': '10', 'vnfInstanceId': 'vnf-9'})
+    assert etag != list_etag(updated.version, {'limit': '20'})
+    assert etag_matches(f'"x", {etag.removeprefix("W/")}', etag) and etag_matches('*', etag)
+    assert not etag_matches('"x"', etag) and not etag_matches(None, etag)
+
+    refreshed = []
+
+    def refresh(vnf_id):
+        refreshed.append(vnf_id)
+        inventory.replace(vnf_id, rules)
+
+    refresher = InventoryRefresher(inventory, refresh, interval=0)
+    assert refresher.run_once() == 1 and refreshed == ['vnf-1']
+    assert len(inventory.get('vnf-1').rules) == 3
+    inventory.max_age = 0
+    assert inventory.get('vnf-1') is None
+
+
+def test_list_answers_from_rule_inventory_with_etag(app_client, monkeypatch):
+    client, broker, _ = app_client
+    fetches = []
+
+    def fetch(vnf_id, request_id):
+        fetches.append(vnf_id)
+        yield from _vendor_rules(4)
+
+    monkeypatch.setattr(broker, 'fetch_firewall_rules', fetch)
+    url = '/api/vnf/firewall/list?vnfInstanceId=vnf-inv'
+
+    r = client.get(url, headers=auth_headers())
+    etag = r.headers['ETag']
+    assert r.status_code == 200 and r.get_json()['count'] == 4 and etag
+
+    # Unchanged: 304 without calling the VNF
+    r = client.get(url, headers={**auth_headers(), 'If-None-Match': etag})
+    assert r.status_code == 304 and r.headers['ETag'] == etag and not r.data
+    assert fetches == ['vnf-inv']
+
+    # Writes through this broker change the list without a re-fetch
+    payload = {'vnfInstanceId': 'vnf-inv', 'ruleId': 'r-new', 'action': 'deny', 'protocol': 'udp',
+               'sourceIp': '10.9.0.0/16', 'destinationIp': '192.168.1.10', 'destinationPort': 53}
+    assert client.post('/api/vnf/firewall/create', json=payload, headers=auth_headers()).status_code == 201
+    assert client.delete('/api/vnf/firewall/delete/r0?vnfInstanceId=vnf-inv', headers=auth_headers()).status_code == 200
+    r = client.get(url, headers={**auth_headers(), 'If-None-Match': etag})
+    assert r.status_code == 200 and r.headers['ETag'] != etag
+    rules = r.get_json()['rules']
+    assert [rule['ruleId'] for rule in rules] == ['r1', 'r2', 'r3', 'r-new']
+    assert rules[-1]['protocol'] == 'udp' and rules[-1]['action'] == 'deny'
+
+    r = client.get(url + '&format=ndjson&protocol=udp', headers=auth_headers())
+    assert r.headers['ETag'] and r.headers['ETag'] != etag
+    assert [json.loads(line).get('ruleId') for line in r.data.splitlines()][-2] == 'r-new'
+    r.close()
+    assert fetches == ['vnf-inv']
+    assert client.get('/metrics').get_json()['rule_inventory']['write_through'] == 2
@@ -9,7 +9,7 @@ Features:
 - mTLS authentication with management server
 - JWT authorization for requests
 - HTTP/HTTPS proxying to VNF devices
-- SSH/CLI command execution
+- SSH/CLI command execution over pooled connections (ssh_pool.py)
 - Request/response logging for audit
 
 Installation on VR:
@@ -29,15 +29,18 @@ import subprocess
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import requests
-import paramiko
 import jwt
 from cryptography import x509
 from cryptography.x509.oid import NameOID
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 
+from ssh_pool import SSHSessionPool, SSHPoolExhausted
+import proxy_stream
+from http_sessions import SessionRegistry
+
 # Configuration
 CONFIG = {
     'BROKER_PORT': 8443,
@@ -51,7 +54,20 @@ CONFIG = {
     'CA_CERT_PATH': '/etc/vnf-broker/ca.crt',
     'LOG_FILE': '/var/log/vnf-broker/broker.log',
     'REQUEST_TIMEOUT': 30,
+    'PROXY_STREAM_CHUNK_SIZE': 65536,  # bytes relayed per chunk in streaming proxy mode
+    'PROXY_POOL_MAXSIZE': 10,  # keep-alive connections per appliance
+    'PROXY_POOL_BLOCK': False,  # wait for a free connection instead of opening an extra one
+    'PROXY_MAX_RETRIES': 2,  # retries of failed connects (and 502/503/504 on idempotent methods)
+    'PROXY_RETRY_BACKOFF': 0.5,  # exponential backoff base (seconds)
+    'PROXY_RETRY_STATUSES': [502, 503, 504],
+    'PROXY_SESSION_IDLE_TIMEOUT': 300,  # seconds an unused appliance session stays open
     'SSH_KEY_PATH': '/etc/vnf-broker/ssh_key',
+    'SSH_POOL_MAX_CHANNELS': 4,  # concurrent commands per appliance connection
+    'SSH_POOL_IDLE_TIMEOUT': 300,  # seconds an unused connection stays open
+    'SSH_POOL_MAX_LIFETIME': 3600,  # seconds before a connection is replaced
+    'SSH_POOL_ACQUIRE_TIMEOUT': 30,  # seconds a command waits for a free channel
+    'SSH_COMMAND_TIMEOUT': 120,  # seconds a command may run
+    'SSH_KEEPALIVE': 30,  # SSH keepalive interval (seconds, 0 = off)
     'DEBUG': False
 }
 
@@ -69,6 +85,12 @@ logger = logging.getLogger('vnf-broker')
 # Flask app
 app = Flask(__name__)
 
+# Persistent SSH connections per appliance (see get_ssh_pool)
+ssh_pool: Optional[SSHSessionPool] = None
+
+# Keep-alive HTTP sessions per appliance (see get_http_sessions)
+http_sessions: Optional[SessionRegistry] = None
+
 def load_config():
     """Load configuration from file"""
     config_file = '/etc/vnf-broker/config.json'
@@ -114,6 +136,22 @@ def check_ip_allowed(ip: str, allowed_list: list) -> bool:
         return True
     return ip in allowed_list
 
+def get_http_sessions() -> SessionRegistry:
+    """Get the per-appliance HTTP session registry, created with its idle reaper on first use"""
+    global http_sessions
+    if http_sessions is None:
+        http_sessions = SessionRegistry(
+            pool_maxsize=CONFIG['PROXY_POOL_MAXSIZE'],
+            pool_block=CONFIG['PROXY_POOL_BLOCK'],
+            max_retries=CONFIG['PROXY_MAX_RETRIES'],
+            backoff_factor=CONFIG['PROXY_RETRY_BACKOFF'],
+            retry_statuses=CONFIG['PROXY_RETRY_STATUSES'],
+            idle_timeout=CONFIG['PROXY_SESSION_IDLE_TIMEOUT'],
+            verify=False  # VNF devices often use self-signed certs
+        )
+        http_sessions.start()
+    return http_sessions
+
 def proxy_http_request(target_ip: str, method: str, uri: str, 
                        headers: Dict, body: Optional[str]) -> Dict:
     """
@@ -129,13 +167,13 @@ def proxy_http_request(target_ip: str, method: str, uri: str,
     start_time = time.time()
     
     try:
-        response = requests.request(
+        response = get_http_sessions().request(
+            target_ip,
             method=method,
             url=url,
             headers=headers_copy,
             data=body,
-            timeout=CONFIG['REQUEST_TIMEOUT'],
-            verify=False  # VNF devices often use self-signed certs
+            timeout=CONFIG['REQUEST_TIMEOUT']
         )
         
         duration_ms = int((time.time() - start_time) * 1000)
@@ -165,55 +203,65 @@ def proxy_http_request(target_ip: str, method: str, uri: str,
             'duration_ms': int((time.time() - start_time) * 1000)
         }
 
+def proxy_http_stream(target_ip: str, method: str, uri: str,
+                      headers: Dict, body: Optional[str]) -> Response:
+    """
+    Proxy HTTP/HTTPS request to VNF device, relaying the response as is
+    (status, headers and body bytes, streamed - see proxy_stream)
+    """
+    url = f"https://{target_ip}{uri}"
+    
+    headers_copy = headers.copy()
+    headers_copy.pop('Host', None)
+    headers_copy.pop('Content-Length', None)
+    
+    start_time = time.time()
+    
+    try:
+        upstream = get_http_sessions().request(
+            target_ip,
+            method=method,
+            url=url,
+            headers=headers_copy,
+            data=body,
+            timeout=CONFIG['REQUEST_TIMEOUT'],
+            stream=True
+        )
+    except requests.Timeout:
+        logger.error(f"Timeout connecting to {target_ip}")
+        return proxy_stream.error_response(504, 'Gateway Timeout', int((time.time() - start_time) * 1000))
+    except requests.RequestException as e:
+        logger.error(f"Error connecting to {target_ip}: {e}")
+        return proxy_stream.error_response(502, f'Bad Gateway: {str(e)}', int((time.time() - start_time) * 1000))
+    
+    return proxy_stream.streaming_response(upstream, target_ip, start_time, CONFIG['PROXY_STREAM_CHUNK_SIZE'])
+
+def get_ssh_pool() -> SSHSessionPool:
+    """Get the SSH session pool, created with its idle reaper on first use"""
+    global ssh_pool
+    if ssh_pool is None:
+        ssh_pool = SSHSessionPool(
+            max_channels=CONFIG['SSH_POOL_MAX_CHANNELS'],
+            idle_timeout=CONFIG['SSH_POOL_IDLE_TIMEOUT'],
+            max_lifetime=CONFIG['SSH_POOL_MAX_LIFETIME'],
+            acquire_timeout=CONFIG['SSH_POOL_ACQUIRE_TIMEOUT'],
+            connect_timeout=CONFIG['REQUEST_TIMEOUT'],
+            keepalive=CONFIG['SSH_KEEPALIVE'],
+            key_path=CONFIG['SSH_KEY_PATH']
+        )
+        ssh_pool.start()
+    return ssh_pool
+
 def execute_ssh_command(target_ip: str, port: int, username: str, 
                         password: Optional[str], command: str) -> Dict:
     """
-    Execute command on VNF device via SSH
+    Execute command on VNF device via SSH (on a pooled connection)
     """
     start_time = time.time()
     
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
-        # Attempt key-based auth first, then password
-        try:
-            if os.path.exists(CONFIG['SSH_KEY_PATH']):
-                client.connect(
-                    target_ip,
-                    port=port,
-                    username=username,
-                    key_filename=CONFIG['SSH_KEY_PATH'],
-                    timeout=CONFIG['REQUEST_TIMEOUT']
-                )
-            else:
-                client.connect(
-                    target_ip,
-                    port=port,
-                    username=username,
-                    password=password,
-                    timeout=CONFIG['REQUEST_TIMEOUT']
-                )
-        except paramiko.AuthenticationException:
-            if password:
-                client.connect(
-                    target_ip,
-                    port=port,
-                    username=username,
-                    password=password,
-                    timeout=CONFIG['REQUEST_TIMEOUT']
-                )
-            else:
-                raise
-        
-        # Execute command
-        stdin, stdout, stderr = client.exec_command(command)
-        exit_code = stdout.channel.recv_exit_status()
-        
-        stdout_text = stdout.read().decode('utf-8')
-        stderr_text = stderr.read().decode('utf-8')
-        
-        client.close()
+        exit_code, stdout_text, stderr_text = get_ssh_pool().execute(
+            target_ip, port, username, password, command, timeout=CONFIG['SSH_COMMAND_TIMEOUT'])
         
         duration_ms = int((time.time() - start_time) * 1000)
         
@@ -225,6 +273,14 @@ def execute_ssh_command(target_ip: str, port: int, username: str,
             'duration_ms': duration_ms
         }
         
+    except SSHPoolExhausted as e:
+        logger.warning(f"SSH busy for {target_ip}: {e}")
+        return {
+            'success': False,
+            'status_code': -1,
+            'error': str(e),
+            'duration_ms': int((time.time() - start_time) * 1000)
+        }
     except Exception as e:
         logger.error(f"SSH error to {target_ip}: {e}")
         return {
@@ -240,6 +296,8 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'service': 'vnf-broker',
+        'ssh_pool': ssh_pool.get_stats() if ssh_pool is not None else None,
+        'http_sessions': http_sessions.get_stats() if http_sessions is not None else None,
         'timestamp': datetime.now().isoformat()
     })
 
@@ -259,6 +317,8 @@ def vnf_proxy():
             "Content-Type": "application/json"
         },
         "body": "...",
+        "stream": false,      // true: relay the HTTP response as is (status,
+                              // headers, body bytes) instead of a JSON envelope
         // For SSH:
         "command": "...",
         "ssh_username": "admin",
@@ -321,6 +381,10 @@ def vnf_proxy():
         headers = req_data.get('headers', {})
         body = req_data.get('body')
         
+        if req_data.get('stream'):
+            # Large exports and backups: never buffered in the broker
+            return proxy_http_stream(target_ip, method, uri, headers, body)
+        
         result = proxy_http_request(target_ip, method, uri, headers, body)
         
     elif protocol == 'SSH':
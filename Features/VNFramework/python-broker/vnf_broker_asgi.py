@@ -0,0 +1,1156 @@
+#!/usr/bin/env python3
+"""
+VNF Broker Service - ASGI Serving Mode (Build2)
+===============================================
+Async variant of vnf_broker_enhanced.py for high-concurrency deployments:
+- Same endpoints, request models, require_auth/rate_limit decorators and
+  Prometheus metrics as the Flask app (imported from vnf_broker_enhanced)
+- Non-blocking Redis via redis.asyncio
+- Async vendor I/O via a shared httpx.AsyncClient, so in-flight appliance
+  calls cost a coroutine, not a worker thread
+
+Run:
+  python3 vnf_broker_asgi.py
+  uvicorn vnf_broker_asgi:app --host 0.0.0.0 --port 8443
+"""
+
+import math
+import time
+import json
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from functools import wraps
+from contextlib import asynccontextmanager, AsyncExitStack
+from typing import Dict, Optional, Tuple, List, Callable, Awaitable, AsyncIterator, Iterable
+
+import httpx
+import redis
+import redis.asyncio as aioredis
+from pydantic import ValidationError
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.routing import Route
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+
+import vnf_broker_enhanced as broker
+from rate_limiter import AsyncRateLimiter, AsyncLeasedRateLimiter, RateLimitResult
+from bulkhead import AsyncBulkhead, BulkheadRejected
+from single_flight import AsyncSingleFlight
+from redis_topology import create_async_redis_client, describe_topology, mget_any_slot
+from rule_listing import RulePager, ndjson_line, aiter_json_items
+from rule_inventory import InventorySnapshot, list_etag, etag_matches
+from vnf_broker_enhanced import (
+    CONFIG,
+    CreateFirewallRuleRequest,
+    CreateNATRuleRequest,
+    HTTP_REQUESTS,
+    HTTP_LATENCY,
+    RATE_LIMIT_ALLOWED,
+    RATE_LIMIT_BLOCKED,
+    RATE_LIMIT_DECISIONS,
+    BATCH_SIZE,
+    FirewallBatch,
+    bulkhead_settings,
+    bulkhead_rejection,
+    compute_idempotency_key,
+    get_idempotency_codec,
+    near_cache_get,
+    idempotency_near_cache_stats,
+    get_durable_store,
+    durable_record,
+    durable_lookup,
+    parse_list_query,
+    firewall_rule_record,
+    get_rule_inventory,
+    update_rule_inventory,
+    publish_rule_inventory_change,
+    rule_inventory_stats,
+    count_rule_inventory_lookup,
+)
+
+logger = logging.getLogger('vnf-broker-asgi')
+
+# Async clients (initialized in lifespan)
+redis_client: Optional[aioredis.Redis] = None
+redis_binary_client: Optional[aioredis.Redis] = None  # raw bytes (encoded idempotency entries)
+vendor_client: Optional[httpx.AsyncClient] = None
+rate_limiter = None  # AsyncRateLimiter or AsyncLeasedRateLimiter
+bulkhead: Optional[AsyncBulkhead] = None  # see get_bulkhead
+single_flight: Optional[AsyncSingleFlight] = None  # see get_single_flight
+inventory_refresh_task: Optional[asyncio.Task] = None  # see refresh_rule_inventories
+invalidation_retry_task: Optional[asyncio.Task] = None  # see near_cache_put
+
+# ============================================================================
+# Initialization
+# ============================================================================
+
+async def init_redis():
+    """Create the async Redis clients for REDIS_MODE (connect on first use, see vnf_broker_enhanced.init_redis)"""
+    global redis_client, redis_binary_client
+
+    redis_client = create_async_redis_client(CONFIG)
+    redis_binary_client = create_async_redis_client(CONFIG, decode_responses=False)
+    try:
+        await redis_client.ping()
+        logger.info(f"Async Redis connected: {describe_topology(CONFIG)}")
+    except redis.RedisError as e:
+        logger.error(f"Redis unavailable at startup ({describe_topology(CONFIG)}), will retry on use: {e}")
+
+def _init_sync_redis():
+    broker.init_redis()
+    broker.init_idempotency_invalidation()
+    broker.init_rule_inventory_invalidation()
+
+def init_vendor_client():
+    """Create the shared async HTTP client used for VNF calls"""
+    global vendor_client
+
+    vendor_client = httpx.AsyncClient(
+        timeout=CONFIG['REQUEST_TIMEOUT'],
+        verify=False,  # VNF devices often use self-signed certs
+        limits=httpx.Limits(max_connections=CONFIG['VENDOR_MAX_CONNECTIONS'])
+    )
+
+@asynccontextmanager
+async def lifespan(app):
+    """Startup/shutdown for the ASGI app"""
+    broker.load_config()
+    broker.JWT_PUBLIC_KEY = broker.load_jwt_public_key()
+    broker.init_jwt_cache()
+    global inventory_refresh_task
+    await init_redis()
+    if CONFIG['CIRCUIT_BREAKER_BACKEND'] == 'redis' or CONFIG['IDEMPOTENCY_NEAR_CACHE'] or CONFIG['RULE_INVENTORY']:
+        # Shared breaker state and near-cache / inventory invalidation use the
+        # enhanced module's sync client. Connecting and subscribing block, so
+        # they run in a worker thread; invalidation then listens on pub/sub
+        # threads, and breaker calls go through asyncio.to_thread as well
+        # (see check_circuit_breaker below)
+        await asyncio.to_thread(_init_sync_redis)
+    await asyncio.to_thread(get_durable_store)  # may connect to the database
+    init_vendor_client()
+    if get_rule_inventory(refresh=False) is not None:
+        inventory_refresh_task = asyncio.create_task(refresh_rule_inventories())
+    logger.info("VNF Broker ASGI mode started")
+    try:
+        yield
+    finally:
+        if inventory_refresh_task is not None:
+            inventory_refresh_task.cancel()
+            inventory_refresh_task = None
+        if isinstance(rate_limiter, AsyncLeasedRateLimiter):
+            await rate_limiter.stop()
+        if broker.circuit_breaker is not None:
+            broker.circuit_breaker.close()
+        if broker.idempotency_invalidator is not None:
+            broker.idempotency_invalidator.close()
+        if broker.inventory_invalidator is not None:
+            broker.inventory_invalidator.close()
+        if broker.durable_store is not None:
+            # Writes what is still queued; may wait on the database
+            await asyncio.to_thread(broker.durable_store.close)
+        await vendor_client.aclose()
+        await redis_client.aclose()
+        if redis_binary_client is not None:
+            await redis_binary_client.aclose()
+        logger.info("VNF Broker ASGI mode stopped")
+
+# ============================================================================
+# Rate Limiting / Idempotency (async Redis)
+# ============================================================================
+
+async def get_rate_limiter():
+    """
+    Get the rate limiter for the current Redis client and configuration
+    (an AsyncLeasedRateLimiter with a reconcile task when
+    RATE_LIMIT_LOCAL_LEASE is set)
+    """
+    global rate_limiter
+    leased = bool(CONFIG.get('RATE_LIMIT_LOCAL_LEASE'))
+    if (rate_limiter is not None
+            and rate_limiter.redis is redis_client
+            and rate_limiter.algorithm == CONFIG['RATE_LIMIT_ALGORITHM']
+            and isinstance(rate_limiter, AsyncLeasedRateLimiter) == leased):
+        return rate_limiter
+
+    if isinstance(rate_limiter, AsyncLeasedRateLimiter):
+        await rate_limiter.stop()
+
+    limiter = AsyncRateLimiter(
+        redis_client,
+        algorithm=CONFIG['RATE_LIMIT_ALGORITHM'],
+        burst=CONFIG.get('RATE_LIMIT_BURST')
+    )
+    if leased:
+        limiter = AsyncLeasedRateLimiter(
+            limiter,
+            lease_fraction=CONFIG['RATE_LIMIT_LEASE_FRACTION'],
+            max_lease=CONFIG['RATE_LIMIT_LEASE_MAX'],
+            lease_ttl=CONFIG['RATE_LIMIT_LEASE_TTL']
+        )
+        limiter.start()
+    rate_limiter = limiter
+    return rate_limiter
+
+async def check_rate_limit(client_id: str) -> RateLimitResult:
+    """
+    Check if client has exceeded rate limit (one EVALSHA round trip)
+    Returns: RateLimitResult with remaining quota and reset/retry-after seconds
+    """
+    limit = CONFIG['RATE_LIMIT_REQUESTS']
+    window = CONFIG['RATE_LIMIT_WINDOW']
+
+    try:
+        result = await (await get_rate_limiter()).check(client_id, limit=limit, window=window)
+    except redis.RedisError as e:
+        logger.error(f"Rate limit check failed: {e}")
+        # Fail open in case of Redis issues
+        return RateLimitResult(allowed=True, limit=limit, remaining=limit, reset_after=window)
+
+    RATE_LIMIT_DECISIONS.labels(tier=result.source).inc()
+
+    if not result.allowed:
+        logger.warning(f"Rate limit exceeded for {client_id}: {limit}/{window}s")
+        RATE_LIMIT_BLOCKED.labels(client=client_id).inc()
+        return result
+
+    RATE_LIMIT_ALLOWED.labels(client=client_id).inc()
+    return result
+
+def get_bulkhead() -> AsyncBulkhead:
+    """Get the bulkhead for the current configuration (metrics shared with the Flask app)"""
+    global bulkhead
+    settings = bulkhead_settings()
+    if bulkhead is None or bulkhead.settings != settings:
+        bulkhead = AsyncBulkhead(
+            on_admit=broker._on_bulkhead_admit,
+            on_reject=broker._on_bulkhead_reject,
+            **settings
+        )
+        bulkhead.settings = settings
+    return bulkhead
+
+def _idempotency_redis() -> aioredis.Redis:
+    """Client for idempotency entries (binary-safe once init_redis has run)"""
+    return redis_binary_client if redis_binary_client is not None else redis_client
+
+def near_cache_put(key: str, response: Dict, ttl: Optional[float] = None):
+    """vnf_broker_enhanced.near_cache_put; a due subscription retry runs in a worker thread"""
+    global invalidation_retry_task
+    cache = broker.get_idempotency_near_cache()
+    if cache is None or response is None:
+        return
+    cache.put(key, response, ttl)
+    if broker.invalidation_retry_due() and (invalidation_retry_task is None or invalidation_retry_task.done()):
+        invalidation_retry_task = asyncio.get_running_loop().create_task(
+            asyncio.to_thread(broker.init_idempotency_invalidation))
+
+async def idempotency_redis_complete() -> bool:
+    """Async vnf_broker_enhanced.idempotency_redis_complete (same marker key and per-worker state)"""
+    cached = broker._marker_cached()
+    if cached is not None:
+        return cached
+    client = _idempotency_redis()
+    ttl = CONFIG['IDEMPOTENCY_TTL_SECONDS']
+    now = time.time()
+    try:
+        if broker._idempotency_marker['reset']:
+            await client.delete(broker.IDEMPOTENCY_MARKER_KEY)
+            broker._idempotency_marker['reset'] = False
+        since = await client.get(broker.IDEMPOTENCY_MARKER_KEY)
+        if since is None:
+            since = now
+            await client.setex(broker.IDEMPOTENCY_MARKER_KEY, 2 * ttl, repr(since))
+        else:
+            await client.expire(broker.IDEMPOTENCY_MARKER_KEY, 2 * ttl)
+    except redis.RedisError as e:
+        logger.error(f"Idempotency marker check failed: {e}")
+        return False
+    return broker._marker_read(since, now)
+
+async def _durable_lookup(keys: List[str]) -> Dict[str, Tuple[Dict, int]]:
+    """durable_lookup off the event loop, then write the recovered entries back to Redis"""
+    if not keys or get_durable_store() is None:
+        return {}
+    found = await asyncio.to_thread(durable_lookup, keys)
+    if found:
+        codec = get_idempotency_codec()
+        try:
+            pipe = _idempotency_redis().pipeline()
+            for key, (response, ttl) in found.items():
+                pipe.setex(key, ttl, codec.encode(response))
+            await pipe.execute()
+        except redis.RedisError as e:
+            logger.error(f"Idempotency restore from durable store failed: {e}")
+    return found
+
+async def check_idempotency(operation: str, params: Dict, durable: bool = True) -> Optional[Dict]:
+    """Check idempotency cache (near-cache, then Redis, then the durable store)"""
+    key = compute_idempotency_key(operation, params)
+    cached_response = near_cache_get(key)
+    if cached_response is not None:
+        logger.info(f"Idempotency HIT (near-cache): {key}")
+        return cached_response
+    redis_failed = False
+    try:
+        cached = await _idempotency_redis().get(key)
+        if cached:
+            logger.info(f"Idempotency HIT: {key}")
+            cached_response = broker._decode_idempotency(key, cached)
+            near_cache_put(key, cached_response)
+            return cached_response
+    except redis.RedisError as e:
+        logger.error(f"Idempotency check failed: {e}")
+        redis_failed = True
+    if not durable or get_durable_store() is None:
+        return None
+    if not redis_failed and await idempotency_redis_complete():
+        return None
+    found = await _durable_lookup([key])
+    return found[key][0] if key in found else None
+
+async def check_idempotency_many(operation: str, params_list: List[Dict]) -> List[Optional[Dict]]:
+    """Check idempotency cache for many requests (near-cache, one MGET, then one durable store read for the misses)"""
+    if not params_list:
+        return []
+    keys = [compute_idempotency_key(operation, params) for params in params_list]
+    results = [near_cache_get(key) for key in keys]
+    missing = [index for index, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+    redis_failed = False
+    try:
+        cached = await mget_any_slot(_idempotency_redis(), [keys[index] for index in missing])
+        for index, value in zip(missing, cached):
+            if value:
+                results[index] = broker._decode_idempotency(keys[index], value)
+                near_cache_put(keys[index], results[index])
+    except redis.RedisError as e:
+        logger.error(f"Idempotency batch check failed: {e}")
+        redis_failed = True
+    unresolved = [keys[index] for index in missing if results[index] is None]
+    if not unresolved or get_durable_store() is None or (not redis_failed and await idempotency_redis_complete()):
+        return results
+    found = await _durable_lookup(unresolved)
+    for index in missing:
+        if keys[index] in found:
+            results[index] = found[keys[index]][0]
+    return results
+
+async def store_idempotency(operation: str, params: Dict, response: Dict):
+    """Store response in idempotency cache (and queue it for the durable store)"""
+    key = compute_idempotency_key(operation, params)
+    durable_record(key, operation, params, response)
+    try:
+        ttl = CONFIG['IDEMPOTENCY_TTL_SECONDS']
+        await _idempotency_redis().setex(key, ttl, get_idempotency_codec().encode(response))
+        near_cache_put(key, response, ttl)
+        logger.info(f"Idempotency stored: {key}")
+    except redis.RedisError as e:
+        logger.error(f"Idempotency store failed: {e}")
+        broker._marker_lost()
+
+async def store_idempotency_many(operation: str, items: List[Tuple[Dict, Dict]]):
+    """Store many (params, response) pairs in one pipeline round trip"""
+    if not items:
+        return
+    ttl = CONFIG['IDEMPOTENCY_TTL_SECONDS']
+    codec = get_idempotency_codec()
+    keys = [compute_idempotency_key(operation, params) for params, _ in items]
+    for key, (params, response) in zip(keys, items):
+        durable_record(key, operation, params, response)
+    try:
+        pipe = _idempotency_redis().pipeline()
+        for key, (_, response) in zip(keys, items):
+            pipe.setex(key, ttl, codec.encode(response))
+        await pipe.execute()
+        for key, (_, response) in zip(keys, items):
+            near_cache_put(key, response, ttl)
+    except redis.RedisError as e:
+        logger.error(f"Idempotency batch store failed: {e}")
+        broker._marker_lost()
+
+def get_single_flight() -> AsyncSingleFlight:
+    """Get the single-flight group for the current async Redis client"""
+    global single_flight
+    if single_flight is None or single_flight.redis is not redis_client:
+        single_flight = AsyncSingleFlight(redis_client)
+    single_flight.lease_ttl = CONFIG['SINGLE_FLIGHT_LEASE_TTL']
+    return single_flight
+
+async def run_single_flight(operation: str, params: Dict,
+                            execute: Callable[[], Awaitable[Tuple[Dict, int]]]) -> Tuple[Dict, int]:
+    """Run execute once for all concurrent duplicates (see vnf_broker_enhanced.run_single_flight)"""
+    async def load() -> Optional[Tuple[Dict, int]]:
+        cached = await check_idempotency(operation, params, durable=False)
+        return (cached, 200) if cached else None
+
+    key = compute_idempotency_key(operation, params)
+    (body, status), executed = await get_single_flight().do(key, execute, load)
+    if not executed:
+        logger.info(f"Single-flight: shared in-flight result for {key}")
+        if status == 201:
+            status = 200
+    return body, status
+
+# ============================================================================
+# Circuit Breaker (sync breaker off the event loop)
+# ============================================================================
+
+def _breaker_blocks() -> bool:
+    """The Redis backend may run an EVALSHA per call; the memory backend never blocks"""
+    return CONFIG['CIRCUIT_BREAKER_BACKEND'] == 'redis'
+
+async def check_circuit_breaker(vnf_instance_id: str) -> bool:
+    """vnf_broker_enhanced.check_circuit_breaker without blocking the event loop"""
+    if not _breaker_blocks():
+        return broker.check_circuit_breaker(vnf_instance_id)
+    allowed = await asyncio.to_thread(broker.check_circuit_breaker, vnf_instance_id)
+    if allowed:
+        # to_thread runs in a copy of the context; start the call timer here
+        broker._vnf_call_started.set((vnf_instance_id, time.monotonic()))
+    return allowed
+
+async def record_circuit_breaker_success(vnf_instance_id: str, duration: Optional[float] = None):
+    """vnf_broker_enhanced.record_circuit_breaker_success without blocking the event loop"""
+    duration = broker._call_duration(vnf_instance_id, duration)
+    if _breaker_blocks():
+        await asyncio.to_thread(broker.record_circuit_breaker_success, vnf_instance_id, duration)
+    else:
+        broker.record_circuit_breaker_success(vnf_instance_id, duration)
+
+async def record_circuit_breaker_failure(vnf_instance_id: str, duration: Optional[float] = None):
+    """vnf_broker_enhanced.record_circuit_breaker_failure without blocking the event loop"""
+    duration = broker._call_duration(vnf_instance_id, duration)
+    if _breaker_blocks():
+        await asyncio.to_thread(broker.record_circuit_breaker_failure, vnf_instance_id, duration)
+    else:
+        broker.record_circuit_breaker_failure(vnf_instance_id, duration)
+
+# ============================================================================
+# VNF Operations (async vendor I/O)
+# ============================================================================
+
+def vnf_api_url(vnf_instance_id: str) -> Optional[str]:
+    """Appliance API base URL from VNF_API_ENDPOINTS (None = not mapped, or no vendor client)"""
+    base = CONFIG['VNF_API_ENDPOINTS'].get(vnf_instance_id)
+    if base is None or vendor_client is None:
+        return None
+    return base.rstrip('/')
+
+async def apply_firewall_rule(req_data: CreateFirewallRuleRequest, request_id: str) -> Dict:
+    """Push a firewall rule to the VNF instance through the shared vendor client"""
+    base = vnf_api_url(req_data.vnfInstanceId)
+    if base is None:
+        # Unmapped instance: the enhanced module's placeholder, off the event loop
+        return await asyncio.to_thread(broker.apply_firewall_rule, req_data, request_id)
+    response = await vendor_client.post(f"{base}/firewall/rules", json=firewall_rule_record(req_data),
+                                        headers={'X-Request-ID': request_id})
+    response.raise_for_status()
+    return {
+        'success': True,
+        'ruleId': req_data.ruleId,
+        'vnfInstanceId': req_data.vnfInstanceId,
+        'status': 'created',
+        'timestamp': datetime.now().isoformat(),
+        'request_id': request_id
+    }
+
+async def fetch_firewall_rules(vnf_instance_id: str, request_id: str) -> AsyncIterator[Dict]:
+    """
+    Stream the firewall rules of a VNF instance
+
+    The appliance's list response is decoded one rule at a time at
+    VNF_RULES_LIST_PATH (rule_listing.aiter_json_items), as it arrives.
+    """
+    base = vnf_api_url(vnf_instance_id)
+    if base is None:
+        for rule in await asyncio.to_thread(lambda: list(broker.fetch_firewall_rules(vnf_instance_id, request_id))):
+            yield rule
+        return
+    async with vendor_client.stream('GET', f"{base}/firewall/rules", headers={'X-Request-ID': request_id}) as response:
+        response.raise_for_status()
+        async for rule in aiter_json_items(response.aiter_bytes(), CONFIG['VNF_RULES_LIST_PATH']):
+            yield rule
+
+async def _aiter_rules(rules: Iterable[Dict], rest: Optional[AsyncIterator[Dict]] = None) -> AsyncIterator[Dict]:
+    try:
+        for rule in rules:
+            yield rule
+        if rest is not None:
+            async for rule in rest:
+                yield rule
+    finally:
+        if rest is not None:
+            await rest.aclose()
+
+async def fetch_rule_inventory(vnf_instance_id: str,
+                               request_id: str) -> Tuple[Optional[InventorySnapshot], AsyncIterator[Dict]]:
+    """Async counterpart of vnf_broker_enhanced.fetch_rule_inventory"""
+    inventory = get_rule_inventory(refresh=False)
+    rules = fetch_firewall_rules(vnf_instance_id, request_id)
+    if inventory is None:
+        return None, rules
+    token = inventory.fetch_token(vnf_instance_id)
+    head = []
+    try:
+        async for rule in rules:
+            head.append(rule)
+            if len(head) > inventory.max_rules:
+                inventory.invalidate(vnf_instance_id)
+                return None, _aiter_rules(head, rules)
+    except BaseException:
+        await rules.aclose()
+        raise
+    return inventory.replace(vnf_instance_id, head, token), _aiter_rules(head)
+
+async def refresh_rule_inventory(vnf_instance_id: str):
+    """Re-fetch one cached VNF (skipped while its breaker is open)"""
+    async with get_bulkhead().slot(vnf=vnf_instance_id):
+        if not await check_circuit_breaker(vnf_instance_id):
+            return
+        started = time.monotonic()
+        try:
+            _, rules = await fetch_rule_inventory(vnf_instance_id, 'inventory-refresh')
+        except Exception:
+            await record_circuit_breaker_failure(vnf_instance_id, time.monotonic() - started)
+            raise
+        await rules.aclose()
+        await record_circuit_breaker_success(vnf_instance_id, time.monotonic() - started)
+
+async def refresh_rule_inventories():
+    """Background task: re-fetch cached VNFs every RULE_INVENTORY_REFRESH_INTERVAL"""
+    while True:
+        interval = CONFIG['RULE_INVENTORY_REFRESH_INTERVAL']
+        await asyncio.sleep(min(interval, 5.0))
+        inventory = get_rule_inventory(refresh=False)
+        if inventory is None:
+            continue
+        for vnf_instance_id in inventory.due_for_refresh(interval):
+            try:
+                await refresh_rule_inventory(vnf_instance_id)
+            except Exception as e:
+                # Left as is: served until RULE_INVENTORY_MAX_AGE, then listed live
+                logger.warning(f"Rule inventory refresh failed for {vnf_instance_id}: {e}")
+
+async def record_rule_write(vnf_instance_id: str, rule: Optional[Dict] = None, removed_rule_id: Optional[str] = None):
+    """Write-through plus cross-worker invalidation (the publish runs off the event loop)"""
+    if update_rule_inventory(vnf_instance_id, rule, removed_rule_id):
+        await asyncio.to_thread(publish_rule_inventory_change, vnf_instance_id)
+
+# ============================================================================
+# Request Decorators
+# ============================================================================
+
+def _new_request_id(request: Request) -> str:
+    client_host = request.client.host if request.client else ''
+    return hashlib.sha256(f"{time.time()}:{client_host}".encode()).hexdigest()[:8]
+
+def require_auth(f):
+    """Decorator to require JWT authentication"""
+    @wraps(f)
+    async def decorated_function(request: Request):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return JSONResponse({'error': 'Unauthorized', 'message': 'Missing or invalid Authorization header'}, 401)
+
+        token = auth_header.split(' ', 1)[1]
+        # Signature checks on a JWT cache miss are CPU-bound: keep them off the loop
+        jwt_payload = await asyncio.to_thread(broker.validate_jwt, token)
+
+        if not jwt_payload:
+            return JSONResponse({'error': 'Forbidden', 'message': 'Invalid or expired JWT token'}, 403)
+
+        request.state.jwt_payload = jwt_payload
+        return await f(request)
+
+    return decorated_function
+
+def rate_limit(f):
+    """Decorator to enforce rate limiting"""
+    @wraps(f)
+    async def decorated_function(request: Request):
+        jwt_payload = getattr(request.state, 'jwt_payload', None) or {}
+        client_id = jwt_payload.get('sub') or (request.client.host if request.client else 'unknown')
+
+        result = await check_rate_limit(client_id)
+        if not result.allowed:
+            retry_after = max(math.ceil(result.retry_after), 1)
+            response = JSONResponse({
+                'error': 'Rate limit exceeded',
+                'message': f'Too many requests. Retry after {retry_after} seconds.',
+                'retry_after': retry_after
+            }, 429)
+        else:
+            response = await f(request)
+
+        response.headers.update(result.headers())
+        return response
+
+    return decorated_function
+
+def request_subject(request: Request) -> Optional[str]:
+    """JWT subject of the request (the tenant's bulkhead compartment)"""
+    return (getattr(request.state, 'jwt_payload', None) or {}).get('sub')
+
+async def with_bulkhead(vnf_instance_id: str, subject: Optional[str],
+                        call: Callable[[], Awaitable[Tuple[Dict, int]]]) -> Tuple[Dict, int]:
+    """
+    Run one VNF call holding the bulkhead slots of its VNF and tenant
+    (see vnf_broker_enhanced.with_bulkhead)
+
+    Raises:
+        BulkheadRejected: No slot before the deadline (see bulkhead_response)
+    """
+    async with get_bulkhead().slot(vnf=vnf_instance_id, subject=subject):
+        return await call()
+
+def bulkhead_response(e: BulkheadRejected) -> JSONResponse:
+    """Rejection response for a call that got no bulkhead slot"""
+    body, status = bulkhead_rejection(e)
+    return JSONResponse(body, status, headers={'Retry-After': str(e.retry_after)})
+
+async def _parse_model(request: Request, model, request_id: str):
+    """Parse and validate JSON body; returns (model, error_response)"""
+    try:
+        return model(**(await request.json())), None
+    except ValidationError as e:
+        logger.error(f"[{request_id}] Validation error: {e}")
+        return None, JSONResponse({
+            'error': 'Validation error',
+            'message': 'Invalid request data',
+            'details': json.loads(e.json())
+        }, 400)
+    except Exception as e:
+        logger.error(f"[{request_id}] Parse error: {e}")
+        return None, JSONResponse({'error': 'Bad request', 'message': 'Invalid JSON'}, 400)
+
+def _circuit_open_body(vnf_instance_id: str) -> Dict:
+    return {
+        'error': 'Service unavailable',
+        'message': f'Circuit breaker open for VNF instance {vnf_instance_id}',
+        'vnfInstanceId': vnf_instance_id
+    }
+
+def _circuit_open(vnf_instance_id: str) -> JSONResponse:
+    return JSONResponse(_circuit_open_body(vnf_instance_id), 503)
+
+# ============================================================================
+# API Endpoints
+# ============================================================================
+
+async def health_check(request: Request):
+    """Health check with detailed status"""
+    redis_status = 'unknown'
+    redis_latency_ms = None
+
+    try:
+        start = time.time()
+        await redis_client.ping()
+        redis_latency_ms = int((time.time() - start) * 1000)
+        redis_status = 'connected'
+    except Exception as e:
+        redis_status = f'error: {str(e)}'
+
+    return JSONResponse({
+        'status': 'healthy',
+        'service': 'vnf-broker-enhanced',
+        'mode': 'asgi',
+        'version': '1.0.0-build2',
+        'redis': {
+            'status': redis_status,
+            'latency_ms': redis_latency_ms
+        },
+        'timestamp': datetime.now().isoformat()
+    })
+
+async def metrics(request: Request):
+    """Metrics endpoint for monitoring"""
+    circuit_breaker_stats = {}
+    for vnf_id, cb in broker.get_circuit_breaker().snapshot().items():
+        circuit_breaker_stats[vnf_id] = {
+            'state': cb['state'],
+            'failure_count': cb['failures'],
+            'calls': cb['calls'],
+            'failure_rate': cb['failure_rate'],
+            'slow_call_rate': cb['slow_call_rate'],
+            'buckets': cb['buckets']
+        }
+
+    return JSONResponse({
+        'circuit_breakers': circuit_breaker_stats,
+        'jwt_cache': broker.jwt_cache.get_stats(),
+        'rate_limiter': rate_limiter.get_stats() if isinstance(rate_limiter, AsyncLeasedRateLimiter) else None,
+        'bulkhead': get_bulkhead().get_stats(),
+        'single_flight': single_flight.get_stats() if single_flight is not None else None,
+        'idempotency_codec': get_idempotency_codec().get_stats(),
+        'idempotency_near_cache': idempotency_near_cache_stats(),
+        'durable_store': broker.durable_store.get_stats() if broker.durable_store is not None else None,
+        'rule_inventory': rule_inventory_stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+async def metrics_prometheus(request: Request):
+    """Prometheus text-format metrics endpoint"""
+    return Response(content=generate_latest(), status_code=200, media_type=CONTENT_TYPE_LATEST)
+
+@require_auth
+@rate_limit
+async def create_firewall_rule(request: Request):
+    """Create firewall rule with full validation and hardening"""
+    request_id = _new_request_id(request)
+
+    req_data, error = await _parse_model(request, CreateFirewallRuleRequest, request_id)
+    if error:
+        return error
+
+    operation = 'firewall.create'
+    params = req_data.dict()
+
+    cached_response = await check_idempotency(operation, params)
+    if cached_response:
+        logger.info(f"[{request_id}] Idempotent request for rule {req_data.ruleId}")
+        return JSONResponse(cached_response, 200)
+
+    async def execute() -> Tuple[Dict, int]:
+        # After the cache and single-flight, as in vnf_broker_enhanced
+        if not await check_circuit_breaker(req_data.vnfInstanceId):
+            return _circuit_open_body(req_data.vnfInstanceId), 503
+        try:
+            response_data = await apply_firewall_rule(req_data, request_id)
+            await record_circuit_breaker_success(req_data.vnfInstanceId)
+            await store_idempotency(operation, params, response_data)
+            await record_rule_write(req_data.vnfInstanceId, firewall_rule_record(req_data))
+
+            logger.info(f"[{request_id}] Created firewall rule {req_data.ruleId}")
+            return response_data, 201
+
+        except Exception as e:
+            await record_circuit_breaker_failure(req_data.vnfInstanceId)
+            logger.error(f"[{request_id}] Failed to create rule: {e}")
+            return {
+                'error': 'VNF operation failed',
+                'message': str(e),
+                'request_id': request_id
+            }, 502
+
+    subject = request_subject(request)
+    try:
+        body, status = await run_single_flight(
+            operation, params, lambda: with_bulkhead(req_data.vnfInstanceId, subject, execute))
+    except BulkheadRejected as e:
+        return bulkhead_response(e)
+    return JSONResponse(body, status)
+
+async def _apply_firewall_rules_for_vnf(vnf_instance_id: str, items: List[Tuple[int, CreateFirewallRuleRequest]],
+                                        request_id: str, semaphore: asyncio.Semaphore,
+                                        subject: Optional[str] = None) -> List[Tuple[int, Dict, int]]:
+    """Apply one VNF instance's share of a batch in order; returns (index, result, status)"""
+    results = []
+    publish = False
+    async with semaphore:
+        for position, (index, req_data) in enumerate(items):
+            try:
+                async with get_bulkhead().slot(vnf=vnf_instance_id, subject=subject):
+                    admitted = await check_circuit_breaker(vnf_instance_id)
+                    if admitted:
+                        result = await apply_firewall_rule(req_data, request_id)
+                        await record_circuit_breaker_success(vnf_instance_id)
+            except BulkheadRejected as e:
+                body, status = bulkhead_rejection(e)
+                results.append((index, {
+                    'success': False,
+                    'ruleId': req_data.ruleId,
+                    'vnfInstanceId': vnf_instance_id,
+                    **body
+                }, status))
+                continue
+            except Exception as e:
+                await record_circuit_breaker_failure(vnf_instance_id)
+                logger.error(f"[{request_id}] Failed to create rule {req_data.ruleId}: {e}")
+                results.append((index, {
+                    'success': False,
+                    'ruleId': req_data.ruleId,
+                    'vnfInstanceId': vnf_instance_id,
+                    'error': 'VNF operation failed',
+                    'message': str(e)
+                }, 502))
+                continue
+
+            if not admitted:
+                for skipped_index, skipped in items[position:]:
+                    results.append((skipped_index, {
+                        'success': False,
+                        'ruleId': skipped.ruleId,
+                        'vnfInstanceId': vnf_instance_id,
+                        'error': 'Service unavailable',
+                        'message': f'Circuit breaker open for VNF instance {vnf_instance_id}'
+                    }, 503))
+                break
+            results.append((index, result, 201))
+            publish = update_rule_inventory(vnf_instance_id, firewall_rule_record(req_data)) or publish
+    if publish:
+        await asyncio.to_thread(publish_rule_inventory_change, vnf_instance_id)
+    return results
+
+@require_auth
+@rate_limit
+async def create_firewall_rules_batch(request: Request):
+    """Create many firewall rules in one request (see vnf_broker_enhanced)"""
+    request_id = _new_request_id(request)
+
+    try:
+        body = await request.json()
+    except Exception:
+        body = None
+    rules = body.get('rules') if isinstance(body, dict) else body
+    if not isinstance(rules, list) or not rules:
+        return JSONResponse({'error': 'Bad request', 'message': 'Expected a non-empty "rules" array'}, 400)
+    if len(rules) > CONFIG['BATCH_MAX_ITEMS']:
+        return JSONResponse({'error': 'Bad request', 'message': f"Batch exceeds {CONFIG['BATCH_MAX_ITEMS']} rules"}, 400)
+
+    BATCH_SIZE.observe(len(rules))
+
+    batch = FirewallBatch(rules)
+    batch.apply_cached(await check_idempotency_many(batch.operation, batch.params_list))
+
+    semaphore = asyncio.Semaphore(max(1, CONFIG['BATCH_MAX_CONCURRENCY']))
+    subject = (getattr(request.state, 'jwt_payload', None) or {}).get('sub')
+    groups = await asyncio.gather(*[
+        _apply_firewall_rules_for_vnf(vnf_id, items, request_id, semaphore, subject)
+        for vnf_id, items in batch.pending.items()
+    ])
+    for outcomes in groups:
+        batch.record(outcomes)
+
+    await store_idempotency_many(batch.operation, batch.finalize())
+    return JSONResponse(batch.response(request_id), 200)
+
+@require_auth
+@rate_limit
+async def create_nat_rule(request: Request):
+    """Create NAT rule with validation"""
+    request_id = _new_request_id(request)
+
+    req_data, error = await _parse_model(request, CreateNATRuleRequest, request_id)
+    if error:
+        return error
+
+    operation = 'nat.create'
+    params = req_data.dict()
+
+    cached_response = await check_idempotency(operation, params)
+    if cached_response:
+        return JSONResponse(cached_response, 200)
+
+    async def execute() -> Tuple[Dict, int]:
+        if not await check_circuit_breaker(req_data.vnfInstanceId):
+            return _circuit_open_body(req_data.vnfInstanceId), 503
+        response_data = {
+            'success': True,
+            'ruleId': req_data.ruleId,
+            'vnfInstanceId': req_data.vnfInstanceId,
+            'natType': req_data.natType,
+            'status': 'created',
+            'timestamp': datetime.now().isoformat(),
+            'request_id': request_id
+        }
+
+        await record_circuit_breaker_success(req_data.vnfInstanceId)
+        await store_idempotency(operation, params, response_data)
+
+        logger.info(f"[{request_id}] Created NAT rule {req_data.ruleId}")
+        return response_data, 201
+
+    subject = request_subject(request)
+    try:
+        body, status = await run_single_flight(
+            operation, params, lambda: with_bulkhead(req_data.vnfInstanceId, subject, execute))
+    except BulkheadRejected as e:
+        return bulkhead_response(e)
+    return JSONResponse(body, status)
+
+@require_auth
+@rate_limit
+async def update_firewall_rule(request: Request):
+    """Update existing firewall rule"""
+    request_id = _new_request_id(request)
+    rule_id = request.path_params['rule_id']
+
+    req_data, error = await _parse_model(request, CreateFirewallRuleRequest, request_id)
+    if error:
+        return error
+
+    async def execute() -> Tuple[Dict, int]:
+        if not await check_circuit_breaker(req_data.vnfInstanceId):
+            return _circuit_open_body(req_data.vnfInstanceId), 503
+
+        response_data = {
+            'success': True,
+            'ruleId': rule_id,
+            'vnfInstanceId': req_data.vnfInstanceId,
+            'status': 'updated',
+            'timestamp': datetime.now().isoformat(),
+            'request_id': request_id
+        }
+
+        await record_circuit_breaker_success(req_data.vnfInstanceId)
+        await record_rule_write(req_data.vnfInstanceId, firewall_rule_record(req_data, rule_id))
+        logger.info(f"[{request_id}] Updated firewall rule {rule_id}")
+        return response_data, 200
+
+    try:
+        body, status = await with_bulkhead(req_data.vnfInstanceId, request_subject(request), execute)
+    except BulkheadRejected as e:
+        return bulkhead_response(e)
+    return JSONResponse(body, status)
+
+@require_auth
+@rate_limit
+async def delete_firewall_rule(request: Request):
+    """Delete firewall rule"""
+    request_id = _new_request_id(request)
+    rule_id = request.path_params['rule_id']
+
+    vnf_instance_id = request.query_params.get('vnfInstanceId')
+    if not vnf_instance_id and request.headers.get('content-type', '').startswith('application/json'):
+        try:
+            vnf_instance_id = (await request.json()).get('vnfInstanceId')
+        except Exception:
+            vnf_instance_id = None
+
+    if not vnf_instance_id:
+        return JSONResponse({
+            'error': 'Bad request',
+            'message': 'vnfInstanceId is required (query param or body)'
+        }, 400)
+
+    async def execute() -> Tuple[Dict, int]:
+        if not await check_circuit_breaker(vnf_instance_id):
+            return _circuit_open_body(vnf_instance_id), 503
+
+        response_data = {
+            'success': True,
+            'ruleId': rule_id,
+            'vnfInstanceId': vnf_instance_id,
+            'status': 'deleted',
+            'timestamp': datetime.now().isoformat(),
+            'request_id': request_id
+        }
+
+        await record_circuit_breaker_success(vnf_instance_id)
+        await record_rule_write(vnf_instance_id, removed_rule_id=rule_id)
+        logger.info(f"[{request_id}] Deleted firewall rule {rule_id}")
+        return response_data, 200
+
+    try:
+        body, status = await with_bulkhead(vnf_instance_id, request_subject(request), execute)
+    except BulkheadRejected as e:
+        return bulkhead_response(e)
+    return JSONResponse(body, status)
+
+async def _collect_page(rules: AsyncIterator[Dict], pager: RulePager) -> List[Dict]:
+    """Async counterpart of rule_listing.paginate"""
+    page = []
+    try:
+        async for rule in rules:
+            if pager.accept(rule):
+                page.append(rule)
+            if pager.done:
+                break
+    finally:
+        await rules.aclose()
+    return page
+
+async def _stream_rules_ndjson(vnf_instance_id: str, rules: AsyncIterator[Dict], pager: RulePager,
+                               request_id: str, started: Optional[float] = None) -> AsyncIterator[bytes]:
+    """Async counterpart of vnf_broker_enhanced.stream_rules_ndjson"""
+    try:
+        async for rule in rules:
+            if pager.accept(rule):
+                yield ndjson_line(rule)
+            if pager.done:
+                break
+        if started is not None:
+            await record_circuit_breaker_success(vnf_instance_id, time.monotonic() - started)
+        logger.info(f"[{request_id}] Streamed {pager.count} firewall rules for {vnf_instance_id}")
+        yield ndjson_line({'_meta': {
+            'success': True,
+            'vnfInstanceId': vnf_instance_id,
+            'count': pager.count,
+            'nextCursor': pager.next_cursor,
+            'request_id': request_id
+        }})
+    except Exception as e:
+        if started is not None:
+            await record_circuit_breaker_failure(vnf_instance_id, time.monotonic() - started)
+        logger.error(f"[{request_id}] Failed to stream rules: {e}")
+        yield ndjson_line({'error': 'VNF operation failed', 'message': str(e), 'request_id': request_id})
+    finally:
+        await rules.aclose()
+
+@require_auth
+@rate_limit
+async def list_firewall_rules(request: Request):
+    """List firewall rules for a VNF instance (query parameters as in vnf_broker_enhanced)"""
+    request_id = _new_request_id(request)
+
+    vnf_instance_id = request.query_params.get('vnfInstanceId')
+    if not vnf_instance_id:
+        return JSONResponse({
+            'error': 'Bad request',
+            'message': 'vnfInstanceId query parameter is required'
+        }, 400)
+
+    try:
+        rule_filter, limit, cursor, ndjson = parse_list_query(request.query_params)
+        pager = RulePager(rule_filter, limit, cursor)
+    except ValueError as e:
+        return JSONResponse({'error': 'Bad request', 'message': str(e)}, 400)
+
+    async with AsyncExitStack() as vnf_slot:
+        inventory = get_rule_inventory(refresh=False)
+        snapshot = inventory.get(vnf_instance_id) if inventory is not None else None
+        started = None
+        if snapshot is not None:
+            count_rule_inventory_lookup('hit')
+        else:
+            # Only a list that reaches the appliance takes a bulkhead slot
+            try:
+                await vnf_slot.enter_async_context(
+                    get_bulkhead().slot(vnf=vnf_instance_id, subject=request_subject(request)))
+            except BulkheadRejected as e:
+                return bulkhead_response(e)
+
+            if not await check_circuit_breaker(vnf_instance_id):
+                return _circuit_open(vnf_instance_id)
+
+            started = time.monotonic()
+            try:
+                snapshot, rules = await fetch_rule_inventory(vnf_instance_id, request_id)
+            except Exception as e:
+                await record_circuit_breaker_failure(vnf_instance_id, time.monotonic() - started)
+                logger.error(f"[{request_id}] Failed to list rules: {e}")
+                return JSONResponse({
+                    'error': 'VNF operation failed',
+                    'message': str(e),
+                    'request_id': request_id
+                }, 502)
+            if snapshot is not None:
+                await record_circuit_breaker_success(vnf_instance_id, time.monotonic() - started)
+                started = None
+                await vnf_slot.aclose()
+            count_rule_inventory_lookup('miss')
+
+        headers = {}
+        if snapshot is not None:
+            headers['ETag'] = list_etag(snapshot.version, request.query_params)
+            if etag_matches(request.headers.get('If-None-Match'), headers['ETag']):
+                count_rule_inventory_lookup('not_modified')
+                return Response(status_code=304, headers=headers)
+            rules = _aiter_rules(snapshot.rules)
+
+        if ndjson:
+            # The VNF is read while the body streams: release the slot when it is done
+            return StreamingResponse(
+                _stream_rules_ndjson(vnf_instance_id, rules, pager, request_id, started),
+                media_type='application/x-ndjson',
+                headers=headers,
+                background=BackgroundTask(vnf_slot.pop_all().aclose)
+            )
+
+        try:
+            page = await _collect_page(rules, pager)
+        except Exception as e:
+            if started is not None:
+                await record_circuit_breaker_failure(vnf_instance_id)
+            logger.error(f"[{request_id}] Failed to list rules: {e}")
+            return JSONResponse({
+                'error': 'VNF operation failed',
+                'message': str(e),
+                'request_id': request_id
+            }, 502)
+
+        response_data = {
+            'success': True,
+            'vnfInstanceId': vnf_instance_id,
+            'rules': page,
+            'count': len(page),
+            'nextCursor': pager.next_cursor,
+            'timestamp': datetime.now().isoformat(),
+            'request_id': request_id
+        }
+
+        if started is not None:
+            await record_circuit_breaker_success(vnf_instance_id)
+        logger.info(f"[{request_id}] Listed {len(page)} firewall rules for {vnf_instance_id}")
+        return JSONResponse(response_data, 200, headers=headers)
+
+# ============================================================================
+# Application
+# ============================================================================
+
+routes = [
+    Route('/health', health_check, methods=['GET']),
+    Route('/metrics', metrics, methods=['GET']),
+    Route('/metrics.prom', metrics_prometheus, methods=['GET']),
+    Route('/api/vnf/firewall/create', create_firewall_rule, methods=['POST']),
+    Route('/api/vnf/firewall/batch', create_firewall_rules_batch, methods=['POST']),
+    Route('/api/vnf/nat/create', create_nat_rule, methods=['POST']),
+    Route('/api/vnf/firewall/update/{rule_id}', update_firewall_rule, methods=['PUT']),
+    Route('/api/vnf/firewall/delete/{rule_id}', delete_firewall_rule, methods=['DELETE']),
+    Route('/api/vnf/firewall/list', list_firewall_rules, methods=['GET']),
+]
+
+async def record_metrics(request: Request, call_next):
+    """Per-request Prometheus metrics (same series as the Flask app)"""
+    start = time.time()
+    response = await call_next(request)
+    try:
+        endpoint = request.url.path
+        HTTP_REQUESTS.labels(method=request.method, endpoint=endpoint, status=str(response.status_code)).inc()
+        HTTP_LATENCY.labels(endpoint=endpoint).observe(max(0.0, time.time() - start))
+    except Exception:
+        # Metrics should never break the request flow
+        pass
+    return response
+
+async def handle_exception(request: Request, exc: Exception):
+    """Global exception handler with structured errors"""
+    logger.exception("Unhandled exception")
+    return JSONResponse({
+        'error': 'Internal server error',
+        'message': str(exc) if CONFIG['DEBUG'] else 'An unexpected error occurred',
+        'timestamp': datetime.now().isoformat()
+    }, 500)
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(BaseHTTPMiddleware, dispatch=record_metrics)],
+    exception_handlers={Exception: handle_exception},
+    lifespan=lifespan
+)
+
+# ============================================================================
+# Main Entry Point
+# ============================================================================
+
+def main():
+    """Start broker under uvicorn"""
+    import uvicorn
+
+    broker.load_config()
+    uvicorn.run(
+        app,
+        host=CONFIG['BROKER_HOST'],
+        port=CONFIG['BROKER_PORT'],
+        log_level='debug' if CONFIG['DEBUG'] else 'info'
+    )
+
+if __name__ == '__main__':
+    main()
@@ -35,10 +35,14 @@ import hashlib
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import requests
 import redis
 from redis.connection import ConnectionPool
+
+from redis_topology import create_redis_client, describe_topology, hash_tag
+import proxy_stream
+from http_sessions import SessionRegistry
 import jwt
 from cryptography.hazmat.primitives import serialization
 
@@ -48,11 +52,16 @@ CONFIG = {
     'BROKER_HOST': '0.0.0.0',
     'JWT_PUBLIC_KEY_PATH': '/etc/vnf-broker/jwt_public.pem',
     'JWT_ALGORITHM': 'RS256',  # RS256 per Build1 requirement
+    'REDIS_MODE': 'standalone',  # standalone | sentinel | cluster
     'REDIS_HOST': 'localhost',
     'REDIS_PORT': 6379,
     'REDIS_DB': 0,
     'REDIS_PASSWORD': None,
     'REDIS_MAX_CONNECTIONS': 10,
+    'REDIS_SENTINELS': [],  # [[host, port], ...] (sentinel mode)
+    'REDIS_SENTINEL_SERVICE': 'mymaster',
+    'REDIS_SENTINEL_PASSWORD': None,
+    'REDIS_CLUSTER_NODES': [],  # [[host, port], ...] startup nodes (cluster mode)
     'IDEMPOTENCY_TTL_SECONDS': 86400,  # 24 hours
     'ALLOWED_MANAGEMENT_IPS': [],
     'ALLOWED_VNF_IPS': [],
@@ -60,6 +69,13 @@ CONFIG = {
     'TLS_KEY_PATH': '/etc/vnf-broker/server.key',
     'LOG_FILE': '/var/log/vnf-broker/broker.log',
     'REQUEST_TIMEOUT': 30,
+    'PROXY_STREAM_CHUNK_SIZE': 65536,  # bytes relayed per chunk in streaming proxy mode
+    'PROXY_POOL_MAXSIZE': 10,  # keep-alive connections per appliance
+    'PROXY_POOL_BLOCK': False,  # wait for a free connection instead of opening an extra one
+    'PROXY_MAX_RETRIES': 2,  # retries of failed connects (and 502/503/504 on idempotent methods)
+    'PROXY_RETRY_BACKOFF': 0.5,  # exponential backoff base (seconds)
+    'PROXY_RETRY_STATUSES': [502, 503, 504],
+    'PROXY_SESSION_IDLE_TIMEOUT': 300,  # seconds an unused appliance session stays open
     'DEBUG': False
 }
 
@@ -81,6 +97,9 @@ app = Flask(__name__)
 redis_pool: Optional[ConnectionPool] = None
 redis_client: Optional[redis.Redis] = None
 
+# Keep-alive HTTP sessions per appliance (see get_http_sessions)
+http_sessions: Optional[SessionRegistry] = None
+
 def load_config():
     """Load configuration from file"""
     config_file = '/etc/vnf-broker/config.json'
@@ -93,31 +112,23 @@ def load_config():
         logger.warning(f"Config file {config_file} not found, using defaults")
 
 def init_redis():
-    """Initialize Redis connection pool"""
+    """
+    Create the Redis client for REDIS_MODE (standalone, sentinel or cluster)
+    
+    The client connects on first use, so a Redis outage at startup does not
+    stop the broker; idempotency fails open until Redis is back.
+    """
     global redis_pool, redis_client
     
+    redis_client = create_redis_client(CONFIG)  # decode_responses=True
+    redis_pool = getattr(redis_client, 'connection_pool', None) if CONFIG['REDIS_MODE'] != 'cluster' else None
+    
+    # Test connection
     try:
-        redis_pool = ConnectionPool(
-            host=CONFIG['REDIS_HOST'],
-            port=CONFIG['REDIS_PORT'],
-            db=CONFIG['REDIS_DB'],
-            password=CONFIG['REDIS_PASSWORD'],
-            max_connections=CONFIG['REDIS_MAX_CONNECTIONS'],
-            decode_responses=True,  # Auto-decode bytes to str
-            socket_connect_timeout=5,
-            socket_keepalive=True
-        )
-        
-        redis_client = redis.Redis(connection_pool=redis_pool)
-        
-        # Test connection
         redis_client.ping()
-        logger.info(f"Redis connection established: {CONFIG['REDIS_HOST']}:{CONFIG['REDIS_PORT']}")
-        
-    except redis.ConnectionError as e:
-        logger.error(f"Failed to connect to Redis: {e}")
-        logger.error("Broker will not start without Redis - per Build1 requirements")
-        sys.exit(1)
+        logger.info(f"Redis connection established: {describe_topology(CONFIG)}")
+    except redis.RedisError as e:
+        logger.error(f"Redis unavailable at startup ({describe_topology(CONFIG)}), will retry on use: {e}")
 
 def load_jwt_public_key():
     """Load RSA public key for JWT verification"""
@@ -169,13 +180,13 @@ def validate_jwt(token: str) -> Optional[Dict]:
 def compute_idempotency_key(operation: str, params: Dict) -> str:
     """
     Compute idempotency key for request
-    Format: idempotency:<operation>:<sha256_hash_of_params>
+    Format: idempotency:<operation>:{<sha256_hash_of_params>} (hash tag = cluster slot)
     """
     # Sort params for consistent hashing
     params_str = json.dumps(params, sort_keys=True)
     params_hash = hashlib.sha256(params_str.encode()).hexdigest()[:16]
     
-    return f"idempotency:{operation}:{params_hash}"
+    return f"idempotency:{operation}:{hash_tag(params_hash)}"
 
 def check_idempotency(operation: str, params: Dict) -> Optional[Dict]:
     """
@@ -212,6 +223,22 @@ def store_idempotency(operation: str, params: Dict, response: Dict):
         logger.error(f"Redis error storing idempotency: {e}")
         # Non-fatal - continue without caching
 
+def get_http_sessions() -> SessionRegistry:
+    """Get the per-appliance HTTP session registry, created with its idle reaper on first use"""
+    global http_sessions
+    if http_sessions is None:
+        http_sessions = SessionRegistry(
+            pool_maxsize=CONFIG['PROXY_POOL_MAXSIZE'],
+            pool_block=CONFIG['PROXY_POOL_BLOCK'],
+            max_retries=CONFIG['PROXY_MAX_RETRIES'],
+            backoff_factor=CONFIG['PROXY_RETRY_BACKOFF'],
+            retry_statuses=CONFIG['PROXY_RETRY_STATUSES'],
+            idle_timeout=CONFIG['PROXY_SESSION_IDLE_TIMEOUT'],
+            verify=False  # VNF devices often use self-signed certs
+        )
+        http_sessions.start()
+    return http_sessions
+
 def proxy_http_request(target_ip: str, method: str, uri: str, 
                        headers: Dict, body: Optional[str]) -> Dict:
     """
@@ -227,13 +254,13 @@ def proxy_http_request(target_ip: str, method: str, uri: str,
     start_time = time.time()
     
     try:
-        response = requests.request(
+        response = get_http_sessions().request(
+            target_ip,
             method=method,
             url=url,
             headers=headers_copy,
             data=body,
-            timeout=CONFIG['REQUEST_TIMEOUT'],
-            verify=False  # VNF devices often use self-signed certs
+            timeout=CONFIG['REQUEST_TIMEOUT']
         )
         
         duration_ms = int((time.time() - start_time) * 1000)
@@ -263,6 +290,39 @@ def proxy_http_request(target_ip: str, method: str, uri: str,
             'duration_ms': int((time.time() - start_time) * 1000)
         }
 
+def proxy_http_stream(target_ip: str, method: str, uri: str,
+                      headers: Dict, body: Optional[str]) -> Response:
+    """
+    Proxy HTTP/HTTPS request to VNF device, relaying the response as is
+    (status, headers and body bytes, streamed - see proxy_stream)
+    """
+    url = f"https://{target_ip}{uri}"
+    
+    headers_copy = headers.copy()
+    headers_copy.pop('Host', None)
+    headers_copy.pop('Content-Length', None)
+    
+    start_time = time.time()
+    
+    try:
+        upstream = get_http_sessions().request(
+            target_ip,
+            method=method,
+            url=url,
+            headers=headers_copy,
+            data=body,
+            timeout=CONFIG['REQUEST_TIMEOUT'],
+            stream=True
+        )
+    except requests.Timeout:
+        logger.error(f"Timeout connecting to {target_ip}")
+        return proxy_stream.error_response(504, 'Gateway Timeout', int((time.time() - start_time) * 1000))
+    except requests.RequestException as e:
+        logger.error(f"Error connecting to {target_ip}: {e}")
+        return proxy_stream.error_response(502, f'Bad Gateway: {str(e)}', int((time.time() - start_time) * 1000))
+    
+    return proxy_stream.streaming_response(upstream, target_ip, start_time, CONFIG['PROXY_STREAM_CHUNK_SIZE'])
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint with Redis status"""
@@ -277,6 +337,7 @@ def health_check():
         'status': 'healthy',
         'service': 'vnf-broker',
         'redis': redis_status,
+        'http_sessions': http_sessions.get_stats() if http_sessions is not None else None,
         'timestamp': datetime.now().isoformat()
     })
 
@@ -384,7 +445,7 @@ def main():
     
     logger.info(f"Starting VNF Broker with Redis idempotency on port {CONFIG['BROKER_PORT']}")
     logger.info(f"JWT Algorithm: {CONFIG['JWT_ALGORITHM']} (RS256)")
-    logger.info(f"Redis: {CONFIG['REDIS_HOST']}:{CONFIG['REDIS_PORT']}")
+    logger.info(f"Redis: {describe_topology(CONFIG)}")
     logger.info(f"Idempotency TTL: {CONFIG['IDEMPOTENCY_TTL_SECONDS']}s (24h)")
     
     # Run Flask (production deployment should use gunicorn/uwsgi)